@@ -41,8 +41,8 @@ def getData(query_params, payload):
         raise tarp.server.OperationInProgress("Data is still being generated. Please wait a moment.", retry_after=10)
     #If the data is ready then return it as a JSON payload
     #This is a simple example, but you could return any data structure that can be serialized
-    #to JSON, such as a list or dictionary.
-    return {'x': x.tolist(), 'y': y.tolist()}
+    #to JSON, such as a list or dictionary. NumPy arrays can go in as they are
+    return {'x': x, 'y': y}
 
 def showFigure(query_params, payload):
     """Displays the generated figure."""
@@ -91,10 +91,12 @@ server.addAsyncRPCEndpoint('asyncRPCExample', rpcExample, suggested_wait=10)
 
 
 # Register endpoints for HTML interface
+#The data and figure only change when generateData is called, so they are cached
+#until then rather than being recomputed on every request
 server.addPostEndpoint('setRange', setRange)
-server.addGetEndpoint('generateData', generateData)
-server.addGetEndpoint('getData', getData)
-server.addGetEndpoint('showFigure', showFigure)
+server.addGetEndpoint('generateData', generateData, invalidates=['getData', 'showFigure'])
+server.addGetEndpoint('getData', getData, cache=True)
+server.addGetEndpoint('showFigure', showFigure, cache=True)
 
 #Parse the command line arguments for 
 # 1) Secure connection (--secure)
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+# Compares the two RPC wire formats for a range of payload sizes.
+# "json" is the original format: a pickle, base64 encoded and wrapped in JSON.
+# "frames" is the framed binary format from tarp.wire.
+# For each size this reports the number of bytes that would go on the wire and
+# the CPU time needed to encode the payload on one side and decode it on the other.
+import argparse
+import base64
+import json
+import pickle
+import time
+
+import tarp.wire
+
+def parse_size(text):
+    """Parses sizes like 1K, 16M or 1G into a number of bytes."""
+    units = {'K': 1024, 'M': 1024**2, 'G': 1024**3}
+    text = text.strip().upper()
+    if text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+def json_roundtrip(obj):
+    start = time.process_time()
+    body = json.dumps({'payload': base64.b64encode(pickle.dumps(obj)).decode('utf-8')}).encode('utf-8')
+    encoded = time.process_time()
+    pickle.loads(base64.b64decode(json.loads(body.decode('utf-8'))['payload']))
+    decoded = time.process_time()
+    return len(body), encoded - start, decoded - encoded
+
+def frames_roundtrip(obj):
+    start = time.process_time()
+    body = tarp.wire.dumps(obj)
+    encoded = time.process_time()
+    #The server writes the frames to the socket one by one, joining them here
+    #stands in for the socket and is not counted
+    data = bytes(body)
+    decode_start = time.process_time()
+    tarp.wire.loads(data)
+    decoded = time.process_time()
+    return len(body), encoded - start, decoded - decode_start
+
+parser = argparse.ArgumentParser(description='Compare the JSON and framed binary RPC wire formats.')
+parser.add_argument('--sizes', type=str, default='1K,16K,1M,16M,256M,1G', help='Comma separated payload sizes (default: 1K,16K,1M,16M,256M,1G)')
+parser.add_argument('--json', action='store_true', help='Print the results as JSON')
+args = parser.parse_args()
+
+results = []
+for size in [parse_size(s) for s in args.sizes.split(',')]:
+    payload = bytes(size)
+    for name, roundtrip in (('json', json_roundtrip), ('frames', frames_roundtrip)):
+        wire_bytes, encode_time, decode_time = roundtrip(payload)
+        results.append({'format': name, 'payload_bytes': size, 'wire_bytes': wire_bytes,
+                        'encode_cpu_s': encode_time, 'decode_cpu_s': decode_time})
+    del payload
+
+if args.json:
+    print(json.dumps(results, indent=2))
+else:
+    print(f"{'format':>8} {'payload':>12} {'wire bytes':>12} {'overhead':>9} {'encode s':>10} {'decode s':>10}")
+    for r in results:
+        overhead = 100.0 * (r['wire_bytes'] - r['payload_bytes']) / r['payload_bytes']
+        print(f"{r['format']:>8} {r['payload_bytes']:>12} {r['wire_bytes']:>12} {overhead:>8.1f}% {r['encode_cpu_s']:>10.4f} {r['decode_cpu_s']:>10.4f}")
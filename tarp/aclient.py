@@ -0,0 +1,546 @@
+#   Copyright 2025 Chris Brady, Heather Ratcliffe
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+# asyncio version of tarp.client. Every remote endpoint becomes a coroutine,
+# so calls to many endpoints or many servers can be overlapped from one thread.
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+import asyncio
+import contextlib
+import json
+import ssl
+import base64
+import pickle
+import time
+from . import wire
+from . import compress
+from . import jsonenc
+from . import arrays
+from . import shm
+from .client import OperationInProgress, InvalidServerState, activeTimer, timePhase, timedCall
+from .client import METHOD_KINDS, MANIFEST_DIRECTORY, readManifest, writeManifest, sharedMemoryInfo, packFrames, framedLength
+from .client import UNIX_URL, unixSocketPath
+
+#aiohttp trace callbacks that mark where each phase of a call starts and ends
+#(see tarp.client.CLIENT_PHASES). Sending the request is finished once its last
+#part has been written, so the time up to each part written counts as sending
+#and the time after it as waiting
+async def traceConnect(session, context, params):
+    timePhase('connect')
+
+async def traceConnected(session, context, params):
+    timePhase('send')
+
+async def traceSent(session, context, params):
+    timer = activeTimer.get()
+    if timer is not None:
+        timer.phase = 'send'
+        timer.switch('wait')
+
+async def traceResponse(session, context, params):
+    timePhase('receive')
+
+def timingTrace():
+    """Returns an aiohttp.TraceConfig that times the phases of calls."""
+    trace = aiohttp.TraceConfig()
+    trace.on_request_start.append(traceConnect)
+    trace.on_connection_create_end.append(traceConnected)
+    trace.on_connection_reuseconn.append(traceConnected)
+    trace.on_request_headers_sent.append(traceSent)
+    trace.on_request_chunk_sent.append(traceSent)
+    trace.on_request_end.append(traceResponse)
+    return trace
+
+class client:
+
+    class asyncResult:
+        """A class to represent an asynchronous function call. Awaiting it waits
+        for the result."""
+        def __init__(self, client, ID):
+            self.client = client
+            self.ID = ID
+
+        def __await__(self):
+            return self.wait().__await__()
+
+        async def wait(self):
+            """Wait for the asynchronous operation to complete."""
+            return await self.client.wait(self.ID)
+
+        async def probe(self):
+            """Check the status of the asynchronous operation."""
+            return await self.client.probe(self.ID)
+
+        async def waitCycle(self):
+            """Wait for the asynchronous operation to complete, checking status periodically."""
+            pb = await self.probe()
+            if pb['status'] == 'in_progress' and self.client.useLongPoll:
+                #The server holds the probe open until the operation finishes,
+                #so the result is available as soon as it is ready
+                pb = await self.client.probe(self.ID, timeout=pb['suggested_wait'])
+                if pb['status'] == 'in_progress':
+                    return None
+            if pb['status'] == 'in_progress':
+                await asyncio.sleep(pb['suggested_wait'])
+                return None
+            elif pb['status'] == 'completed':
+                return await self.wait()
+            elif pb['status'] == 'failed':
+                raise Exception(f"Async operation failed with error: {pb.get('error', 'Unknown error')}")
+
+        async def status(self):
+            result = await self.probe()
+            return result.get('status', 'unknown')
+
+    def __init__(self, server_url, server_key=None, max_connections=10, max_concurrency=None, idle_timeout=30, timeout=None, binary=True, session=None, poll_timeout=30, compress_responses=True, compress_requests=False, compress_min_size=1024, compress_level=None, timing=True, timing_hook=None, manifest_cache=False, manifest_max_age=0, array_format=None, shared_memory=None):
+        if aiohttp is None:
+            raise ImportError("tarp.aclient needs the aiohttp package, install it with 'pip install aiohttp'")
+        #unix:///path/to/socket URLs work as they do for tarp.client.client
+        self.server_name = server_url.rstrip('/')
+        self.socketPath = unixSocketPath(server_url)
+        self.server_url = UNIX_URL if self.socketPath else self.server_name
+        self.server_key = server_key
+        self.remoteNames = []
+        #The list of endpoints is fetched by connect, or by the first call if connect
+        #is not used, and cached as it is by tarp.client.client
+        self.remoteEndpoints = None
+        self.manifestLock = asyncio.Lock()
+        self.manifestDirectory = MANIFEST_DIRECTORY if manifest_cache is True else manifest_cache
+        self.manifest_max_age = manifest_max_age
+        #max_connections and idle_timeout behave as they do for tarp.client.client.
+        #max_concurrency limits how many calls this client has waiting on the server
+        #at once. Pass an existing aiohttp.ClientSession as session to share one
+        #connection pool between several clients
+        self.max_connections = max_connections
+        self.idle_timeout = idle_timeout
+        self.timeout = aiohttp.ClientTimeout(total=timeout) if timeout is not None else None
+        self.limiter = asyncio.Semaphore(max_concurrency) if max_concurrency else None
+        self.session = session
+        self.ownsSession = session is None
+        self.sslContext = ssl.create_default_context(cafile=server_key) if server_key else None
+        self.binary = binary
+        self.useFrames = False
+        self.useBatch = False
+        #Shared memory is used as it is by tarp.client.client
+        self.shared_memory = shared_memory
+        self.sharedMemory = None
+        self.requestTimeout = timeout
+        self.poll_timeout = poll_timeout
+        self.useLongPoll = False
+        #Compression behaves as it does for tarp.client.client
+        self.compress_responses = compress_responses
+        self.compress_requests = compress_requests
+        self.compress_min_size = compress_min_size
+        self.compress_level = compress_level
+        self.requestEncoding = None
+        #Arrays are asked for in array_format as they are by tarp.client.client
+        self.arrayHeaders = {'Accept': f'{arrays.MIMETYPES[array_format]}, application/json;q=0.5'} if array_format else {}
+        #Timing behaves as it does for tarp.client.client. The connection phases
+        #are only timed if the client creates its own session
+        self.timing = timing
+        self.timingHook = timing_hook
+        self.lastTiming = None
+
+    async def __aenter__(self):
+        return await self.connect()
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def connect(self):
+        """Open the connection pool and fetch the endpoints from the server."""
+        self.openSession()
+        await self.loadEndpoints()
+        return self
+
+    def openSession(self):
+        """Create the connection pool if the client does not have one yet."""
+        if self.session is None:
+            if self.socketPath:
+                connector = aiohttp.UnixConnector(path=self.socketPath, limit_per_host=self.max_connections, keepalive_timeout=self.idle_timeout)
+            else:
+                connector = aiohttp.TCPConnector(limit_per_host=self.max_connections, keepalive_timeout=self.idle_timeout)
+            self.session = aiohttp.ClientSession(connector=connector, trace_configs=[timingTrace()] if self.timing else None)
+
+    async def ensureEndpoints(self):
+        """Load the endpoints if that has not been done yet."""
+        if self.remoteEndpoints is None:
+            async with self.manifestLock:
+                if self.remoteEndpoints is None:
+                    await self.loadEndpoints()
+
+    async def close(self):
+        """Close the connection pool, unless it was passed in by the caller."""
+        if self.ownsSession and self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def limit(self):
+        """Returns a context manager that holds one of the max_concurrency slots."""
+        return self.limiter if self.limiter is not None else contextlib.nullcontext()
+
+    async def request(self, method, url, **kwargs):
+        """Make an HTTP request to the server through the connection pool.
+        The caller is responsible for releasing the response."""
+        self.openSession()
+        if self.sslContext is not None:
+            kwargs.setdefault('ssl', self.sslContext)
+        if not self.compress_responses:
+            kwargs['headers'] = dict(kwargs.get('headers') or {}, **{'Accept-Encoding': 'identity'})
+        if kwargs.get('timeout') is None:
+            kwargs.pop('timeout', None)
+            if self.timeout is not None:
+                kwargs['timeout'] = self.timeout
+        resp = await self.session.request(method, url, **kwargs)
+        timer = activeTimer.get()
+        if timer is not None:
+            timer.server = resp.headers.get('Server-Timing')
+        return resp
+
+    def raiseAPIerror(self, type, message, retry_after=None):
+        """Raise the exception matching an error type reported by the server."""
+        if type == 'OperationInProgress':
+            raise OperationInProgress(message or 'Operation in progress', retry_after=int(retry_after or 5))
+        elif type == 'InvalidServerState':
+            raise InvalidServerState(message or 'Invalid server state')
+        else:
+            raise Exception(message or 'Unknown error')
+
+    async def checkAPIresult(self, response):
+        """Check if the API response is successful. Streamed results are returned
+        as an async iterator that takes over the response, anything else is read
+        in full and the response released."""
+        try:
+            #Read the whole body first so that reading and decoding it are timed separately
+            if response.status != 200 or response.content_type != wire.NDJSON_MIMETYPE:
+                await response.read()
+                timePhase('decode')
+            if response.status == 404:
+                raise Exception("API endpoint not found.")
+            if response.status != 200:
+                #If the response is not 200 and the response is JSON, try to parse it
+                text = await response.read()
+                try:
+                    json_response = json.loads(text)
+                except ValueError:
+                    raise Exception(f"API Error: {response.status} - {text.decode('utf-8', errors='replace')}")
+                self.raiseAPIerror(json_response.get('type',None), json_response.get('message'), response.headers.get('Retry-After', 5))
+            if response.content_type == wire.NDJSON_MIMETYPE:
+                return wire.NDJSON_MIMETYPE, self.iterLines(response)
+            if response.content_type in arrays.FORMATS:
+                return response.content_type, arrays.decode(response.content_type, await response.read())
+            if response.content_type != 'application/json':
+                return response.content_type, await response.read()
+            result = jsonenc.loads(await response.read())
+            if (result['status'] != 'success'):
+                raise Exception(f"API Error: {result.get('message', 'Unknown error')}")
+            return result.get('mimetype'), result.get('result', None)
+        finally:
+            if response.content_type != wire.NDJSON_MIMETYPE or response.status != 200:
+                response.release()
+
+    async def readFrames(self, resp):
+        """Read a framed binary response into preallocated buffers."""
+        async def readinto(view):
+            data = await resp.content.read(min(view.nbytes, 1 << 20))
+            view[:len(data)] = data
+            return len(data)
+        return await wire.read_frames_async(readinto, framedLength(resp.headers))
+
+    async def iterLines(self, resp):
+        """Lazily yield the items of a newline delimited JSON stream."""
+        try:
+            pending = b''
+            async for data in resp.content.iter_any():
+                lines = (pending + data).split(b'\n')
+                pending = lines.pop()
+                for line in lines:
+                    if line.strip():
+                        yield jsonenc.loads(line)
+            if pending.strip():
+                yield jsonenc.loads(pending)
+        except aiohttp.ClientPayloadError:
+            raise Exception("Streamed response ended early, the server reported an error")
+        finally:
+            resp.release()
+
+    async def iterFrames(self, resp):
+        """Lazily yield the items of a streamed RPC result."""
+        try:
+            while True:
+                kind, value = wire.load_frames(await self.readFrames(resp))
+                if kind == 'item':
+                    yield value
+                elif kind == 'error':
+                    self.raiseAPIerror(*value)
+                else:
+                    return
+        except (EOFError, aiohttp.ClientPayloadError):
+            raise Exception("Streamed response ended early")
+        finally:
+            resp.release()
+
+    def encodeBody(self, data, headers):
+        """Compress a request body if compress_requests is set and the server can decode it.
+        Returns the body and headers to send."""
+        if self.requestEncoding is None or not isinstance(data, (bytes, bytearray, wire.framedBody)) or len(data) < self.compress_min_size:
+            return data, headers
+        headers = dict(headers, **{'Content-Encoding': self.requestEncoding})
+        return compress.compress(data, self.requestEncoding, self.compress_level), headers
+
+    async def rpcRequest(self, url, args, kwargs):
+        """Send the arguments of an RPC or AsyncRPC call to the server."""
+        if self.useFrames:
+            frames = wire.dump_frames((args, kwargs))
+            packed = packFrames(self.sharedMemory, frames)
+            if packed is not None:
+                try:
+                    headers = {'Content-Type': shm.SHM_MIMETYPE, 'Accept': self.framesAccept()}
+                    return await self.request('POST', url, data=shm.dumps(packed), headers=headers)
+                finally:
+                    #The server has taken the files by the time it replies, unless it failed
+                    shm.release(packed)
+            headers = {'Content-Type': wire.PICKLE_MIMETYPE, 'Accept': self.framesAccept()}
+            body, headers = self.encodeBody(wire.framedBody(frames), headers)
+            if isinstance(body, bytes):
+                return await self.request('POST', url, data=body, headers=headers)
+            async def frames():
+                for frame in body:
+                    yield frame
+            headers['Content-Length'] = str(len(body))
+            return await self.request('POST', url, data=frames(), headers=headers)
+        #Prepare the payload as a JSON object with base64 encoded pickles
+        payload = {
+            'args': base64.b64encode(pickle.dumps(args)).decode('utf-8'),
+            'kwargs': base64.b64encode(pickle.dumps(kwargs)).decode('utf-8')
+        }
+        headers = {'Content-Type': 'application/json'}
+        body, headers = self.encodeBody(json.dumps(payload).encode('utf-8'), headers)
+        return await self.request('POST', url, data=body, headers=headers)
+
+    def framesAccept(self):
+        """The Accept header for framed responses, which may come through shared memory."""
+        return f'{shm.SHM_MIMETYPE}, {wire.PICKLE_MIMETYPE}' if self.sharedMemory is not None else wire.PICKLE_MIMETYPE
+
+    async def rpcResult(self, resp, name):
+        """Unpack the pickled result of an RPC call from either wire format."""
+        if resp.status == 200 and resp.content_type == wire.STREAM_MIMETYPE:
+            return self.iterFrames(resp)
+        if resp.status == 200 and resp.content_type == wire.PICKLE_MIMETYPE:
+            try:
+                frames = await self.readFrames(resp)
+            finally:
+                resp.release()
+            timePhase('decode')
+            return wire.load_frames(frames)
+        if resp.status == 200 and resp.content_type == shm.SHM_MIMETYPE:
+            body = await resp.read()
+            timePhase('decode')
+            return shm.loads(body, self.sharedMemory['directory'])
+        mime, results = await self.checkAPIresult(resp)
+        if mime != 'application/json':
+            raise Exception(f"RPC endpoint {name} returned non-JSON response: {mime}")
+        #Unpack the results from base64 encoded pickles
+        return pickle.loads(base64.b64decode(results['payload']))
+
+    async def loadEndpoints(self):
+        """Fetch the available endpoints from the server, revalidating a cached copy
+        of the list as tarp.client.client does."""
+        cached = readManifest(self.manifestDirectory, self.server_name)
+        if cached is not None and self.manifest_max_age and time.time() - cached['saved'] < self.manifest_max_age:
+            self.applyManifest(cached['manifest'])
+            return
+        headers = {'If-None-Match': cached['etag']} if cached is not None and cached.get('etag') else {}
+        async with self.limit():
+            resp = await self.request('GET', f"{self.server_url}/", headers=headers)
+            if resp.status == 304 and cached is not None:
+                resp.release()
+                result = cached['manifest']
+            else:
+                mimetype, result = await self.checkAPIresult(resp)
+        writeManifest(self.manifestDirectory, self.server_name, resp.headers.get('ETag'), result)
+        self.applyManifest(result)
+
+    def applyManifest(self, result):
+        """Set up the client from the list of endpoints returned by the server.
+        The coroutines for the endpoints are made when they are first used."""
+        self.useFrames = self.binary and wire.PICKLE_CAPABILITY in result.get('CAPABILITIES', [])
+        self.useBatch = self.useFrames and 'batch' in result.get('CAPABILITIES', [])
+        self.useLongPoll = bool(self.poll_timeout) and 'long-poll' in result.get('CAPABILITIES', [])
+        self.sharedMemory = sharedMemoryInfo(self.shared_memory, self.server_url, result) if self.useFrames else None
+        if self.compress_requests and 'content-encoding' in result.get('CAPABILITIES', []):
+            self.requestEncoding = next((e for e in compress.ENCODINGS if e in result.get('ENCODINGS', [])), None)
+        remoteEndpoints = {}
+        for kind in ('GET', 'POST', 'RPC', 'ASYNCRPC'):
+            for endpoint in result.get(kind, []):
+                remoteEndpoints[endpoint['name'].replace('/', '_')] = (kind, endpoint)
+        self.remoteNames = list(remoteEndpoints)
+        self.remoteEndpoints = remoteEndpoints
+        for name in remoteEndpoints:
+            if hasattr(type(self), name):
+                setattr(self, name, self.makeMethod(name))
+
+    def __getattr__(self, name):
+        #Only called for attributes that are not found normally, so a remote
+        #coroutine is made the first time it is used and then kept on the instance
+        if name.startswith('_') or 'remoteEndpoints' not in self.__dict__:
+            raise AttributeError(name)
+        if self.remoteEndpoints is None:
+            #The endpoints cannot be fetched here without blocking, so the coroutine
+            #returned fetches them when it is called and then calls the endpoint
+            async def call_after_connect(*args, **kwargs):
+                await self.ensureEndpoints()
+                return await getattr(self, name)(*args, **kwargs)
+            return call_after_connect
+        if name not in self.remoteEndpoints:
+            raise AttributeError(f"'{type(self).__name__}' object has no attribute or remote method '{name}'")
+        method = self.makeMethod(name)
+        setattr(self, name, method)
+        return method
+
+    def __dir__(self):
+        return list(super().__dir__()) + list(self.remoteEndpoints or [])
+
+    def makeMethod(self, name):
+        """Make the coroutine that calls a remote endpoint, in the same way as tarp.client."""
+        kind, endpoint = self.remoteEndpoints[name]
+        if kind == 'GET':
+            async def get_method(name=name, **kwargs):
+                params = '&'.join(f"{k}={v}" for k, v in kwargs.items())
+                url = f"{self.server_url}/{name}?{params}"
+                async with self.limit():
+                    with timedCall(self, name):
+                        resp = await self.request('GET', url, headers=self.arrayHeaders)
+                        return await self.checkAPIresult(resp)
+            method = get_method
+        elif kind == 'POST':
+            async def post_method(payload=None, name=name, **kwargs):
+                url = f"{self.server_url}/{name}"
+                params = '&'.join(f"{k}={v}" for k, v in kwargs.items())
+                if params:
+                    url += f"?{params}"
+                async with self.limit():
+                    with timedCall(self, name):
+                        headers = dict(self.arrayHeaders)
+                        if payload:
+                            if isinstance(payload, dict):
+                                headers['Content-Type'] = 'application/json'
+                                payload = json.dumps(payload).encode('utf-8')
+                            else:
+                                headers['Content-Type'] = 'application/octet-stream'
+                            payload, headers = self.encodeBody(payload, headers)
+                        resp = await self.request('POST', url, data=payload or None, headers=headers)
+                        return await self.checkAPIresult(resp)
+            method = post_method
+        elif kind == 'RPC':
+            async def rpc_method(*args, name=name, **kwargs):
+                url = f"{self.server_url}/{name}"
+                async with self.limit():
+                    with timedCall(self, name):
+                        resp = await self.rpcRequest(url, args, kwargs)
+                        return await self.rpcResult(resp, name)
+            method = rpc_method
+        else:
+            async def async_rpc_method(*args, name=name, **kwargs):
+                url = f"{self.server_url}/{name}"
+                async with self.limit():
+                    with timedCall(self, name):
+                        resp = await self.rpcRequest(url, args, kwargs)
+                        mime, results = await self.checkAPIresult(resp)
+                if mime != 'application/json':
+                    raise Exception(f"RPC endpoint {name} returned non-JSON response: {mime}")
+                return self.asyncResult(self, results['ID'])
+            method = async_rpc_method
+        method.__doc__ = endpoint.get('description', f"{METHOD_KINDS[kind]} for {name}")
+        return method
+
+    async def call_many(self, calls, concurrent=False, return_exceptions=False):
+        """Make several RPC calls in a single round trip to the server.
+        See tarp.client.client.call_many."""
+        calls = [(call[0], tuple(call[1]) if len(call) > 1 else (), dict(call[2]) if len(call) > 2 else {}) for call in calls]
+        await self.ensureEndpoints()
+        if not self.useBatch:
+            #The server does not support batches, so make the calls separately
+            async def call(name, args, kwargs):
+                return await getattr(self, name)(*args, **kwargs)
+            coroutines = [call(name, args, kwargs) for name, args, kwargs in calls]
+            return await asyncio.gather(*coroutines, return_exceptions=return_exceptions)
+        async with self.limit():
+            with timedCall(self, 'batch'):
+                headers = {'Content-Type': wire.PICKLE_MIMETYPE, 'Accept': wire.PICKLE_MIMETYPE}
+                body, headers = self.encodeBody(bytes(wire.dumps({'calls': calls, 'concurrent': concurrent})), headers)
+                resp = await self.request('POST', f"{self.server_url}/batch", data=body, headers=headers)
+                records = await self.rpcResult(resp, 'batch')
+        results = []
+        for kind, value in records:
+            if kind == 'ok':
+                results.append(value)
+                continue
+            try:
+                self.raiseAPIerror(*value)
+            except Exception as e:
+                if not return_exceptions:
+                    raise
+                results.append(e)
+        return results
+
+    def pollArguments(self, timeout):
+        """Returns the query string and request timeout for a long-poll request."""
+        if not timeout:
+            return '', self.timeout
+        #The request itself must be allowed to last longer than the poll
+        if self.requestTimeout is None:
+            return f"&timeout={timeout}", None
+        return f"&timeout={timeout}", aiohttp.ClientTimeout(total=self.requestTimeout + timeout)
+
+    async def wait(self, ID):
+        """Wait for an asynchronous operation to complete."""
+        query, request_timeout = self.pollArguments(self.poll_timeout if self.useLongPoll else None)
+        url = f"{self.server_url}/asyncGet?UUID={ID}{query}"
+        headers = {'Accept': self.framesAccept()} if self.useFrames else {}
+        while True:
+            try:
+                async with self.limit():
+                    with timedCall(self, 'asyncGet'):
+                        resp = await self.request('GET', url, headers=headers, timeout=request_timeout)
+                        if resp.status == 200 and resp.content_type in (wire.PICKLE_MIMETYPE, shm.SHM_MIMETYPE):
+                            return await self.rpcResult(resp, 'asyncGet')
+                        mime, result = await self.checkAPIresult(resp)
+                        if mime == 'application/json':
+                            return pickle.loads(base64.b64decode(result['payload']))
+                        else:
+                            raise Exception(f"Unexpected mimetype: {mime}")
+            except OperationInProgress as e:
+                await asyncio.sleep(e.retry_after)
+
+    async def probe(self, ID, timeout=None):
+        """Check the status of an asynchronous operation. If timeout is given and
+        the server supports it, wait up to that many seconds for the operation to finish."""
+        query, request_timeout = self.pollArguments(timeout if self.useLongPoll else None)
+        url = f"{self.server_url}/asyncProbe?UUID={ID}{query}"
+        async with self.limit():
+            with timedCall(self, 'asyncProbe'):
+                resp = await self.request('GET', url, timeout=request_timeout)
+                mime, result = await self.checkAPIresult(resp)
+        if mime == 'application/json':
+            return result
+        else:
+            raise Exception(f"Unexpected mimetype: {mime}")
+
+async def connect(server_url, **kwargs):
+    """Create a client and fetch its endpoints. Takes the same arguments as client."""
+    return await client(server_url, **kwargs).connect()
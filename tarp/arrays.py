@@ -0,0 +1,162 @@
+#   Copyright 2025 Chris Brady, Heather Ratcliffe
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+# Binary array formats that GET and POST endpoints returning NumPy arrays can
+# send instead of JSON, when the client asks for one with an Accept header or
+# a _format query parameter:
+#   npy    a single array in NumPy's .npy format
+#   npz    an array, or a dict of arrays, as an uncompressed NumPy .npz archive
+#   arrow  a 1-D array, or a dict of 1-D arrays of the same length, as an
+#          Apache Arrow IPC stream. Needs the optional pyarrow package
+# .npy and Arrow are written straight from the arrays' memory.
+import io
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+except ImportError:
+    pyarrow = None
+
+# The query parameter that names a format. It is reserved by the server and not
+# passed on to endpoints, so that they can still have a parameter called format
+QUERY_PARAMETER = '_format'
+NPY_MIMETYPE = 'application/x-npy'
+NPZ_MIMETYPE = 'application/x-npz'
+ARROW_MIMETYPE = 'application/vnd.apache.arrow.stream'
+
+MIMETYPES = {'npy': NPY_MIMETYPE, 'npz': NPZ_MIMETYPE, 'arrow': ARROW_MIMETYPE}
+FORMATS = {mimetype: name for name, mimetype in MIMETYPES.items()}
+EXTENSIONS = {'npy': 'npy', 'npz': 'npz', 'arrow': 'arrows'}
+
+class bufferBody:
+    """Buffers to be sent one after another as a single response body. len() gives
+    the total size for the Content-Length header."""
+    def __init__(self, buffers):
+        self.buffers = [memoryview(buffer).cast('B') for buffer in buffers]
+
+    def __len__(self):
+        return sum(buffer.nbytes for buffer in self.buffers)
+
+    def __iter__(self):
+        return iter(self.buffers)
+
+    def __bytes__(self):
+        return b''.join(self.buffers)
+
+def available(name):
+    """True if this installation can read and write the named format."""
+    if name == 'arrow':
+        return numpy is not None and pyarrow is not None
+    return numpy is not None and name in MIMETYPES
+
+def requested(query_format, accept):
+    """Returns the array formats a request asked for, most preferred first. A _format
+    query parameter overrides the Accept header. Only formats named explicitly in
+    the Accept header count, so */* and application/json give an empty list."""
+    if query_format is not None:
+        return [query_format]
+    if not accept or 'application/' not in accept:
+        return []
+    wanted = []
+    for position, item in enumerate(accept.split(',')):
+        mimetype, _, params = item.strip().partition(';')
+        name = FORMATS.get(mimetype.strip().lower())
+        if name is None:
+            continue
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                pass
+        if quality > 0:
+            wanted.append((-quality, position, name))
+    return [name for _, _, name in sorted(wanted)]
+
+def is_array(obj):
+    return numpy is not None and isinstance(obj, (numpy.ndarray, numpy.generic)) and obj.dtype != object
+
+def is_arraylike(result):
+    """True for the results that can be sent as an array format: an array, a NumPy
+    scalar or a non-empty dict of them with string keys."""
+    if isinstance(result, dict):
+        return bool(result) and all(isinstance(key, str) and is_array(value) for key, value in result.items())
+    return is_array(result)
+
+def encodable(name, result):
+    """True if result can be sent in the named format."""
+    if not available(name) or not is_arraylike(result):
+        return False
+    if name == 'npy':
+        return not isinstance(result, dict)
+    if name == 'arrow':
+        columns = result if isinstance(result, dict) else {'values': result}
+        lengths = {len(column) if numpy.ndim(column) == 1 else None for column in columns.values()}
+        return None not in lengths and len(lengths) == 1
+    return True
+
+def npy_buffers(array):
+    """Returns the .npy header and the array's data, without copying the data if
+    the array is contiguous."""
+    array = numpy.asarray(array)
+    if not array.flags.c_contiguous and not array.flags.f_contiguous:
+        array = numpy.ascontiguousarray(array)
+    header = numpy.lib.format.header_data_from_array_1_0(array)
+    out = io.BytesIO()
+    try:
+        numpy.lib.format.write_array_header_1_0(out, header)
+    except ValueError:
+        #Headers over 64 KB need version 2 of the format
+        numpy.lib.format.write_array_header_2_0(out, header)
+    #Fortran ordered arrays are written column by column, which is the transpose in C order
+    data = array.T if header['fortran_order'] else array
+    #Viewed as bytes since memoryview does not accept every dtype
+    return [out.getvalue(), data.reshape(-1).view(numpy.uint8)]
+
+def encode(name, result):
+    """Encodes an array, or a dict of arrays, in the named format as a bufferBody."""
+    if name == 'npy':
+        return bufferBody(npy_buffers(result))
+    if name == 'npz':
+        arrays = result if isinstance(result, dict) else {'arr_0': result}
+        out = io.BytesIO()
+        numpy.savez(out, **arrays)
+        return bufferBody([out.getbuffer()])
+    columns = result if isinstance(result, dict) else {'values': result}
+    batch = pyarrow.record_batch([pyarrow.array(column) for column in columns.values()], names=list(columns))
+    sink = pyarrow.BufferOutputStream()
+    with pyarrow.ipc.new_stream(sink, batch.schema) as writer:
+        writer.write_batch(batch)
+    return bufferBody([sink.getvalue()])
+
+def decode(mimetype, data):
+    """Decodes a response in one of the array formats: an array for .npy and a dict
+    of arrays for .npz and Arrow. Data that cannot be decoded here, Arrow without
+    pyarrow for one, is returned unchanged."""
+    name = FORMATS.get(mimetype)
+    if name is None or not available(name):
+        return data
+    if name == 'npy':
+        return numpy.load(io.BytesIO(data), allow_pickle=False)
+    if name == 'npz':
+        with numpy.load(io.BytesIO(data), allow_pickle=False) as archive:
+            return {key: archive[key] for key in archive.files}
+    table = pyarrow.ipc.open_stream(data).read_all()
+    return {column: table.column(column).to_numpy() for column in table.column_names}
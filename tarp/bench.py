@@ -0,0 +1,394 @@
+#   Copyright 2025 Chris Brady, Heather Ratcliffe
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+# Benchmarks a local TARP server. Run it with
+#   python -m tarp.bench --help
+# A server made with makeServer and started with runServer, either in a
+# subprocess (the default, so that the client and server CPU time and memory
+# can be told apart) or on a thread of this process, is driven through
+# tarp.client by GET, POST, RPC and AsyncRPC calls for every combination of
+# payload type (bytes, dict or NumPy array), payload size, concurrency, TLS
+# on or off and transport (loopback TCP or a Unix domain socket). For each combination it reports the throughput, the latency
+# percentiles and the CPU time and peak RSS of both sides, as a table or as
+# JSON that a later run can be compared with using --compare.
+# The server does not log requests, since writing a line for each one would
+# dominate the timings of small calls.
+import argparse
+import concurrent.futures
+import contextlib
+import json
+import math
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from . import client as tarpClient
+from . import server as tarpServer
+
+KINDS = ('get', 'post', 'rpc', 'asyncrpc')
+TRANSPORTS = ('tcp', 'unix')
+PAYLOADS = ('bytes', 'dict', 'array')
+
+def parse_size(text):
+    """Parses sizes like 1K, 16M or 1G into a number of bytes."""
+    units = {'K': 1024, 'M': 1024**2, 'G': 1024**3}
+    text = text.strip().upper()
+    if text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+def peak_rss():
+    """Returns the peak resident set size of this process in bytes, or None if it is not known."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    #Linux reports kilobytes and macOS bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+def make_payload(kind, size):
+    """Returns a payload of roughly size bytes: bytes, a dict holding a list of
+    floats, or a NumPy array of float64."""
+    if kind == 'bytes':
+        return os.urandom(size)
+    count = max(1, size // 8)
+    if kind == 'dict':
+        return {'values': [float(i) for i in range(count)]}
+    if numpy is None:
+        raise ValueError('NumPy array payloads need NumPy to be installed')
+    return numpy.arange(count, dtype=numpy.float64)
+
+payloads = {}
+
+def cached_payload(kind, size):
+    key = (kind, size)
+    if key not in payloads:
+        payloads[key] = make_payload(kind, size)
+    return payloads[key]
+
+#The benchmark endpoints
+def bench_get(query, body):
+    """Returns a payload of the type and size given by the query parameters."""
+    payload = cached_payload(query['type'], int(query['size']))
+    if isinstance(payload, bytes):
+        return tarpServer.rawPayload(payload)
+    if isinstance(payload, dict):
+        return payload
+    #Arrays are encoded straight into the JSON
+    return {'values': payload}
+
+def bench_post(query, body):
+    """Reports the length of the body it was sent, or the number of keys for JSON."""
+    return {'received': len(body) if body is not None else 0}
+
+def bench_echo(value):
+    """Returns its argument."""
+    return value
+
+def bench_usage(query, body):
+    """Reports the CPU time used by the server process and its peak RSS."""
+    return {'cpu': time.process_time(), 'peak_rss': peak_rss()}
+
+def make_bench_server():
+    """Returns a server class with the benchmark endpoints."""
+    cls = tarpServer.makeServer('benchServer', multiThreaded=True)
+    cls.log_message = lambda self, format, *args: None
+    cls.addGetEndpoint('benchGet', bench_get, description='Returns a payload of a given type and size')
+    cls.addGetEndpoint('benchUsage', bench_usage, description='Reports the CPU time and peak RSS of the server')
+    cls.addPostEndpoint('benchPost', bench_post, description='Reports the size of the body it was sent')
+    cls.addRPCEndpoint('benchEcho', bench_echo, description='Returns its argument')
+    cls.addAsyncRPCEndpoint('benchAsyncEcho', bench_echo, description='Returns its argument', suggested_wait=0.01)
+    return cls
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def make_certificate(directory):
+    """Creates a self-signed certificate for localhost with openssl. Returns the
+    certificate and key files."""
+    certfile = os.path.join(directory, 'bench.pem')
+    keyfile = os.path.join(directory, 'bench.key')
+    subprocess.run(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1',
+                    '-keyout', keyfile, '-out', certfile, '-subj', '/CN=localhost',
+                    '-addext', 'subjectAltName=DNS:localhost,IP:127.0.0.1'],
+                   check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return certfile, keyfile
+
+class benchServer:
+    """A benchmark server running on a local port, or on a Unix socket if unix_socket
+    is given, in a subprocess or on a thread."""
+    def __init__(self, engine='threaded', tls=False, certfile=None, keyfile=None, in_process=False, compress=True, unix_socket=None):
+        self.port = None if unix_socket else free_port()
+        self.unix_socket = unix_socket
+        self.transport = 'unix' if unix_socket else 'tcp'
+        self.tls = tls
+        self.compress = compress
+        self.certfile = certfile
+        self.in_process = in_process
+        self.process = None
+        if in_process:
+            cls = make_bench_server()
+            kwargs = {'port': self.port, 'bindTo': '127.0.0.1', 'engine': engine, 'secure': tls, 'unix_socket': unix_socket}
+            if tls:
+                kwargs.update(certfile=certfile, keyfile=keyfile)
+            threading.Thread(target=tarpServer.runServer, args=(cls,), kwargs=kwargs, daemon=True).start()
+        else:
+            command = [sys.executable, '-m', 'tarp.bench', '--serve', '--engine', engine]
+            command += ['--unix-socket', unix_socket] if unix_socket else ['--port', str(self.port)]
+            if tls:
+                command += ['--certfile', certfile, '--keyfile', keyfile]
+            #The child must be able to import tarp from wherever this copy was found
+            env = dict(os.environ)
+            root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+            env['PYTHONPATH'] = os.pathsep.join([root] + ([env['PYTHONPATH']] if env.get('PYTHONPATH') else []))
+            self.process = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL)
+        self.url = f"unix://{unix_socket}" if unix_socket else f"{'https' if tls else 'http'}://localhost:{self.port}"
+
+    def connect(self, max_connections=1, timeout=15):
+        """Returns a client for the server, waiting for it to start."""
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                return tarpClient.client(self.url, server_key=self.certfile if self.tls else None, max_connections=max_connections, compress_responses=self.compress,
+                                         lazy=False, manifest_cache=False)
+            except Exception:
+                if self.process is not None and self.process.poll() is not None:
+                    raise RuntimeError('The benchmark server exited while starting')
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.1)
+
+    def usage(self, c):
+        """Returns the CPU time and peak RSS of the server process."""
+        return c.benchUsage()[1]
+
+    def close(self):
+        if self.process is not None:
+            self.process.terminate()
+            self.process.wait()
+
+def make_call(c, kind, payload_type, size):
+    """Returns a function that makes one call of the given kind to the server."""
+    payload = cached_payload(payload_type, size)
+    if kind == 'get':
+        return lambda: c.benchGet(type=payload_type, size=size)
+    if kind == 'post':
+        #Arrays are posted as their raw bytes
+        body = payload.tobytes() if numpy is not None and isinstance(payload, numpy.ndarray) else payload
+        return lambda: c.benchPost(body)
+    if kind == 'rpc':
+        return lambda: c.benchEcho(payload)
+    return lambda: c.benchAsyncEcho(payload).wait()
+
+def percentile(ordered, p):
+    """The p-th percentile of a sorted list, by the nearest rank method."""
+    return ordered[max(0, min(len(ordered) - 1, math.ceil(p / 100 * len(ordered)) - 1))]
+
+def run_case(server, kind, payload_type, size, concurrency, requests, duration, warmup):
+    """Makes requests calls (or as many as fit in duration seconds) from concurrency
+    threads and returns the measurements."""
+    c = server.connect(max_connections=concurrency)
+    try:
+        call = make_call(c, kind, payload_type, size)
+        for _ in range(warmup):
+            call()
+        latencies = []
+        errors = []
+        issued = 0
+        lock = threading.Lock()
+        deadline = time.monotonic() + duration
+        def worker():
+            nonlocal issued
+            while True:
+                with lock:
+                    if issued >= requests or time.monotonic() > deadline:
+                        return
+                    issued += 1
+                start = time.perf_counter()
+                try:
+                    call()
+                except Exception as e:
+                    with lock:
+                        errors.append(str(e))
+                    continue
+                elapsed = time.perf_counter() - start
+                with lock:
+                    latencies.append(elapsed)
+        server_before = server.usage(c)
+        cpu_before = time.process_time()
+        started = time.perf_counter()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as pool:
+            for future in [pool.submit(worker) for _ in range(concurrency)]:
+                future.result()
+        elapsed = time.perf_counter() - started
+        client_cpu = time.process_time() - cpu_before
+        server_after = server.usage(c)
+    finally:
+        c.close()
+    latencies.sort()
+    result = {
+        'kind': kind, 'payload': payload_type, 'size': size, 'concurrency': concurrency, 'tls': server.tls, 'transport': server.transport,
+        'requests': len(latencies), 'errors': len(errors), 'seconds': elapsed,
+        'throughput_rps': len(latencies) / elapsed if elapsed else 0.0,
+        'latency_s': {'mean': sum(latencies) / len(latencies), 'p50': percentile(latencies, 50), 'p95': percentile(latencies, 95),
+                      'p99': percentile(latencies, 99), 'max': latencies[-1]} if latencies else None,
+        'client_cpu_s': client_cpu, 'client_peak_rss': peak_rss(),
+        #In process the server's usage is that of this process, which the client figures already include
+        'server_cpu_s': None if server.in_process else server_after['cpu'] - server_before['cpu'],
+        'server_peak_rss': None if server.in_process else server_after['peak_rss'],
+    }
+    if errors:
+        result['first_error'] = errors[0]
+    return result
+
+def case_key(result):
+    #Results saved before the transport was recorded were all over TCP
+    return (result['kind'], result['payload'], result['size'], result['concurrency'], result['tls'], result.get('transport', 'tcp'))
+
+def format_bytes(value):
+    if value is None:
+        return '-'
+    for unit in ('B', 'K', 'M', 'G'):
+        if value < 1024 or unit == 'G':
+            return f'{value:.0f}{unit}' if unit == 'B' else f'{value:.1f}{unit}'
+        value /= 1024
+
+def format_ms(value):
+    return '-' if value is None else f'{value * 1000:.2f}'
+
+HEADER = (f"{'kind':>8} {'payload':>7} {'size':>7} {'conc':>4} {'tls':>3} {'net':>4} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}"
+          f" {'cli cpu':>7} {'srv cpu':>7} {'cli rss':>7} {'srv rss':>7} {'err':>4}")
+
+def format_row(r, baseline=None):
+    latency = r['latency_s'] or {}
+    row = (f"{r['kind']:>8} {r['payload']:>7} {format_bytes(r['size']):>7} {r['concurrency']:>4} {'on' if r['tls'] else 'off':>3} {r.get('transport', 'tcp'):>4}"
+           f" {r['throughput_rps']:>9.1f} {format_ms(latency.get('p50')):>8} {format_ms(latency.get('p95')):>8} {format_ms(latency.get('p99')):>8}"
+           f" {r['client_cpu_s']:>7.2f} {'-' if r['server_cpu_s'] is None else format(r['server_cpu_s'], '.2f'):>7}"
+           f" {format_bytes(r['client_peak_rss']):>7} {format_bytes(r['server_peak_rss']):>7} {r['errors']:>4}")
+    if baseline is not None and baseline.get('throughput_rps') and latency and baseline.get('latency_s'):
+        row += f"  throughput x{r['throughput_rps'] / baseline['throughput_rps']:.2f}, p50 x{latency['p50'] / baseline['latency_s']['p50']:.2f}"
+    return row
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m tarp.bench', description='Benchmark the TARP client and server on this machine.')
+    parser.add_argument('--kinds', default=','.join(KINDS), help=f'Comma separated endpoint kinds (default: {",".join(KINDS)})')
+    parser.add_argument('--payloads', default=','.join(PAYLOADS), help=f'Comma separated payload types (default: {",".join(PAYLOADS)})')
+    parser.add_argument('--sizes', default='1K,64K,1M', help='Comma separated payload sizes (default: 1K,64K,1M)')
+    parser.add_argument('--concurrency', default='1,8', help='Comma separated numbers of concurrent callers (default: 1,8)')
+    parser.add_argument('--tls', default='off', help='Comma separated TLS settings, off and/or on (default: off)')
+    parser.add_argument('--transports', default='tcp', help=f'Comma separated transports, {" and/or ".join(TRANSPORTS)} (default: tcp)')
+    parser.add_argument('--requests', type=int, default=200, help='Calls measured for each combination (default: 200)')
+    parser.add_argument('--duration', type=float, default=10.0, help='Longest time in seconds spent on each combination (default: 10)')
+    parser.add_argument('--warmup', type=int, default=5, help='Calls made before measuring each combination (default: 5)')
+    parser.add_argument('--engine', default='threaded', choices=('threaded', 'asyncio'), help='Server engine (default: threaded)')
+    parser.add_argument('--no-compress', action='store_true', help='Ask the server not to compress responses')
+    parser.add_argument('--in-process', action='store_true', help='Run the server on a thread of this process rather than in a subprocess')
+    parser.add_argument('--certfile', help='Certificate for TLS, a self-signed one is made with openssl if not given')
+    parser.add_argument('--keyfile', help='Key for the TLS certificate')
+    parser.add_argument('--json', action='store_true', help='Print the results as JSON')
+    parser.add_argument('--output', help='Also write the results as JSON to this file')
+    parser.add_argument('--compare', help='JSON results of an earlier run to compare with')
+    parser.add_argument('--serve', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--unix-socket', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.serve:
+        #Run as the benchmark server in a subprocess
+        tls = args.certfile is not None
+        tarpServer.runServer(make_bench_server(), port=args.port, bindTo='127.0.0.1', engine=args.engine, unix_socket=args.unix_socket,
+                             secure=tls, **({'certfile': args.certfile, 'keyfile': args.keyfile} if tls else {}))
+        return
+
+    kinds = [k.strip().lower() for k in args.kinds.split(',')]
+    types = [p.strip().lower() for p in args.payloads.split(',')]
+    transports = [t.strip().lower() for t in args.transports.split(',')]
+    for name, values, allowed in (('kind', kinds, KINDS), ('payload', types, PAYLOADS), ('transport', transports, TRANSPORTS)):
+        for value in values:
+            if value not in allowed:
+                parser.error(f"Unknown {name} {value}, use one of {', '.join(allowed)}")
+    if 'array' in types and numpy is None:
+        print('NumPy is not installed, skipping array payloads', file=sys.stderr)
+        types.remove('array')
+    sizes = [parse_size(s) for s in args.sizes.split(',')]
+    concurrencies = [int(c) for c in args.concurrency.split(',')]
+    tls_settings = [setting.strip().lower() in ('on', 'true', 'yes', '1') for setting in args.tls.split(',')]
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = {case_key(r): r for r in json.load(f)['results']}
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        certfile, keyfile = args.certfile, args.keyfile
+        if any(tls_settings) and certfile is None:
+            certfile, keyfile = make_certificate(directory)
+        #A Unix socket serves plain HTTP, so it is only benchmarked without TLS
+        settings = [(tls, transport) for tls in tls_settings for transport in transports if not (tls and transport == 'unix')]
+        for tls, transport in settings:
+            unix_socket = os.path.join(directory, 'bench.sock') if transport == 'unix' else None
+            #runServer announces itself on stdout, which must only hold the results
+            with contextlib.redirect_stdout(sys.stderr):
+                server = benchServer(args.engine, tls, certfile, keyfile, args.in_process, not args.no_compress, unix_socket)
+                try:
+                    server.connect().close()
+                except BaseException:
+                    server.close()
+                    raise
+            try:
+                if not args.json:
+                    print(HEADER)
+                for kind in kinds:
+                    for payload_type in types:
+                        for size in sizes:
+                            for concurrency in concurrencies:
+                                result = run_case(server, kind, payload_type, size, concurrency, args.requests, args.duration, args.warmup)
+                                results.append(result)
+                                if not args.json:
+                                    print(format_row(result, baseline.get(case_key(result))), flush=True)
+            finally:
+                server.close()
+
+    report = {
+        'meta': {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'), 'python': platform.python_version(), 'platform': platform.platform(),
+            'cpus': os.cpu_count(), 'engine': args.engine, 'in_process': args.in_process, 'compress': not args.no_compress,
+            'requests': args.requests, 'duration': args.duration, 'warmup': args.warmup,
+        },
+        'results': results,
+    }
+    if args.json:
+        print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -13,10 +13,232 @@
 #   limitations under the License.
 
 import requests
+import requests.adapters
+import urllib3
+import socket
+from urllib.parse import urlparse, unquote
+import contextlib
+import contextvars
+import hashlib
 import json
+import os
+import tempfile
+import threading
 import time
 import base64
 import pickle
+from . import wire
+from . import compress
+from . import metrics
+from . import jsonenc
+from . import arrays
+from . import shm
+
+#Phases of a call timed by the client, in the order they happen:
+#  encode   pickling or encoding the arguments, and anything else before the request
+#  connect  waiting for a pooled connection and opening a new one (with TLS if used)
+#  send     sending the request line, headers and body
+#  wait     waiting for the server to start its response
+#  receive  reading the response body
+#  decode   unpickling or decoding the result
+CLIENT_PHASES = ('encode', 'connect', 'send', 'wait', 'receive', 'decode')
+
+class callTimer(metrics.requestTimer):
+    """Times the phases of a call on the client. server holds the Server-Timing
+    header of the last response received for the call."""
+    __slots__ = ('server',)
+
+    def __init__(self):
+        super().__init__('encode')
+        self.server = None
+
+#The timer of the call being made in this thread or asyncio task, if any
+activeTimer = contextvars.ContextVar('activeTimer', default=None)
+
+def timePhase(phase):
+    """Starts the next phase of the call being timed, if there is one."""
+    timer = activeTimer.get()
+    if timer is not None:
+        timer.switch(phase)
+
+@contextlib.contextmanager
+def timedCall(owner, name):
+    """Times a call made by a client and reports it through owner.lastTiming and
+    owner.timingHook. Calls made while another is being timed are counted as part of it."""
+    if not owner.timing or activeTimer.get() is not None:
+        yield
+        return
+    timer = callTimer()
+    token = activeTimer.set(timer)
+    try:
+        yield
+    finally:
+        activeTimer.reset(token)
+        timer.switch(None)
+        owner.lastTiming = {
+            'call': name,
+            'total': timer.total(),
+            'client': {phase: timer.phases[phase] for phase in CLIENT_PHASES if phase in timer.phases},
+            'server': metrics.parse_server_timing(timer.server),
+        }
+        if owner.timingHook is not None:
+            owner.timingHook(owner.lastTiming)
+
+#urllib3 connections and pools that mark where each phase of a call starts and ends
+class timedConnection:
+    def connect(self):
+        timePhase('connect')
+        try:
+            super().connect()
+        finally:
+            timePhase('send')
+
+    def request(self, *args, **kwargs):
+        timePhase('send')
+        try:
+            super().request(*args, **kwargs)
+        finally:
+            timePhase('wait')
+
+    def getresponse(self, *args, **kwargs):
+        try:
+            return super().getresponse(*args, **kwargs)
+        finally:
+            timePhase('receive')
+
+class timedHTTPConnection(timedConnection, urllib3.connection.HTTPConnection):
+    pass
+
+class timedHTTPSConnection(timedConnection, urllib3.connection.HTTPSConnection):
+    pass
+
+class timedPool:
+    def _get_conn(self, timeout=None):
+        timePhase('connect')
+        return super()._get_conn(timeout)
+
+class timedHTTPConnectionPool(timedPool, urllib3.HTTPConnectionPool):
+    ConnectionCls = timedHTTPConnection
+
+class timedHTTPSConnectionPool(timedPool, urllib3.HTTPSConnectionPool):
+    ConnectionCls = timedHTTPSConnection
+
+class timedAdapter(requests.adapters.HTTPAdapter):
+    """A requests adapter whose connections report the phases of the call being timed."""
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {'http': timedHTTPConnectionPool, 'https': timedHTTPSConnectionPool}
+
+#Requests to a server on a Unix domain socket are made to this URL through a unixAdapter
+UNIX_URL = 'http://localhost'
+
+def unixSocketPath(server_url):
+    """Returns the socket path of a unix:///path/to/socket URL, or None for any other URL."""
+    parsed = urlparse(server_url)
+    if parsed.scheme != 'unix':
+        return None
+    return unquote(parsed.netloc + parsed.path).rstrip('/')
+
+class unixHTTPConnection(timedHTTPConnection):
+    """An HTTP connection over the Unix domain socket at socket_path (set by unixAdapter)."""
+    socket_path = None
+
+    def _new_conn(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if isinstance(self.timeout, (int, float)):
+            sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.socket_path)
+        except OSError as e:
+            sock.close()
+            raise urllib3.exceptions.NewConnectionError(self, f"Failed to connect to {self.socket_path}: {e}") from e
+        return sock
+
+class unixAdapter(timedAdapter):
+    """A timedAdapter that sends every http:// request to the server on a Unix socket."""
+    def __init__(self, socket_path, **kwargs):
+        self.socket_path = socket_path
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        connection = type('unixHTTPConnection', (unixHTTPConnection,), {'socket_path': self.socket_path})
+        self.poolmanager.pool_classes_by_scheme = {'http': type('unixHTTPConnectionPool', (timedHTTPConnectionPool,), {'ConnectionCls': connection})}
+
+METHOD_KINDS = {'GET': 'GET method', 'POST': 'POST method', 'RPC': 'RPC method', 'ASYNCRPC': 'Asynchronous RPC method'}
+
+#Lists of endpoints are cached in this directory, one file per server URL
+MANIFEST_DIRECTORY = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'), 'tarp', 'manifests')
+
+def manifestPath(directory, server_url):
+    return os.path.join(directory, hashlib.sha256(server_url.encode('utf-8')).hexdigest() + '.json')
+
+def readManifest(directory, server_url):
+    """Returns the cached list of endpoints of a server as a dict with its 'etag',
+    the time it was 'saved' and the 'manifest' itself, or None if there is none."""
+    if not directory:
+        return None
+    try:
+        with open(manifestPath(directory, server_url)) as f:
+            cached = json.load(f)
+        if cached.get('server_url') != server_url:
+            return None
+        return cached
+    except (OSError, ValueError):
+        return None
+
+def writeManifest(directory, server_url, etag, manifest):
+    """Caches the list of endpoints of a server. Failing to write it is not an error."""
+    if not directory or not etag:
+        return
+    try:
+        os.makedirs(directory, exist_ok=True)
+        #Write to a temporary file and rename it so that readers never see part of a file
+        fd, path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    except OSError:
+        return
+    try:
+        with open(fd, 'w') as f:
+            json.dump({'server_url': server_url, 'etag': etag, 'saved': time.time(), 'manifest': manifest}, f)
+        os.replace(path, manifestPath(directory, server_url))
+    except OSError:
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+def sharedMemoryInfo(shared_memory, server_url, manifest):
+    """Returns the server's shared memory settings from its endpoint list if a client
+    should use them, None otherwise. The client must see the same directory as the server."""
+    info = manifest.get('SHM')
+    if shared_memory is False or info is None or shm.SHM_CAPABILITY not in manifest.get('CAPABILITIES', []):
+        return None
+    if shared_memory is None and not shm.is_local(server_url):
+        return None
+    if shm.host_id(info['directory']) != info['host_id']:
+        return None
+    return info
+
+def packFrames(info, frames):
+    """Packs the frames of an RPC call's arguments with their large buffers in shared
+    memory, info being the settings from sharedMemoryInfo. Returns None if shared
+    memory is not used, there are no large buffers, or they do not fit, so that the
+    frames are sent as usual."""
+    if info is None:
+        return None
+    try:
+        packed = shm.pack_frames(frames, info['threshold'], info['directory'])
+    except OSError:
+        return None
+    if not shm.has_segments(packed):
+        return None
+    return packed
+
+def framedLength(headers):
+    """The length of a framed response from its headers, None if it is not known."""
+    if 'Content-Encoding' in headers or not headers.get('Content-Length'):
+        return None
+    return int(headers['Content-Length'])
 
 #Custom exception for "Operation in progress"
 class OperationInProgress(Exception):
@@ -66,6 +288,12 @@ class client:
         def waitCycle(self):
             """Wait for the asynchronous operation to complete, checking status periodically."""
             pb = self.probe()
+            if pb['status'] == 'in_progress' and self.client.useLongPoll:
+                #The server holds the probe open until the operation finishes,
+                #so the result is available as soon as it is ready
+                pb = self.client.probe(self.ID, timeout=pb['suggested_wait'])
+                if pb['status'] == 'in_progress':
+                    return None
             if pb['status'] == 'in_progress':
                 time.sleep(pb['suggested_wait'])
                 return None
@@ -78,15 +306,262 @@ class client:
             result = self.probe()
             return result.get('status', 'unknown')
 
-    def __init__(self, server_url, server_key=None):
-        self.server_url = server_url.rstrip('/')
+    class batchResult:
+        """The result of a call made inside a client.batch() block. It is filled in
+        when the block ends."""
+        def __init__(self):
+            self.done = False
+            self.value = None
+            self.error = None
+
+        def result(self):
+            """Return the result of the call, raising its exception if it failed."""
+            if not self.done:
+                raise Exception("Batch has not been sent yet.")
+            if self.error is not None:
+                raise self.error
+            return self.value
+
+    class rpcBatch:
+        """Collects RPC calls made on it and sends them as one batch when the
+        with block ends. Each call returns a batchResult."""
+        def __init__(self, client, concurrent=False):
+            object.__setattr__(self, 'client', client)
+            object.__setattr__(self, 'concurrent', concurrent)
+            object.__setattr__(self, 'calls', [])
+            object.__setattr__(self, 'results', [])
+
+        def __getattr__(self, name):
+            def deferred_call(*args, **kwargs):
+                result = self.client.batchResult()
+                self.calls.append((name, args, kwargs))
+                self.results.append(result)
+                return result
+            return deferred_call
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, exc_type, exc_value, traceback):
+            if exc_type is not None or not self.calls:
+                return
+            values = self.client.call_many(self.calls, concurrent=self.concurrent, return_exceptions=True)
+            for result, value in zip(self.results, values):
+                result.done = True
+                if isinstance(value, Exception):
+                    result.error = value
+                else:
+                    result.value = value
+
+    def __init__(self, server_url, server_key=None, max_connections=10, idle_timeout=30, timeout=None, binary=True, poll_timeout=30, compress_responses=True, compress_requests=False, compress_min_size=1024, compress_level=None, timing=True, timing_hook=None, lazy=False, manifest_cache=False, manifest_max_age=0, array_format=None, shared_memory=None):
+        #A unix:///path/to/socket URL reaches a server listening on that Unix domain
+        #socket. Requests then go to UNIX_URL and server_name keeps the real URL
+        self.server_name = server_url.rstrip('/')
+        self.socketPath = unixSocketPath(server_url)
+        self.server_url = UNIX_URL if self.socketPath else self.server_name
         self.server_key = server_key
         self.remoteNames = []
-        self.loadEndpoints()
+        #The list of endpoints is fetched here, or when a remote method is first
+        #used if lazy is True. It is cached on disk in manifest_cache (a directory,
+        #or True for the default one) if that is given and trusted without asking the server for
+        #manifest_max_age seconds after it was last fetched or revalidated
+        self.remoteEndpoints = None
+        self.manifestLock = threading.Lock()
+        self.manifestDirectory = MANIFEST_DIRECTORY if manifest_cache is True else manifest_cache
+        self.manifest_max_age = manifest_max_age
+        #Each call is timed unless timing is False. The phases of the last call to
+        #finish are put in lastTiming and passed to timing_hook if it is given
+        self.timing = timing
+        self.timingHook = timing_hook
+        self.lastTiming = None
+        #Use the framed binary wire format for RPC calls if the server supports it.
+        #Set binary=False to force the older JSON format
+        self.binary = binary
+        self.useFrames = False
+        self.useBatch = False
+        #Large RPC arguments and results are passed through shared memory files if the
+        #server allows it and sees the same files. By default (None) only if the server
+        #URL names this machine, True to try with any URL, False never
+        self.shared_memory = shared_memory
+        self.sharedMemory = None
+        #Waiting for an asynchronous result holds a request open on the server for
+        #up to poll_timeout seconds, so the result arrives as soon as it is ready
+        self.poll_timeout = poll_timeout
+        self.useLongPoll = False
+        #Responses are compressed by the server if it supports it unless compress_responses
+        #is False. Request bodies of at least compress_min_size bytes are compressed if
+        #compress_requests is True and the server can decode them
+        self.compress_requests = compress_requests
+        self.compress_min_size = compress_min_size
+        self.compress_level = compress_level
+        self.requestEncoding = None
+        #GET and POST endpoints that return arrays send them in array_format ('npy',
+        #'npz' or 'arrow') rather than JSON if it is set and the server can
+        self.arrayHeaders = {'Accept': f'{arrays.MIMETYPES[array_format]}, application/json;q=0.5'} if array_format else {}
+        #Connections to the server are kept alive and reused between calls.
+        #max_connections is a hard limit, extra concurrent calls block until one is free.
+        #Connections left idle for longer than idle_timeout seconds are dropped
+        #rather than reused, because the server will have closed them by then
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.session = requests.Session()
+        if self.socketPath:
+            self.adapter = unixAdapter(self.socketPath, pool_connections=1, pool_maxsize=max_connections, pool_block=True)
+        else:
+            self.adapter = timedAdapter(pool_connections=1, pool_maxsize=max_connections, pool_block=True)
+        self.session.mount('http://', self.adapter)
+        self.session.mount('https://', self.adapter)
+        if not compress_responses:
+            self.session.headers['Accept-Encoding'] = 'identity'
+        self.lastUsed = time.monotonic()
         self.config = self.configInfo(self)
+        if not lazy:
+            self.ensureEndpoints()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """Close all pooled connections to the server."""
+        self.session.close()
+
+    def request(self, method, url, **kwargs):
+        """Make an HTTP request to the server through the connection pool."""
+        now = time.monotonic()
+        if self.idle_timeout is not None and now - self.lastUsed > self.idle_timeout:
+            self.adapter.poolmanager.clear()
+        self.lastUsed = now
+        kwargs.setdefault('verify', self.server_key)
+        kwargs.setdefault('timeout', self.timeout)
+        resp = self.session.request(method, url, **kwargs)
+        timer = activeTimer.get()
+        if timer is not None:
+            timer.server = resp.headers.get('Server-Timing')
+        return resp
+
+    def encodeBody(self, data, headers):
+        """Compress a request body if compress_requests is set and the server can decode it.
+        Returns the body and headers to send."""
+        if self.requestEncoding is None or not isinstance(data, (bytes, bytearray, wire.framedBody)) or len(data) < self.compress_min_size:
+            return data, headers
+        headers = dict(headers, **{'Content-Encoding': self.requestEncoding})
+        return compress.compress(data, self.requestEncoding, self.compress_level), headers
+
+    def rpcRequest(self, url, args, kwargs):
+        """Send the arguments of an RPC or AsyncRPC call to the server."""
+        if self.useFrames:
+            frames = wire.dump_frames((args, kwargs))
+            packed = packFrames(self.sharedMemory, frames)
+            if packed is not None:
+                try:
+                    headers = {'Content-Type': shm.SHM_MIMETYPE, 'Accept': self.framesAccept()}
+                    return self.request('POST', url, data=shm.dumps(packed), headers=headers, stream=True)
+                finally:
+                    #The server has taken the files by the time it replies, unless it failed
+                    shm.release(packed)
+            #The frames are streamed to the socket and the response is read
+            #straight from it, see readFrames
+            headers = {'Content-Type': wire.PICKLE_MIMETYPE, 'Accept': self.framesAccept()}
+            body, headers = self.encodeBody(wire.framedBody(frames), headers)
+            return self.request('POST', url, data=body, headers=headers, stream=True)
+        #Prepare the payload as a JSON object with base64 encoded pickles
+        payload = {
+            'args': base64.b64encode(pickle.dumps(args)).decode('utf-8'),
+            'kwargs': base64.b64encode(pickle.dumps(kwargs)).decode('utf-8')
+        }
+        headers = {'Content-Type': 'application/json'}
+        body, headers = self.encodeBody(json.dumps(payload).encode('utf-8'), headers)
+        return self.request('POST', url, data=body, headers=headers)
+
+    def framesAccept(self):
+        """The Accept header for framed responses, which may come through shared memory."""
+        return f'{shm.SHM_MIMETYPE}, {wire.PICKLE_MIMETYPE}' if self.sharedMemory is not None else wire.PICKLE_MIMETYPE
+
+    def readFrames(self, resp):
+        """Read a framed binary response from the socket into preallocated buffers.
+        Data is read in blocks so the only transient copy is a single block."""
+        def readinto(view):
+            data = resp.raw.read(min(view.nbytes, 1 << 20), decode_content=True)
+            view[:len(data)] = data
+            return len(data)
+        return wire.read_frames(readinto, framedLength(resp.headers))
+
+    def iterLines(self, resp):
+        """Lazily yield the items of a newline delimited JSON stream."""
+        finished = False
+        try:
+            for line in resp.iter_lines(chunk_size=65536):
+                if line:
+                    yield jsonenc.loads(line)
+            finished = True
+        except requests.exceptions.ChunkedEncodingError:
+            raise Exception("Streamed response ended early, the server reported an error")
+        finally:
+            #Close a partly read stream so its connection is not returned to the pool
+            if not finished:
+                resp.close()
+
+    def iterFrames(self, resp):
+        """Lazily yield the items of a streamed RPC result."""
+        finished = False
+        try:
+            while True:
+                kind, value = wire.load_frames(self.readFrames(resp))
+                if kind == 'item':
+                    yield value
+                    continue
+                #Read the end of the chunked body so the connection goes back to the pool
+                resp.raw.read()
+                finished = True
+                if kind == 'error':
+                    self.raiseAPIerror(*value)
+                return
+        except (EOFError, requests.exceptions.RequestException):
+            raise Exception("Streamed response ended early")
+        finally:
+            #Close a partly read stream so its connection is not returned to the pool
+            if not finished:
+                resp.close()
+
+    def rpcResult(self, resp, name):
+        """Unpack the pickled result of an RPC call from either wire format."""
+        if resp.status_code == 200 and resp.headers.get('Content-Type') == wire.PICKLE_MIMETYPE:
+            frames = self.readFrames(resp)
+            timePhase('decode')
+            return wire.load_frames(frames)
+        if resp.status_code == 200 and resp.headers.get('Content-Type') == wire.STREAM_MIMETYPE:
+            return self.iterFrames(resp)
+        if resp.status_code == 200 and resp.headers.get('Content-Type') == shm.SHM_MIMETYPE:
+            body = resp.content
+            timePhase('decode')
+            return shm.loads(body, self.sharedMemory['directory'])
+        mime, results = self.checkAPIresult(resp)
+        if mime == wire.PICKLE_MIMETYPE:
+            return wire.loads(results)
+        if mime != 'application/json':
+            raise Exception(f"RPC endpoint {name} returned non-JSON response: {mime}")
+        #Unpack the results from base64 encoded pickles
+        return pickle.loads(base64.b64decode(results['payload']))
+
+    def raiseAPIerror(self, type, message, retry_after=None):
+        """Raise the exception matching an error type reported by the server."""
+        if type == 'OperationInProgress':
+            raise OperationInProgress(message or 'Operation in progress', retry_after=int(retry_after or 5))
+        elif type == 'InvalidServerState':
+            raise InvalidServerState(message or 'Invalid server state')
+        else:
+            raise Exception(message or 'Unknown error')
 
     def checkAPIresult(self, response):
         """Check if the API response is successful."""
+        #Read the whole body first so that reading and decoding it are timed
+        #separately. Streams are read as their items are used
+        if response.status_code != 200 or response.headers.get('Content-Type') != wire.NDJSON_MIMETYPE:
+            response.content
+            timePhase('decode')
         if response.status_code == 404:
             raise Exception("API endpoint not found.")        
         if response.status_code != 200:
@@ -95,113 +570,183 @@ class client:
                 json_response = response.json()
             except json.JSONDecodeError:
                 raise Exception(f"API Error: {response.status_code} - {response.text}")            
-            if (json_response.get('type',None) == 'OperationInProgress'):
-                retry_after = int(response.headers.get('Retry-After', 5))
-                raise OperationInProgress(json_response.get('message', 'Operation in progress'), retry_after=retry_after)
-            elif (json_response.get('type',None) == 'InvalidServerState'):
-                raise InvalidServerState(json_response.get('message', 'Invalid server state'))
-            else:
-                raise Exception(json_response.get('message', 'Unknown error'))
-            
+            self.raiseAPIerror(json_response.get('type',None), json_response.get('message'), response.headers.get('Retry-After', 5))
+
+        #Streamed results are returned as a lazy iterator over the items
+        if response.headers.get('Content-Type') == wire.NDJSON_MIMETYPE:
+            return wire.NDJSON_MIMETYPE, self.iterLines(response)
+        #Arrays sent in a binary format are decoded into arrays
+        if response.headers.get('Content-Type') in arrays.FORMATS:
+            return response.headers.get('Content-Type'), arrays.decode(response.headers.get('Content-Type'), response.content)
         #Now check the mime type. If it is not application/json have done all possible error checking, so return the result as binary1
         if response.headers.get('Content-Type') != 'application/json':
             return response.headers.get('Content-Type'), response.content
-        json = response.json()
-        if (json['status'] != 'success'):
-            raise Exception(f"API Error: {json.get('message', 'Unknown error')}")
-        return json.get('mimetype'), json.get('result', None)
+        result = jsonenc.loads(response.content)
+        if (result['status'] != 'success'):
+            raise Exception(f"API Error: {result.get('message', 'Unknown error')}")
+        return result.get('mimetype'), result.get('result', None)
 
 
     def loadEndpoints(self):
-        """Fetch available endpoints from the control server."""
-        resp = requests.get(f"{self.server_url}/", verify=self.server_key)
-        mimetype, result = self.checkAPIresult(resp)
-        posts = result.get('POST', [])
-        gets = result.get('GET', [])
-        rpcs = result.get('RPC', [])
-        asyncRPCs = result.get('ASYNCRPC', [])
-
-        #Now monkey patch the methods to this instance to match get endpoints
-        #Methods take keyword arguments that are converted to query parameters
-        for endpoint in gets:
-            name = endpoint['name'].replace('/', '_')
+        """Fetch the available endpoints from the server. A cached copy of the list is
+        revalidated with its ETag, so the server only sends it again if it has changed."""
+        cached = readManifest(self.manifestDirectory, self.server_name)
+        if cached is not None and self.manifest_max_age and time.time() - cached['saved'] < self.manifest_max_age:
+            self.applyManifest(cached['manifest'])
+            return
+        headers = {'If-None-Match': cached['etag']} if cached is not None and cached.get('etag') else {}
+        resp = self.request('GET', f"{self.server_url}/", headers=headers)
+        if resp.status_code == 304 and cached is not None:
+            result = cached['manifest']
+        else:
+            mimetype, result = self.checkAPIresult(resp)
+        writeManifest(self.manifestDirectory, self.server_name, resp.headers.get('ETag'), result)
+        self.applyManifest(result)
+
+    def ensureEndpoints(self):
+        """Load the endpoints if that has not been done yet."""
+        if self.remoteEndpoints is None:
+            with self.manifestLock:
+                if self.remoteEndpoints is None:
+                    self.loadEndpoints()
+
+    def applyManifest(self, result):
+        """Set up the client from the list of endpoints returned by the server.
+        The methods for the endpoints are made when they are first used, see __getattr__."""
+        self.useFrames = self.binary and wire.PICKLE_CAPABILITY in result.get('CAPABILITIES', [])
+        self.useBatch = self.useFrames and 'batch' in result.get('CAPABILITIES', [])
+        self.useLongPoll = bool(self.poll_timeout) and 'long-poll' in result.get('CAPABILITIES', [])
+        self.sharedMemory = sharedMemoryInfo(self.shared_memory, self.server_url, result) if self.useFrames else None
+        if self.compress_requests and 'content-encoding' in result.get('CAPABILITIES', []):
+            self.requestEncoding = next((e for e in compress.ENCODINGS if e in result.get('ENCODINGS', [])), None)
+        remoteEndpoints = {}
+        for kind in ('GET', 'POST', 'RPC', 'ASYNCRPC'):
+            for endpoint in result.get(kind, []):
+                remoteEndpoints[endpoint['name'].replace('/', '_')] = (kind, endpoint)
+        self.remoteNames = list(remoteEndpoints)
+        self.remoteEndpoints = remoteEndpoints
+        #Endpoints named like one of the client's own methods replace it on this
+        #instance, which __getattr__ would never be asked for
+        for name in remoteEndpoints:
+            if hasattr(type(self), name):
+                setattr(self, name, self.makeMethod(name))
+
+    def __getattr__(self, name):
+        #Only called for attributes that are not found normally, so a remote
+        #method is made the first time it is used and then kept on the instance
+        if name.startswith('_') or 'remoteEndpoints' not in self.__dict__:
+            raise AttributeError(name)
+        try:
+            self.ensureEndpoints()
+        except Exception as e:
+            #hasattr and getattr with a default expect AttributeError. The error
+            #from the server is kept as the cause
+            raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}', and the remote methods could not be fetched: {e}") from e
+        if name not in self.remoteEndpoints:
+            raise AttributeError(f"'{type(self).__name__}' object has no attribute or remote method '{name}'")
+        method = self.makeMethod(name)
+        setattr(self, name, method)
+        return method
+
+    def __dir__(self):
+        return list(super().__dir__()) + list(self.remoteEndpoints or [])
+
+    def makeMethod(self, name):
+        """Make the method that calls a remote endpoint."""
+        kind, endpoint = self.remoteEndpoints[name]
+        if kind == 'GET':
+            #Methods take keyword arguments that are converted to query parameters
             def get_method(name=name, **kwargs):
                 params = '&'.join(f"{k}={v}" for k, v in kwargs.items())
                 url = f"{self.server_url}/{name}?{params}"
-                resp = requests.get(url, verify=self.server_key)
-                return self.checkAPIresult(resp)
-            self.__setattr__(name, get_method)
-            self.remoteNames.append(name)
-            #Now set the docstring to the endpoint description
-            get_method.__doc__ = endpoint.get('description', f"GET method for {name}")
-        #Now monkey patch the methods to this instance to match post endpoints
-        for endpoint in posts:
-            name = endpoint['name'].replace('/', '_')
+                with timedCall(self, name):
+                    resp = self.request('GET', url, headers=self.arrayHeaders, stream=True)
+                    return self.checkAPIresult(resp)
+            method = get_method
+        elif kind == 'POST':
             def post_method(payload=None, name=name, **kwargs):
                 url = f"{self.server_url}/{name}"
                 params = '&'.join(f"{k}={v}" for k, v in kwargs.items())
                 if params:
                     url += f"?{params}"
-                #Check the payload type and set the mimetype accordingly
-                if payload:
-                    if isinstance(payload, dict):
-                        headers = {'Content-Type': 'application/json'}
-                        payload = json.dumps(payload).encode('utf-8')
-                    else:
-                        headers = {'Content-Type': 'application/octet-stream'}
-                    resp = requests.post(url, data=payload, headers=headers, verify=self.server_key)
-                else :
-                    resp = requests.post(url, verify=self.server_key)
-                #Check the response and return the result
-                return self.checkAPIresult(resp)                
-            self.__setattr__(name, post_method)
-            self.remoteNames.append(name)
-            #Now set the docstring to the endpoint description
-            post_method.__doc__ = endpoint.get('description', f"POST method for {name}")
-
-        #Now monkey patch the methods to this instance to match rpc endpoints
-        for endpoint in rpcs:
-            name = endpoint['name'].replace('/', '_')
+                with timedCall(self, name):
+                    #Check the payload type and set the mimetype accordingly
+                    if payload:
+                        if isinstance(payload, dict):
+                            headers = {'Content-Type': 'application/json'}
+                            payload = json.dumps(payload).encode('utf-8')
+                        else:
+                            headers = {'Content-Type': 'application/octet-stream'}
+                        payload, headers = self.encodeBody(payload, headers)
+                        resp = self.request('POST', url, data=payload, headers={**self.arrayHeaders, **headers}, stream=True)
+                    else :
+                        resp = self.request('POST', url, headers=self.arrayHeaders, stream=True)
+                    #Check the response and return the result
+                    return self.checkAPIresult(resp)
+            method = post_method
+        elif kind == 'RPC':
             def rpc_method(*args, name=name, **kwargs):
                 url = f"{self.server_url}/{name}"
-                #Prepare the payload as a JSON object with base64 encoded pickles
-                payload = {
-                    'args': base64.b64encode(pickle.dumps(args)).decode('utf-8'),
-                    'kwargs': base64.b64encode(pickle.dumps(kwargs)).decode('utf-8')
-                }
-                headers = {'Content-Type': 'application/json'}
-                resp = requests.post(url, data=json.dumps(payload).encode('utf-8'), headers=headers, verify=self.server_key)
-                mime, results = self.checkAPIresult(resp)
-                if mime != 'application/json':
-                    raise Exception(f"RPC endpoint {name} returned non-JSON response: {mime}")
-                #Unpack the results from base64 encoded pickles
-                return pickle.loads(base64.b64decode(results['payload']))
-            self.__setattr__(name, rpc_method)
-            self.remoteNames.append(name)
-            #Now set the docstring to the endpoint description
-            rpc_method.__doc__ = endpoint.get('description', f"RPC method for {name}")
-
-        #Now monkey patch the methods to this instance to match rpc endpoints
-        for endpoint in asyncRPCs:
-            name = endpoint['name'].replace('/', '_')
-            def rpc_method(*args, name=name, **kwargs):
+                with timedCall(self, name):
+                    resp = self.rpcRequest(url, args, kwargs)
+                    return self.rpcResult(resp, name)
+            method = rpc_method
+        else:
+            def async_rpc_method(*args, name=name, **kwargs):
                 url = f"{self.server_url}/{name}"
-                #Prepare the payload as a JSON object with base64 encoded pickles
-                payload = {
-                    'args': base64.b64encode(pickle.dumps(args)).decode('utf-8'),
-                    'kwargs': base64.b64encode(pickle.dumps(kwargs)).decode('utf-8')
-                }
-                headers = {'Content-Type': 'application/json'}
-                resp = requests.post(url, data=json.dumps(payload).encode('utf-8'), headers=headers, verify=self.server_key)
-                mime, results = self.checkAPIresult(resp)
+                with timedCall(self, name):
+                    resp = self.rpcRequest(url, args, kwargs)
+                    mime, results = self.checkAPIresult(resp)
                 if mime != 'application/json':
                     raise Exception(f"RPC endpoint {name} returned non-JSON response: {mime}")
-                #Unpack the results from base64 encoded pickles
                 return self.asyncResult(self, results['ID'])
-            self.__setattr__(name, rpc_method)
-            self.remoteNames.append(name)
-            #Now set the docstring to the endpoint description
-            rpc_method.__doc__ = endpoint.get('description', f"Asynchronous RPC method for {name}")
+            method = async_rpc_method
+        #Set the docstring to the endpoint description
+        method.__doc__ = endpoint.get('description', f"{METHOD_KINDS[kind]} for {name}")
+        return method
+
+    def call_many(self, calls, concurrent=False, return_exceptions=False):
+        """Make several RPC calls in a single round trip to the server.
+        calls is a list of (name, args, kwargs) tuples, args and kwargs being optional.
+        If concurrent is True the server may run the calls at the same time, otherwise
+        they run in order. The results are returned in a list in the same order as the
+        calls. If a call failed its exception is raised, or put in the list in place of
+        the result if return_exceptions is True."""
+        calls = [(call[0], tuple(call[1]) if len(call) > 1 else (), dict(call[2]) if len(call) > 2 else {}) for call in calls]
+        self.ensureEndpoints()
+        if not self.useBatch:
+            #The server does not support batches, so make the calls one at a time
+            results = []
+            for name, args, kwargs in calls:
+                try:
+                    results.append(getattr(self, name)(*args, **kwargs))
+                except Exception as e:
+                    if not return_exceptions:
+                        raise
+                    results.append(e)
+            return results
+        with timedCall(self, 'batch'):
+            headers = {'Content-Type': wire.PICKLE_MIMETYPE, 'Accept': wire.PICKLE_MIMETYPE}
+            body, headers = self.encodeBody(wire.dumps({'calls': calls, 'concurrent': concurrent}), headers)
+            resp = self.request('POST', f"{self.server_url}/batch", data=body, headers=headers, stream=True)
+            records = self.rpcResult(resp, 'batch')
+        results = []
+        for kind, value in records:
+            if kind == 'ok':
+                results.append(value)
+                continue
+            try:
+                self.raiseAPIerror(*value)
+            except Exception as e:
+                if not return_exceptions:
+                    raise
+                results.append(e)
+        return results
+
+    def batch(self, concurrent=False):
+        """Returns a context manager that collects RPC calls and sends them to the
+        server in a single request when the with block ends."""
+        return self.rpcBatch(self, concurrent)
 
     def getEndpoints(self):
         """Returns the list of available GET endpoints."""
@@ -211,27 +756,44 @@ class client:
         """Returns the list of available POST endpoints."""
         return [endpoint['name'] for endpoint in self.posts]
     
+    def pollArguments(self, timeout):
+        """Returns the query string and request timeout for a long-poll request."""
+        if not timeout:
+            return '', self.timeout
+        #The request itself must be allowed to last longer than the poll
+        return f"&timeout={timeout}", (None if self.timeout is None else self.timeout + timeout)
+
     def wait(self, ID):
         """Wait for an asynchronous operation to complete."""
-        url = f"{self.server_url}/asyncGet?UUID={ID}"
+        self.ensureEndpoints()
+        query, request_timeout = self.pollArguments(self.poll_timeout if self.useLongPoll else None)
+        url = f"{self.server_url}/asyncGet?UUID={ID}{query}"
+        headers = {'Accept': self.framesAccept()} if self.useFrames else {}
         while True:
-            resp = requests.get(url, verify=self.server_key)
             try:
-                mime, result = self.checkAPIresult(resp)
-                if mime == 'application/json':
-                    payload = pickle.loads(base64.b64decode(result['payload']))
-                    return payload
-                else:
-                    raise Exception(f"Unexpected mimetype: {mime}")
+                with timedCall(self, 'asyncGet'):
+                    resp = self.request('GET', url, headers=headers, stream=True, timeout=request_timeout)
+                    if resp.status_code == 200 and resp.headers.get('Content-Type') in (wire.PICKLE_MIMETYPE, shm.SHM_MIMETYPE):
+                        return self.rpcResult(resp, 'asyncGet')
+                    mime, result = self.checkAPIresult(resp)
+                    if mime == 'application/json':
+                        payload = pickle.loads(base64.b64decode(result['payload']))
+                        return payload
+                    else:
+                        raise Exception(f"Unexpected mimetype: {mime}")
             except OperationInProgress as e:
                 time.sleep(e.retry_after)
                 continue
 
-    def probe(self, ID):
-        """Check the status of an asynchronous operation."""
-        url = f"{self.server_url}/asyncProbe?UUID={ID}"
-        resp = requests.get(url, verify=self.server_key)
-        mime, result = self.checkAPIresult(resp)
+    def probe(self, ID, timeout=None):
+        """Check the status of an asynchronous operation. If timeout is given and
+        the server supports it, wait up to that many seconds for the operation to finish."""
+        self.ensureEndpoints()
+        query, request_timeout = self.pollArguments(timeout if self.useLongPoll else None)
+        url = f"{self.server_url}/asyncProbe?UUID={ID}{query}"
+        with timedCall(self, 'asyncProbe'):
+            resp = self.request('GET', url, timeout=request_timeout)
+            mime, result = self.checkAPIresult(resp)
         if mime == 'application/json':
             return result
         else:
@@ -0,0 +1,130 @@
+#   Copyright 2025 Chris Brady, Heather Ratcliffe
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+# HTTP content codings shared by the TARP client and server. gzip and deflate
+# use zlib from the standard library. zstd is used when the optional zstandard
+# package is installed.
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Content codings this installation understands, most preferred first
+ENCODINGS = (['zstd'] if zstandard is not None else []) + ['gzip', 'deflate']
+
+# MIME types that are already compressed, so compressing them again wastes time
+COMPRESSED_MIMETYPES = {
+    'image/png', 'image/jpeg', 'image/gif', 'image/webp', 'image/avif',
+    'application/zip', 'application/gzip', 'application/x-gzip', 'application/zstd',
+    'application/x-bzip2', 'application/x-xz', 'application/x-7z-compressed',
+    'application/vnd.apache.parquet', 'font/woff', 'font/woff2',
+}
+COMPRESSED_PREFIXES = ('video/', 'audio/')
+
+def compressible(content_type):
+    """Returns False for MIME types whose content is already compressed."""
+    content_type = (content_type or '').split(';')[0].strip().lower()
+    return content_type not in COMPRESSED_MIMETYPES and not content_type.startswith(COMPRESSED_PREFIXES)
+
+def choose(accept_encoding, offered=ENCODINGS):
+    """Picks the first of the offered codings that an Accept-Encoding header allows,
+    or None if the response should not be compressed."""
+    if not accept_encoding:
+        return None
+    accepted = {}
+    for item in accept_encoding.split(','):
+        name, _, params = item.strip().partition(';')
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip().lower()] = quality
+    for name in offered:
+        if accepted.get(name, accepted.get('*', 0)) > 0:
+            return name
+    return None
+
+class compressor:
+    """Incremental compressor for one of the content codings. level is passed to
+    the codec, None for its default."""
+    def __init__(self, encoding, level=None):
+        if encoding == 'zstd':
+            self.codec = zstandard.ZstdCompressor(level=3 if level is None else level).compressobj()
+            self.sync_flag = zstandard.COMPRESSOBJ_FLUSH_BLOCK
+        elif encoding in ('gzip', 'deflate'):
+            level = -1 if level is None else level
+            self.codec = zlib.compressobj(level, zlib.DEFLATED, zlib.MAX_WBITS | (16 if encoding == 'gzip' else 0))
+            self.sync_flag = zlib.Z_SYNC_FLUSH
+        else:
+            raise ValueError(f"Unsupported content coding {encoding}")
+
+    def compress(self, data):
+        return self.codec.compress(data)
+
+    def sync(self):
+        """Returns everything compressed so far, so that it can be sent as a chunk of a stream."""
+        return self.codec.flush(self.sync_flag)
+
+    def flush(self):
+        return self.codec.flush()
+
+def compress(data, encoding, level=None):
+    """Compresses a buffer, or an iterable of buffers such as a framedBody, in one go."""
+    c = compressor(encoding, level)
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        return c.compress(data) + c.flush()
+    return b''.join([c.compress(part) for part in data] + [c.flush()])
+
+# Bytes of compressed input read at a time by decompressor
+DECODE_BLOCK = 65536
+
+class decompressor:
+    """Decompresses a stream in one of the content codings, reading the compressed
+    data from source (a file-like object) as it is needed. Each read returns at most
+    the number of bytes asked for, however well the data compresses, so the caller
+    can stop as soon as the output is larger than it will accept."""
+    def __init__(self, encoding, source):
+        encoding = encoding.strip().lower()
+        self.source = source
+        self.finished = False
+        if encoding == 'zstd' and zstandard is not None:
+            self.codec = None
+            self.reader = zstandard.ZstdDecompressor().stream_reader(source, read_size=DECODE_BLOCK, read_across_frames=True, closefd=False)
+        elif encoding in ('gzip', 'x-gzip'):
+            self.codec = zlib.decompressobj(zlib.MAX_WBITS | 16)
+        elif encoding == 'deflate':
+            self.codec = zlib.decompressobj()
+        else:
+            raise ValueError(f"Unsupported content coding {encoding}")
+
+    def read(self, size=DECODE_BLOCK):
+        """Returns up to size bytes of decompressed data, or b'' at the end of the stream."""
+        if self.codec is None:
+            return self.reader.read(size)
+        while not self.finished:
+            data = self.codec.unconsumed_tail
+            if not data:
+                data = self.source.read(DECODE_BLOCK)
+                if not data:
+                    self.finished = True
+                    return self.codec.flush()
+            data = self.codec.decompress(data, size)
+            if data:
+                return data
+        return b''
@@ -0,0 +1,134 @@
+#   Copyright 2025 Chris Brady, Heather Ratcliffe
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+# JSON encoding for TARP responses. On top of what the json module accepts
+# it encodes
+#   bytes, bytearray and memoryview   as base64 strings
+#   NumPy arrays                      as (nested) lists
+#   NumPy scalars                     as numbers or booleans
+# without first copying the result into a tree of plain Python objects. The
+# optional orjson package is used when it is installed, which encodes NumPy
+# arrays directly from their memory. Otherwise the json module is used, which
+# has to turn arrays into lists a block at a time.
+# iter_encode produces the encoding in pieces, so that a large result can be
+# written out as it is encoded rather than held in memory as one string.
+import base64
+import json
+import sys
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+BACKEND = 'orjson' if orjson is not None else 'json'
+# Arrays and lists longer than this are encoded in blocks of this many items by iter_encode
+BLOCK_ITEMS = 65536
+#Compact output, the same as orjson gives
+SEPARATORS = (',', ':')
+
+def default(obj):
+    """Converts the objects the JSON encoders do not know about."""
+    if isinstance(obj, (bytes, bytearray, memoryview)):
+        return base64.b64encode(obj).decode('ascii')
+    #NumPy objects can only exist if NumPy has been imported
+    numpy = sys.modules.get('numpy')
+    if numpy is not None:
+        if isinstance(obj, numpy.ndarray):
+            return obj.tolist()
+        if isinstance(obj, numpy.generic):
+            return obj.item()
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
+
+if orjson is not None:
+    ORJSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+    def dumps(obj):
+        """Encodes an object as JSON bytes."""
+        try:
+            return orjson.dumps(obj, default=default, option=ORJSON_OPTIONS)
+        except TypeError:
+            #orjson is stricter than json about some things, integers over 64 bits for one
+            return json.dumps(obj, default=default, separators=SEPARATORS).encode('utf-8')
+
+    def loads(data):
+        """Decodes JSON from bytes or a string."""
+        return orjson.loads(data)
+else:
+    def dumps(obj):
+        """Encodes an object as JSON bytes."""
+        return json.dumps(obj, default=default, separators=SEPARATORS).encode('utf-8')
+
+    def loads(data):
+        """Decodes JSON from bytes or a string."""
+        return json.loads(data)
+
+def is_array(obj):
+    numpy = sys.modules.get('numpy')
+    return numpy is not None and isinstance(obj, numpy.ndarray)
+
+def is_scalar(obj):
+    numpy = sys.modules.get('numpy')
+    return numpy is not None and isinstance(obj, numpy.generic)
+
+def iter_pieces(obj):
+    """Yields the JSON encoding of obj in pieces. Containers are taken apart only
+    where they hold something large, everything else is encoded in one go."""
+    if isinstance(obj, dict):
+        yield b'{'
+        first = True
+        for key, value in obj.items():
+            #Encoding the single entry dict gives the key exactly as the encoder would
+            entry = dumps({key: None})
+            yield (b'' if first else b',') + entry[1:entry.rindex(b':') + 1]
+            yield from iter_pieces(value)
+            first = False
+        yield b'}'
+    elif is_array(obj) and obj.ndim > 0 and obj.size > BLOCK_ITEMS:
+        #Encode blocks of whole rows, each of about BLOCK_ITEMS items
+        rows = max(1, BLOCK_ITEMS // max(1, obj.size // len(obj)))
+        yield b'['
+        for start in range(0, len(obj), rows):
+            block = dumps(obj[start:start + rows])
+            yield (b',' if start else b'') + block[1:-1]
+        yield b']'
+    elif isinstance(obj, (list, tuple)) and len(obj) > BLOCK_ITEMS:
+        yield b'['
+        for start in range(0, len(obj), BLOCK_ITEMS):
+            block = obj[start:start + BLOCK_ITEMS]
+            if start:
+                yield b','
+            if any(isinstance(item, (dict, list, tuple)) or is_array(item) for item in block):
+                for i, item in enumerate(block):
+                    if i:
+                        yield b','
+                    yield from iter_pieces(item)
+            else:
+                yield dumps(list(block))[1:-1]
+        yield b']'
+    else:
+        yield dumps(obj)
+
+def iter_encode(obj, chunk_size=1024 * 1024):
+    """Yields the JSON encoding of obj as chunks of about chunk_size bytes (more
+    if a single piece is larger). A result that encodes to less than chunk_size
+    comes out as a single chunk."""
+    buffer = bytearray()
+    for piece in iter_pieces(obj):
+        buffer += piece
+        if len(buffer) >= chunk_size:
+            yield bytes(buffer)
+            buffer.clear()
+    if buffer:
+        yield bytes(buffer)
@@ -0,0 +1,183 @@
+#   Copyright 2025 Chris Brady, Heather Ratcliffe
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+# Request metrics for the TARP server. Each request carries a requestTimer that
+# splits its time into phases:
+#   parse       reading the request line and headers
+#   deserialize reading and decoding the request body
+#   execute     running the endpoint's function
+#   serialize   encoding the result
+#   write       compressing and sending the response
+# When the request finishes its phase times are added to histograms kept per
+# endpoint by serverMetrics, which also counts requests and errors. Recording
+# a request takes one lock and a few additions, so metrics can stay on.
+import bisect
+import threading
+import time
+
+# Upper bounds of the histogram buckets in seconds
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+PHASES = ('parse', 'deserialize', 'execute', 'serialize', 'write')
+
+class requestTimer:
+    """Accumulates the time a request spends in each phase."""
+    __slots__ = ('phase', 'started', 'begun', 'phases')
+
+    def __init__(self, phase='parse'):
+        self.begun = self.started = time.perf_counter()
+        self.phase = phase
+        self.phases = {}
+
+    def switch(self, phase):
+        """Ends the current phase and starts another one. Time spent in a phase
+        more than once is added up."""
+        now = time.perf_counter()
+        self.phases[self.phase] = self.phases.get(self.phase, 0.0) + now - self.started
+        self.phase = phase
+        self.started = now
+
+    def total(self):
+        return time.perf_counter() - self.begun
+
+class histogram:
+    __slots__ = ('counts', 'sum', 'count')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """Returns (upper bound, count of observations at or below it) for each bucket."""
+        total = 0
+        result = []
+        for bound, count in zip(BUCKETS + (float('inf'),), self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+class endpointMetrics:
+    __slots__ = ('requests', 'errors', 'phases')
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = {}
+        self.phases = {phase: histogram() for phase in PHASES + ('total',)}
+
+class serverMetrics:
+    """Request counts, error counts and phase latency histograms for each endpoint,
+    keyed on the endpoint type (GET, POST, RPC, ASYNCRPC, BATCH or internal) and name."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.endpoints = {}
+        self.in_flight = 0
+        self.started = time.time()
+
+    def begin(self):
+        """Called when a request starts. Returns its timer."""
+        with self.lock:
+            self.in_flight += 1
+        return requestTimer()
+
+    def finish(self, type, endpoint, timer, error=None):
+        """Called when a request has been answered. error is the type of error reported, if any."""
+        timer.switch(None)
+        total = timer.total()
+        with self.lock:
+            self.in_flight -= 1
+            data = self.endpoints.get((type, endpoint))
+            if data is None:
+                data = self.endpoints[(type, endpoint)] = endpointMetrics()
+            data.requests += 1
+            if error is not None:
+                data.errors[error] = data.errors.get(error, 0) + 1
+            for phase, elapsed in timer.phases.items():
+                if phase in data.phases:
+                    data.phases[phase].observe(elapsed)
+            data.phases['total'].observe(total)
+
+    def snapshot(self):
+        """Returns the request metrics as a JSON serialisable dict."""
+        with self.lock:
+            requests = []
+            for (type, endpoint), data in sorted(self.endpoints.items()):
+                requests.append({
+                    'type': type, 'endpoint': endpoint, 'count': data.requests, 'errors': dict(data.errors),
+                    'phases': {phase: {'count': h.count, 'sum': h.sum, 'buckets': [[bound if bound != float('inf') else '+Inf', count] for bound, count in h.cumulative()]}
+                               for phase, h in data.phases.items() if h.count},
+                })
+            return {'uptime': time.time() - self.started, 'in_flight': self.in_flight, 'requests': requests}
+
+def server_timing(timer):
+    """Formats the phases a request has been through so far as a Server-Timing header,
+    with durations in milliseconds."""
+    parts = [f'{phase};dur={elapsed * 1000:.3f}' for phase, elapsed in timer.phases.items() if phase in PHASES]
+    parts.append(f'total;dur={timer.total() * 1000:.3f}')
+    return ', '.join(parts)
+
+def parse_server_timing(header):
+    """Reads a Server-Timing header into a dict of metric name to duration in seconds.
+    Metrics without a duration are left out."""
+    result = {}
+    for item in (header or '').split(','):
+        name, *params = item.split(';')
+        name = name.strip()
+        for param in params:
+            key, _, value = param.strip().partition('=')
+            if name and key.strip() == 'dur':
+                try:
+                    result[name] = float(value.strip('" ')) / 1000
+                except ValueError:
+                    pass
+    return result
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def labels(**values):
+    return '{' + ','.join(f'{key}="{escape(value)}"' for key, value in values.items()) + '}'
+
+def prometheus(snapshot, gauges):
+    """Formats a snapshot and a list of extra (name, type, help, [(labels dict, value)])
+    metrics in the Prometheus text exposition format."""
+    lines = []
+    def family(name, kind, help, samples):
+        lines.append(f'# HELP {name} {help}')
+        lines.append(f'# TYPE {name} {kind}')
+        for sample_labels, value in samples:
+            lines.append(f'{name}{labels(**sample_labels) if sample_labels else ""} {value}')
+    requests = snapshot['requests']
+    family('tarp_uptime_seconds', 'gauge', 'Seconds since the server started.', [({}, snapshot['uptime'])])
+    family('tarp_requests_in_flight', 'gauge', 'Requests being handled.', [({}, snapshot['in_flight'])])
+    family('tarp_requests_total', 'counter', 'Requests handled.',
+           [({'type': r['type'], 'endpoint': r['endpoint']}, r['count']) for r in requests])
+    family('tarp_errors_total', 'counter', 'Requests answered with an error, by error type.',
+           [({'type': r['type'], 'endpoint': r['endpoint'], 'error': error}, count) for r in requests for error, count in sorted(r['errors'].items())])
+    lines.append('# HELP tarp_request_phase_seconds Time spent in each phase of handling a request.')
+    lines.append('# TYPE tarp_request_phase_seconds histogram')
+    for r in requests:
+        for phase, h in r['phases'].items():
+            base = {'type': r['type'], 'endpoint': r['endpoint'], 'phase': phase}
+            for bound, count in h['buckets']:
+                lines.append(f'tarp_request_phase_seconds_bucket{labels(**base, le=bound)} {count}')
+            lines.append(f'tarp_request_phase_seconds_sum{labels(**base)} {h["sum"]}')
+            lines.append(f'tarp_request_phase_seconds_count{labels(**base)} {h["count"]}')
+    for name, kind, help, samples in gauges:
+        family(name, kind, help, samples)
+    return '\n'.join(lines) + '\n'
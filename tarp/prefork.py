@@ -0,0 +1,185 @@
+#   Copyright 2025 Chris Brady, Heather Ratcliffe
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+# Pre-forked worker processes for runServer(workers=N). A supervisor process
+# forks the workers, which all accept connections on the same listening
+# sockets, and restarts any worker that exits. When the supervisor is asked
+# to stop it sends each worker SIGTERM, and a worker then stops accepting
+# connections and finishes the requests it is handling before it exits.
+# Each worker keeps its own AsyncRPC jobs. A job's ID ends with the index of
+# the worker that started it, and each worker also listens on a private Unix
+# socket, so that a request about the job that reaches another worker is
+# passed on to the one that has it.
+import http.client
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+import traceback
+
+#Headers that only apply to one connection, so are not passed on between workers
+HOP_BY_HOP = {'connection', 'keep-alive', 'proxy-connection', 'proxy-authenticate', 'proxy-authorization', 'te', 'trailer', 'transfer-encoding', 'upgrade'}
+#Bytes copied at a time when passing a response on from another worker
+PROXY_BLOCK = 1024 * 1024
+#How often the supervisor checks on its workers, in seconds
+POLL_INTERVAL = 0.2
+#A worker that exits within MIN_UPTIME seconds of starting is restarted after a
+#delay that doubles each time this happens, up to MAX_RESTART_DELAY seconds
+MIN_UPTIME = 1
+MAX_RESTART_DELAY = 30
+
+class inFlight:
+    """Counts the requests a worker is handling, so that it can wait for them
+    to finish before it exits."""
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.count = 0
+        self.draining = False
+
+    def enter(self):
+        with self.condition:
+            self.count += 1
+
+    def leave(self):
+        with self.condition:
+            self.count -= 1
+            if self.count == 0:
+                self.condition.notify_all()
+
+    def drain(self, timeout=None):
+        """Marks the worker as draining and waits at most timeout seconds for the
+        requests in flight to finish. Returns True if they did."""
+        with self.condition:
+            self.draining = True
+            return self.condition.wait_for(lambda: self.count == 0, timeout)
+
+def socket_path(directory, index):
+    """The path of the private socket of worker index."""
+    return os.path.join(directory, f'worker-{index}.sock')
+
+def job_owner(ID):
+    """Returns the index of the worker that started the job with this ID, or None
+    if it was not started by a worker."""
+    _, dot, index = ID.rpartition('.')
+    return int(index) if dot and index.isdigit() else None
+
+class workerConnection(http.client.HTTPConnection):
+    """An HTTP connection to the private socket of a worker."""
+    def __init__(self, path, timeout=None):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.settimeout(self.timeout)
+            sock.connect(self.socket_path)
+        except OSError:
+            sock.close()
+            raise
+        self.sock = sock
+
+def exit_reason(status):
+    code = os.waitstatus_to_exitcode(status)
+    if code < 0:
+        try:
+            return f'signal {signal.Signals(-code).name}'
+        except ValueError:
+            return f'signal {-code}'
+    return f'status {code}'
+
+def start_worker(run_worker, index, handlers):
+    """Forks a process that calls run_worker(index) and exits. Returns its pid."""
+    #Anything still buffered would otherwise be written by both processes
+    sys.stdout.flush()
+    sys.stderr.flush()
+    pid = os.fork()
+    if pid:
+        return pid
+    status = 1
+    try:
+        for signum, handler in handlers.items():
+            signal.signal(signum, handler)
+        run_worker(index)
+        status = 0
+    except BaseException:
+        traceback.print_exc()
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        #Never return into the supervisor's code
+        os._exit(status)
+
+def reap(running):
+    """Yields (pid, status) for each of the running workers that has exited."""
+    while running:
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            return
+        if pid == 0:
+            return
+        if pid in running:
+            yield pid, status
+
+def supervise(run_worker, workers, drain_timeout=30):
+    """Forks workers processes that each call run_worker(index), restarting any
+    that exit, until the supervisor gets SIGTERM or SIGINT. The workers are then
+    sent SIGTERM to drain and are killed if they have not exited drain_timeout
+    seconds later, or straight away if a second signal arrives."""
+    if not hasattr(os, 'fork'):
+        raise RuntimeError('Worker processes need os.fork, which this platform does not have')
+    signals = []
+    handlers = {signum: signal.signal(signum, lambda signum, frame: signals.append(signum)) for signum in (signal.SIGTERM, signal.SIGINT)}
+    running = {} # pid: (index, time started)
+    pending = {index: 0 for index in range(workers)} # index: time to start it
+    failures = [0] * workers
+    try:
+        while not signals:
+            now = time.monotonic()
+            for index, due in list(pending.items()):
+                if now >= due:
+                    del pending[index]
+                    running[start_worker(run_worker, index, handlers)] = (index, now)
+            for pid, status in reap(running):
+                index, started = running.pop(pid)
+                now = time.monotonic()
+                failures[index] = failures[index] + 1 if now - started < MIN_UPTIME else 0
+                delay = min(MAX_RESTART_DELAY, 0.5 * 2 ** (failures[index] - 1)) if failures[index] else 0
+                print(f'Worker {index} (pid {pid}) exited with {exit_reason(status)}, restarting it{f" in {delay:g}s" if delay else ""}')
+                pending[index] = now + delay
+            time.sleep(POLL_INTERVAL)
+        print(f'Stopping {len(running)} workers')
+        for pid in running:
+            os.kill(pid, signal.SIGTERM)
+        deadline = time.monotonic() + drain_timeout
+        while running:
+            for pid, status in reap(running):
+                running.pop(pid)
+            if running and (len(signals) > 1 or time.monotonic() >= deadline):
+                break
+            time.sleep(POLL_INTERVAL)
+    finally:
+        if running:
+            print(f'Killing {len(running)} workers')
+        for pid in running:
+            try:
+                os.kill(pid, signal.SIGKILL)
+                os.waitpid(pid, 0)
+            except (ProcessLookupError, ChildProcessError):
+                pass
+        for signum, handler in handlers.items():
+            signal.signal(signum, handler)
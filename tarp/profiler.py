@@ -0,0 +1,221 @@
+#   Copyright 2025 Chris Brady, Heather Ratcliffe
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+# On demand profiling of the requests a running TARP server handles. A
+# profiling session covers the next N requests to an endpoint, or its
+# requests for the next T seconds, and is profiled in one of two ways:
+#   cprofile  every function call is traced with cProfile and the statistics
+#             of all the requests are added up into a .pstats file
+#   sample    a background thread records the stacks of the threads handling
+#             the requests every few milliseconds, giving collapsed stacks
+#             that flamegraph tools read. This costs much less than cprofile
+# When there is no session the server only checks that one attribute is None
+# for each request.
+import cProfile
+import marshal
+import pstats
+import sys
+import threading
+import time
+
+MODES = ('cprofile', 'sample')
+
+class profileSession:
+    """Profiles the requests to one endpoint (None for any) until requests have
+    been profiled or seconds have passed, whichever comes first."""
+    def __init__(self, endpoint=None, mode='cprofile', requests=None, seconds=None, interval=0.005):
+        if mode not in MODES:
+            raise ValueError(f"Unknown profiling mode {mode}, use one of {', '.join(MODES)}")
+        if requests is None and seconds is None:
+            requests = 1
+        self.endpoint = endpoint
+        self.mode = mode
+        self.requests = requests
+        self.seconds = seconds
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.deadline = None if seconds is None else time.monotonic() + seconds
+        self.begun = 0
+        self.profiled = 0
+        self.skipped = 0
+        self.running = 0
+        self.finished = False
+        self.stats = None
+        #cProfile can only trace one thread at a time on newer Pythons, so
+        #concurrent requests are skipped rather than profiled
+        self.tracing = threading.Lock()
+        self.stacks = {}
+        self.threads = set()
+        self.stopping = threading.Event()
+        self.sampler = None
+        if mode == 'sample':
+            self.sampler = threading.Thread(target=self.sample, name='tarp-profiler', daemon=True)
+            self.sampler.start()
+
+    def done(self):
+        """True once no more requests should be profiled."""
+        return (self.deadline is not None and time.monotonic() >= self.deadline) or (self.requests is not None and self.begun >= self.requests)
+
+    def begin(self, endpoint):
+        """Called when a request starts. Returns a token to pass to end, or None
+        if the request is not profiled."""
+        with self.lock:
+            if self.finished or self.done():
+                if self.running == 0:
+                    self.finish()
+                return None
+            if self.endpoint is not None and endpoint != self.endpoint:
+                return None
+            if self.mode == 'cprofile' and not self.tracing.acquire(blocking=False):
+                self.skipped += 1
+                return None
+            self.begun += 1
+            self.running += 1
+        if self.mode == 'sample':
+            token = threading.get_ident()
+            with self.lock:
+                self.threads.add(token)
+            return token
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            #Another profiler is already running in this process
+            with self.lock:
+                self.begun -= 1
+                self.running -= 1
+                self.skipped += 1
+            self.tracing.release()
+            return None
+        return profile
+
+    def end(self, token):
+        """Called when a profiled request has finished."""
+        if self.mode == 'sample':
+            with self.lock:
+                self.threads.discard(token)
+        else:
+            token.disable()
+            self.tracing.release()
+        with self.lock:
+            if self.mode == 'cprofile':
+                if self.stats is None:
+                    self.stats = pstats.Stats(token)
+                else:
+                    self.stats.add(token)
+            self.profiled += 1
+            self.running -= 1
+            if self.running == 0 and self.done():
+                self.finish()
+
+    def finish(self):
+        """Ends the session. Called with the lock held."""
+        self.finished = True
+        self.stopping.set()
+
+    def stop(self):
+        with self.lock:
+            self.finish()
+
+    def sample(self):
+        """Runs on the sampler thread, recording the stack of each thread handling
+        a profiled request every interval seconds."""
+        while not self.stopping.wait(self.interval):
+            with self.lock:
+                threads = list(self.threads)
+                if self.running == 0 and self.done():
+                    self.finish()
+            if not threads:
+                continue
+            frames = sys._current_frames()
+            for ident in threads:
+                frame = frames.get(ident)
+                if frame is None:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f'{code.co_name} ({code.co_filename}:{code.co_firstlineno})')
+                    frame = frame.f_back
+                key = ';'.join(reversed(stack))
+                with self.lock:
+                    self.stacks[key] = self.stacks.get(key, 0) + 1
+
+    def status(self):
+        with self.lock:
+            if self.running == 0 and self.done():
+                self.finish()
+            return {
+                'endpoint': self.endpoint, 'mode': self.mode, 'requests': self.requests, 'seconds': self.seconds,
+                'started': self.started, 'profiled': self.profiled, 'running': self.running, 'skipped': self.skipped,
+                'status': 'finished' if self.finished else 'running',
+            }
+
+    def result(self):
+        """Returns the profile so far as (data, mimetype, file extension): marshalled
+        pstats that pstats.Stats can load, or collapsed stacks, one 'stack count' per line."""
+        with self.lock:
+            if self.mode == 'sample':
+                lines = [f'{stack} {count}\n' for stack, count in sorted(self.stacks.items())]
+                return ''.join(lines).encode('utf-8'), 'text/plain', 'collapsed'
+            if self.stats is None:
+                return marshal.dumps({}), 'application/octet-stream', 'pstats'
+            return marshal.dumps(self.stats.stats), 'application/octet-stream', 'pstats'
+
+class requestProfiler:
+    """Holds the profiling session of a server. session is None unless requests
+    are being profiled, and the last session is kept so its result can be fetched."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.session = None
+        self.last = None
+
+    def start(self, **kwargs):
+        """Starts a profileSession with the given arguments, replacing any running one."""
+        session = profileSession(**kwargs)
+        with self.lock:
+            if self.session is not None:
+                self.session.stop()
+            self.session = self.last = session
+        return session
+
+    def stop(self):
+        with self.lock:
+            session, self.session = self.session, None
+        if session is not None:
+            session.stop()
+        return self.last
+
+    def begin(self, endpoint):
+        """Called for each request while a session is set. Returns (session, token)
+        if the request is profiled, otherwise None."""
+        session = self.session
+        if session is None:
+            return None
+        if session.finished:
+            with self.lock:
+                if self.session is session:
+                    self.session = None
+            return None
+        token = session.begin(endpoint)
+        return None if token is None else (session, token)
+
+    def end(self, profiling):
+        session, token = profiling
+        session.end(token)
+        if session.finished:
+            with self.lock:
+                if self.session is session:
+                    self.session = None
@@ -12,16 +12,39 @@
 #   See the License for the specific language governing permissions and
 #   limitations under the License.
 import ssl
+import os
 import sys
 import json
 from http.server import BaseHTTPRequestHandler, HTTPServer
-from socketserver import ThreadingMixIn
+from socketserver import ThreadingMixIn, UnixStreamServer
+import socket
+import stat
 from urllib.parse import urlparse, parse_qs
 import time
 import pickle
 import base64
 import concurrent.futures
 import uuid
+import io
+import mmap
+import tempfile
+import asyncio
+import threading
+import hashlib
+import hmac
+import itertools
+import shutil
+import signal
+from collections import OrderedDict
+from collections.abc import Iterator
+from . import wire
+from . import shm
+from . import compress
+from . import metrics
+from . import profiler
+from . import jsonenc
+from . import arrays
+from . import prefork
 
 #Custom exception for "Operation in progress"
 class OperationInProgress(Exception):
@@ -37,9 +60,11 @@ class InvalidServerState(Exception):
         super().__init__(self.message)
 
 # Simple class to return an arbitrary payload
+# If a filename is given the payload is sent as a download with that name
 class rawPayload:
-    def __init__(self, payload, mimetype = "auto"):
+    def __init__(self, payload, mimetype = "auto", filename = None):
         self.payload = payload
+        self.filename = filename
         if mimetype == "auto":
             if isinstance(payload, bytes):
                 self.mimetype = 'application/octet-stream'
@@ -52,8 +77,39 @@ class rawPayload:
 
     def __bytes__(self):
         return bytes(self.payload)
-    
+
+# File-like view of a request body, passed to endpoints registered with stream_body=True
+# so that they can process large uploads incrementally instead of receiving them in one piece
+class requestBody(io.RawIOBase):
+    def __init__(self, rfile, length, content_type=None):
+        self.rfile = rfile
+        self.length = length
+        self.remaining = length
+        self.content_type = content_type
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        if not self.remaining:
+            return 0
+        with memoryview(b) as view:
+            n = self.rfile.readinto(view.cast('B')[:self.remaining])
+        if not n:
+            raise EOFError("Request body ended early")
+        self.remaining -= n
+        return n
+
+def spooled_buffer(length, directory=None):
+    """Returns a writable mmap of the given length backed by an unnamed temporary file.
+    Large request bodies are read into these so that they live in the page cache
+    and can be written back to disk rather than pushing the server into swap."""
+    with tempfile.TemporaryFile(dir=directory) as f:
+        f.truncate(length)
+        return mmap.mmap(f.fileno(), length)
+
 # Scan through a map for any byte objects. If they are found base64 encode them
+# Results no longer need this since jsonenc encodes bytes itself, kept for existing callers
 def encode_bytes_in_map(data):
     """Recursively encodes byte objects in a dictionary or list to base64 strings."""
     if isinstance(data, dict):
@@ -75,43 +131,586 @@ def flatten_qs(qs):
     
 def api_success(result,mimetype):
     """Returns a JSON-encoded success response with the result and mimetype."""
-    return json.dumps(encode_bytes_in_map({"status": "success", "mimetype": mimetype, "result": result})).encode('utf-8')
+    return jsonenc.dumps(api_wrapper(result, mimetype))
+
+def api_wrapper(result, mimetype):
+    """Returns the API result wrapper for a success response, not yet encoded."""
+    return {"status": "success", "mimetype": mimetype, "result": result}
 
 def api_error(message, type="generic"):
     """Returns a JSON-encoded error response with the message and type of error."""
     return json.dumps({"status": "error", "type":type, "message": message}).encode('utf-8')
 
+class jobRegistry:
+    """Thread-safe registry of the jobs started by AsyncRPC endpoints.
+
+    Completed results that are never collected are dropped ttl seconds after the
+    job finishes. At most max_entries jobs are kept, and the results held in memory
+    are limited to max_bytes, with the least recently used results evicted first.
+    Results larger than spill_threshold bytes are written to a temporary file
+    instead of being kept in memory, with max_spill_bytes limiting the total on disk.
+    Jobs that are still running are never evicted."""
+    owner = None # Index of the worker process keeping the jobs, which their IDs end with (see tarp.prefork)
+
+    def __init__(self, ttl=3600, max_entries=10000, max_bytes=1024**3, spill_threshold=64 * 1024**2, max_spill_bytes=None, spill_directory=None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.spill_threshold = spill_threshold
+        self.max_spill_bytes = max_spill_bytes
+        self.spill_directory = spill_directory
+        self.lock = threading.Lock()
+        self.jobs = OrderedDict() # Kept in least recently used order
+        self.memory_bytes = 0
+        self.spilled_bytes = 0
+        self.evictions = {'expired': 0, 'max_entries': 0, 'max_bytes': 0, 'max_spill_bytes': 0}
+        self.last_sweep = 0
+        self.keys = {} # IDs of running jobs started with a key, see start
+        self.start_lock = threading.Lock()
+        self.coalesced = 0
+
+    def __contains__(self, ID):
+        return self.get(ID) is not None
+
+    def __len__(self):
+        return len(self.jobs)
+
+    def __getitem__(self, ID):
+        job = self.get(ID)
+        if job is None:
+            raise KeyError(ID)
+        return job
+
+    def add(self, future, wait, key=None):
+        """Registers the future of a new job and returns its ID. Raises
+        OperationInProgress if the registry is full of running jobs."""
+        ID = str(uuid.uuid4()) if self.owner is None else f'{uuid.uuid4()}.{self.owner}'
+        job = {'future': future, 'wait': wait, 'created': time.time(), 'completed': None, 'frames': None, 'file': None, 'size': 0, 'key': key, 'refs': 1}
+        with self.lock:
+            self.sweep()
+            if self.max_entries is not None and len(self.jobs) >= self.max_entries and not self.evict_one('max_entries'):
+                raise OperationInProgress("Too many asynchronous operations are in progress.", retry_after=wait)
+            self.jobs[ID] = job
+            if key is not None:
+                self.keys[key] = ID
+        future.add_done_callback(lambda future: self.completed(ID, job))
+        return ID
+
+    def start(self, start, wait, key=None):
+        """Calls start() to submit a job and registers the future it returns, returning
+        the job's ID. If key is given and a job started with the same key is still
+        running, its ID is returned instead and start is not called."""
+        if key is None:
+            future = start()
+            try:
+                return self.add(future, wait)
+            except OperationInProgress:
+                future.cancel()
+                raise
+        with self.start_lock:
+            with self.lock:
+                ID = self.keys.get(key)
+                if ID is not None and ID in self.jobs:
+                    #Each client sharing the job collects the result once
+                    self.jobs[ID]['refs'] += 1
+                    self.coalesced += 1
+                    return ID
+            future = start()
+            try:
+                return self.add(future, wait, key)
+            except OperationInProgress:
+                future.cancel()
+                raise
+
+    def get(self, ID):
+        """Returns the job with the given ID, or None."""
+        with self.lock:
+            self.sweep()
+            job = self.jobs.get(ID)
+            if job is not None:
+                self.jobs.move_to_end(ID)
+            return job
+
+    def pop(self, ID):
+        """Removes a job from the registry and returns it, or None if it is not there.
+        A job shared by several clients stays until each of them has collected it, and
+        job['removed'] is only set once it has gone. The caller must then close
+        job['file'] if the result was spilled."""
+        with self.lock:
+            job = self.jobs.get(ID)
+            if job is None:
+                return None
+            if job['refs'] > 1:
+                job['refs'] -= 1
+                return job
+            del self.jobs[ID]
+            self.forget(job)
+            job['removed'] = True
+            return job
+
+    def completed(self, ID, job):
+        """Called when a job's future finishes. Serialises the result once so that
+        its size is known, and writes it to a temporary file if it is large."""
+        future = job['future']
+        with self.lock:
+            #Identical calls from now on start a new job
+            if job['key'] is not None and self.keys.get(job['key']) == ID:
+                del self.keys[job['key']]
+        if future.cancelled() or future.exception() is not None:
+            with self.lock:
+                job['completed'] = time.time()
+            return
+        try:
+            frames = wire.dump_frames(future.result())
+        except Exception:
+            #Unpicklable results stay in the future and fail when they are collected
+            with self.lock:
+                job['completed'] = time.time()
+            return
+        size = sum(memoryview(frame).nbytes for frame in frames)
+        spill = None
+        if self.spill_threshold is not None and size > self.spill_threshold:
+            spill = tempfile.TemporaryFile(dir=self.spill_directory)
+            for part in wire.framedBody(frames):
+                spill.write(part)
+            #The file is read with pread, which does not see the write buffer
+            spill.flush()
+            frames = None
+        with self.lock:
+            if self.jobs.get(ID) is not job:
+                #Collected or evicted while the result was being stored
+                if spill is not None:
+                    spill.close()
+                return
+            job['completed'] = time.time()
+            job['size'] = size
+            #The stored copy replaces the future's reference to the result
+            stored = concurrent.futures.Future()
+            stored.set_result(None)
+            job['future'] = stored
+            if spill is not None:
+                job['file'] = spill
+                self.spilled_bytes += size
+            else:
+                job['frames'] = frames
+                self.memory_bytes += size
+            while self.max_bytes is not None and self.memory_bytes > self.max_bytes and self.evict_one('max_bytes', lambda job: job['frames'] is not None):
+                pass
+            while self.max_spill_bytes is not None and self.spilled_bytes > self.max_spill_bytes and self.evict_one('max_spill_bytes', lambda job: job['file'] is not None):
+                pass
+
+    def forget(self, job):
+        """Removes a job's stored result from the byte counts. Must hold the lock."""
+        if job['frames'] is not None:
+            self.memory_bytes -= job['size']
+        if job['file'] is not None:
+            self.spilled_bytes -= job['size']
+
+    def discard(self, ID, reason):
+        """Drops a job and its stored result. Must hold the lock."""
+        job = self.jobs.pop(ID)
+        self.forget(job)
+        if job['file'] is not None:
+            job['file'].close()
+        job['frames'] = None
+        self.evictions[reason] += 1
+
+    def evict_one(self, reason, match=None):
+        """Evicts the least recently used completed job (that match accepts).
+        Returns False if there was nothing to evict. Must hold the lock."""
+        for ID, job in self.jobs.items():
+            if job['completed'] is not None and (match is None or match(job)):
+                self.discard(ID, reason)
+                return True
+        return False
+
+    def sweep(self):
+        """Drops results that have not been collected within ttl seconds.
+        Runs at most once a second. Must hold the lock."""
+        now = time.time()
+        if self.ttl is None or now - self.last_sweep < 1:
+            return
+        self.last_sweep = now
+        expired = [ID for ID, job in self.jobs.items() if job['completed'] is not None and now - job['completed'] > self.ttl]
+        for ID in expired:
+            self.discard(ID, 'expired')
+
+    def result(self, job):
+        """Returns the result of a completed job, raising its exception if it failed."""
+        if job['file'] is not None:
+            #The file may be shared, so read without moving its position
+            size = os.fstat(job['file'].fileno()).st_size
+            return wire.loads(os.pread(job['file'].fileno(), size, 0))
+        if job['frames'] is not None:
+            return wire.load_frames(job['frames'])
+        return job['future'].result()
+
+    def stats(self):
+        """Returns the size of the registry and how many jobs have been evicted, for monitoring."""
+        with self.lock:
+            now = time.time()
+            running = sum(1 for job in self.jobs.values() if job['completed'] is None)
+            return {
+                'entries': len(self.jobs),
+                'in_progress': running,
+                'memory_bytes': self.memory_bytes,
+                'spilled_bytes': self.spilled_bytes,
+                'oldest_age': max((now - job['created'] for job in self.jobs.values()), default=0),
+                'evictions': dict(self.evictions),
+                'coalesced': self.coalesced,
+            }
+
+class executorPool:
+    """A named pool of worker threads or processes that RPC and AsyncRPC endpoints run on.
+    kind is 'thread' or 'process'. max_queue limits how many calls may wait for a free
+    worker, beyond which new calls are refused with OperationInProgress. initializer is
+    called with initargs once in each worker as it starts, so expensive state such as
+    loaded models or open devices can be set up once per worker rather than per call."""
+    def __init__(self, name, kind='thread', max_workers=None, max_queue=None, initializer=None, initargs=(), retry_after=1):
+        if kind == 'thread':
+            self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f'tarp-{name}', initializer=initializer, initargs=initargs)
+        elif kind == 'process':
+            self.executor = concurrent.futures.ProcessPoolExecutor(max_workers=max_workers, initializer=initializer, initargs=initargs)
+        else:
+            raise ValueError(f"Unknown pool kind {kind}, should be 'thread' or 'process'")
+        self.name = name
+        self.kind = kind
+        self.max_workers = self.executor._max_workers
+        self.max_queue = max_queue
+        self.retry_after = retry_after
+        self.lock = threading.Lock()
+        self.active = 0 # Calls submitted that have not finished yet
+
+    def submit(self, fn, *args, **kwargs):
+        """Submits a call to the pool, raising OperationInProgress if its queue is full."""
+        with self.lock:
+            if self.max_queue is not None and self.active >= self.max_workers + self.max_queue:
+                raise OperationInProgress(f"The {self.name} pool is busy.", retry_after=self.retry_after)
+            self.active += 1
+        try:
+            future = self.executor.submit(fn, *args, **kwargs)
+        except Exception:
+            self.finished(None)
+            raise
+        future.add_done_callback(self.finished)
+        return future
+
+    def finished(self, future):
+        with self.lock:
+            self.active -= 1
+
+    def stats(self):
+        """Returns the number of calls running and waiting in the pool."""
+        with self.lock:
+            active = self.active
+        return {'kind': self.kind, 'max_workers': self.max_workers, 'max_queue': self.max_queue,
+                'running': min(active, self.max_workers), 'queued': max(active - self.max_workers, 0)}
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        self.executor.shutdown(wait=wait, cancel_futures=cancel_futures)
+
+class resultCache:
+    """Least recently used cache of the responses sent by an endpoint, keyed on its
+    arguments. Entries hold the serialised response body so that a hit skips both
+    the call and the encoding. Entries expire after ttl seconds (never if None),
+    and the cache holds at most max_entries entries and max_bytes bytes of bodies."""
+    def __init__(self, ttl=None, max_entries=1024, max_bytes=64 * 1024**2):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.generation = 0 # Changes whenever the cache is cleared
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """Returns the (content_type, body) cached for key, or None."""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] is not None and entry[0] < time.time():
+                self.remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return entry[1], entry[2]
+
+    def put(self, key, content_type, body, generation):
+        """Stores a response, unless the cache was cleared since generation was read
+        (the response may then have been computed from stale state)."""
+        body = bytes(body)
+        with self.lock:
+            if generation != self.generation or (self.max_bytes is not None and len(body) > self.max_bytes):
+                return
+            if key in self.entries:
+                self.remove(key)
+            expires = time.time() + self.ttl if self.ttl is not None else None
+            self.entries[key] = (expires, content_type, body)
+            self.bytes += len(body)
+            while self.entries and ((self.max_entries is not None and len(self.entries) > self.max_entries) or (self.max_bytes is not None and self.bytes > self.max_bytes)):
+                self.remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    def remove(self, key):
+        """Removes an entry. Must hold the lock."""
+        entry = self.entries.pop(key)
+        self.bytes -= len(entry[2])
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+            self.generation += 1
+
+    def stats(self):
+        with self.lock:
+            return {'entries': len(self.entries), 'bytes': self.bytes, 'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+class singleFlight:
+    """Lets concurrent identical calls to an endpoint share one execution. The first
+    call with a key runs, and calls with the same key that arrive while it is running
+    wait for it and get the same result or exception."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.coalesced = 0
+
+    def run(self, key, func, *args, **kwargs):
+        with self.lock:
+            future = self.calls.get(key)
+            leader = future is None
+            if leader:
+                future = self.calls[key] = concurrent.futures.Future()
+            else:
+                self.coalesced += 1
+        if not leader:
+            result = future.result()
+            #An iterator can only be read by one request, so make a call of our own
+            if isinstance(result, Iterator):
+                return func(*args, **kwargs)
+            return result
+        try:
+            result = func(*args, **kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self.lock:
+                del self.calls[key]
+
+def cache_key(*parts):
+    """Hashes the pickled arguments of a call into a cache key, or returns None
+    if they cannot be pickled. Dicts are sorted so that their order does not matter."""
+    parts = [sorted(part.items()) if isinstance(part, dict) else part for part in parts]
+    try:
+        return hashlib.sha256(pickle.dumps(parts, protocol=5)).hexdigest()
+    except Exception:
+        return None
+
 #Create a multithreaded HTTP server that can handle multiple requests concurrently
 class ThreadedHTTPServer(ThreadingMixIn, HTTPServer):
     daemon_threads = True
 
+#The same listening on a Unix domain socket
+class ThreadedUnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+    def get_request(self):
+        request, _ = self.socket.accept()
+        #Peers on a Unix socket have no address, but handlers log client_address[0]
+        return request, (self.server_address, 0)
+
+def remove_stale_socket(path):
+    """Removes a Unix socket file left behind by a server that is no longer running,
+    so that it can be bound again. Raises OSError if a server is still listening on it."""
+    try:
+        if not stat.S_ISSOCK(os.stat(path).st_mode):
+            raise OSError(f'{path} exists and is not a socket')
+    except FileNotFoundError:
+        return
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+        try:
+            probe.connect(path)
+        except (ConnectionRefusedError, FileNotFoundError):
+            os.unlink(path)
+            return
+    raise OSError(f'A server is already listening on {path}')
+
+# Options that add*Endpoint accept as keyword arguments, with their defaults:
+#  max_body_size     largest request body accepted, None for server.max_body_size
+#  stream_body       pass the body to the callback as a file-like requestBody
+#  pool              name of an addPool pool to run the callback on
+#  cache             cache results on the request (see resultCache), with the
+#                    cache's ttl, max_entries and max_bytes
+#  invalidates       endpoints whose caches are cleared after each successful call
+#  coalesce          identical calls that arrive together share one call (see singleFlight)
+#  compress_min_size override server.compress_min_size for the responses
+#  compress_level    override server.compress_level for the responses
+ENDPOINT_OPTIONS = {'max_body_size': None, 'stream_body': False, 'pool': None, 'cache': False, 'ttl': None, 'max_entries': 1024, 'max_bytes': 64*1024**2,
+                    'invalidates': None, 'coalesce': False, 'compress_min_size': None, 'compress_level': None}
+# The options that each kind of endpoint accepts
+ENDPOINT_KIND_OPTIONS = {
+    'GET': set(ENDPOINT_OPTIONS),
+    'POST': {'max_body_size', 'stream_body', 'pool', 'invalidates', 'compress_min_size', 'compress_level'},
+    'RPC': set(ENDPOINT_OPTIONS) - {'stream_body'},
+    'ASYNCRPC': {'max_body_size', 'pool', 'invalidates', 'coalesce'},
+}
+
 class server(BaseHTTPRequestHandler):
 
     get_endpoints = {} # Dictionary to hold GET endpoints
     post_endpoints = {} # Dictionary to hold POST endpoints
     rpc_endpoints = {} # Dictionary to hold RPC endpoints
     asyncRPC_endpoints = {} # Dictionary to hold AsyncRPC endpoints
-    futures = {}  # Dictionary to hold futures for async RPC calls
+    pools = {} # Named executorPools that endpoints can run on
+    shm_threshold = shm.THRESHOLD # Buffers at least this big are passed to and from process pools through shared memory
+    shm_directory = None # Directory for those shared memory files, None for /dev/shm
+    shm_transport = False # Let clients on the same host send large RPC arguments and results through shared memory files
+    shm_ttl = 60 # Seconds that the shared memory files of a result wait for the client before being removed
+    futures = jobRegistry()  # Registry of the jobs started by AsyncRPC calls, makeServer gives each server its own
+    max_body_size = None # Largest request body accepted by endpoints without their own limit
+    spool_threshold = 64 * 1024 * 1024 # Request bodies (and RPC buffers) larger than this are spooled to a temporary file
+    spool_directory = None # Directory for spooled request bodies, None for the system default
+    max_poll_timeout = 60 # Longest time in seconds that /asyncGet and /asyncProbe will hold a request open
+    compress_min_size = 1024 # Responses at least this big are compressed if the client accepts it, None to never compress
+    compress_level = None # Compression level passed to the codec, None for its default and 0 to never compress
+    json_chunk_size = 1024 * 1024 # JSON results that encode to more than this are streamed in chunks of about this size
+    compress_encodings = compress.ENCODINGS # Content codings used for responses, most preferred first
+    request_metrics = metrics.serverMetrics() # Counts and timings reported on /metrics, None to turn them off
+    server_timing = True # Report the time taken by each phase of a request in a Server-Timing response header
+    request_profiler = profiler.requestProfiler() # Profiles requests on demand through /profile
+    admin_token = None # Token that must be sent as "Authorization: Bearer <token>" to use /profile, None to turn it off
+    manifests = {} # The encoded list of endpoints served on / and its ETag for each server class, built when first requested
+    manifest_generation = 0 # Counts the changes to the endpoints, so that a manifest built during one is not kept
+    worker_index = None # Index of this worker process when runServer was given workers
+    worker_directory = None # Directory of the private sockets of the worker processes
+    requests_in_flight = None # Counts the requests a worker process is handling, so it can drain before exiting
+
+    #Speak HTTP/1.1 so that clients can keep connections open between calls.
+    #Every response must therefore carry a Content-Length
+    protocol_version = "HTTP/1.1"
+    #Headers and body go out in separate writes, so Nagle's algorithm would hold
+    #back the body of a small response on a kept-alive connection until the
+    #client's delayed ACK of the headers arrived
+    disable_nagle_algorithm = True
+    #Idle keep-alive connections are closed after this many seconds (set by runServer)
+    timeout = 60
+    #The connection's rfile while a decompressed request body stands in for it
+    encoded_rfile = None
+    #Times the phases of the current request when metrics are on
+    timer = None
+    #The profiling session and token of the current request if it is being profiled
+    profiling = None
+    #True while the current request is counted in requests_in_flight
+    in_flight = False
+    #True if the asyncio engine has already waited for the job of a long poll
+    polled = False
+    #The array format named by the _format query parameter of the current request
+    array_format = None
+
+    def setup(self):
+        #Nagle's algorithm only exists for TCP, Unix socket connections cannot turn it off
+        if self.request.family == socket.AF_UNIX:
+            self.disable_nagle_algorithm = False
+        super().setup()
 
     @classmethod
-    def addGetEndpoint(cls, name, callback, result_mimetype=None, description=None, query_params=None):
-        """Adds a GET endpoint to the server."""
-        cls.get_endpoints[name] = {"func":callback, "mimetype":result_mimetype, "description": description or callback.__doc__ or "No description provided", "query_params":query_params}
+    def configureJobs(cls, **kwargs):
+        """Replaces the registry of AsyncRPC jobs with one using the given limits (see jobRegistry)."""
+        cls.futures = jobRegistry(**kwargs)
 
     @classmethod
-    def addPostEndpoint(cls, name, callback, result_mimetype=None, description=None, query_params=None, payload_mimetype=None, payload_schema=None):
-        """Adds a POST endpoint to the server."""
-        cls.post_endpoints[name] = {"func":callback, "mimetype":result_mimetype, "description": description or callback.__doc__ or "No description provided", "query_params":query_params, "payload_mimetype": payload_mimetype, "payload_schema": payload_schema}
+    def addPool(cls, name, kind='thread', max_workers=None, max_queue=None, initializer=None, initargs=()):
+        """Declares a named pool of worker threads or processes (see executorPool).
+        Declaring the 'default' pool replaces the one AsyncRPC endpoints use when no pool is given."""
+        if name in cls.pools:
+            cls.pools[name].shutdown(wait=False)
+        cls.pools[name] = executorPool(name, kind, max_workers, max_queue, initializer, initargs)
+        return cls.pools[name]
 
     @classmethod
-    def addRPCEndpoint(cls, name, callback, result_mimetype=None, description=None):
-        """Adds an RPC endpoint to the server."""
-        cls.rpc_endpoints[name] = {"func":callback, "mimetype":result_mimetype, "description": description or callback.__doc__ or "No description provided"}
+    def check_pool(cls, pool, stream_body=False):
+        if pool is not None and pool not in cls.pools:
+            raise ValueError(f"Pool {pool} has not been declared with addPool")
+        if pool is not None and stream_body and cls.pools[pool].kind == 'process':
+            raise ValueError("Endpoints with stream_body cannot run on a process pool")
 
     @classmethod
-    def addAsyncRPCEndpoint(cls, name, callback, result_mimetype=None, description=None, suggested_wait=5):
-        """Adds an AsyncRPC endpoint to the server."""
-        cls.asyncRPC_endpoints[name] = {"func":callback, "mimetype":result_mimetype, "description": description or callback.__doc__ or "No description provided", "wait": suggested_wait}
+    def endpoint_options(cls, kind, options):
+        """Checks the options given to add*Endpoint and returns the fields they add to the endpoint."""
+        unknown = set(options) - ENDPOINT_KIND_OPTIONS[kind]
+        if unknown:
+            raise TypeError(f"{kind} endpoints do not take the option{'s' if len(unknown) > 1 else ''} {', '.join(sorted(unknown))}")
+        options = {option: options.get(option, ENDPOINT_OPTIONS[option]) for option in ENDPOINT_KIND_OPTIONS[kind]}
+        stream_body = options.get('stream_body', False)
+        cls.check_pool(options['pool'], stream_body)
+        fields = {"max_body_size": options['max_body_size'], "pool": options['pool'], "invalidates": list(options['invalidates'] or [])}
+        if 'stream_body' in options:
+            fields["stream_body"] = stream_body
+        if 'cache' in options:
+            if options['cache'] and stream_body:
+                raise ValueError("Endpoints with stream_body cannot be cached")
+            fields["cache"] = resultCache(options['ttl'], options['max_entries'], options['max_bytes']) if options['cache'] else None
+        if 'coalesce' in options:
+            if options['coalesce'] and stream_body:
+                raise ValueError("Endpoints with stream_body cannot be coalesced")
+            #AsyncRPC jobs are coalesced through the job registry rather than a singleFlight
+            fields["coalesce"] = options['coalesce'] if kind == 'ASYNCRPC' else singleFlight() if options['coalesce'] else None
+        if 'compress_min_size' in options:
+            fields["compress_min_size"] = options['compress_min_size']
+            fields["compress_level"] = options['compress_level']
+        return fields
+
+    @classmethod
+    def addGetEndpoint(cls, name, callback, result_mimetype=None, description=None, query_params=None, **options):
+        """Adds a GET endpoint to the server, options are listed at ENDPOINT_OPTIONS."""
+        cls.get_endpoints[name] = {"func":callback, "mimetype":result_mimetype, "description": description or callback.__doc__ or "No description provided", "query_params":query_params,
+                                   **cls.endpoint_options('GET', options)}
+        cls.invalidateManifest()
+
+    @classmethod
+    def addPostEndpoint(cls, name, callback, result_mimetype=None, description=None, query_params=None, payload_mimetype=None, payload_schema=None, **options):
+        """Adds a POST endpoint to the server, options are listed at ENDPOINT_OPTIONS."""
+        cls.post_endpoints[name] = {"func":callback, "mimetype":result_mimetype, "description": description or callback.__doc__ or "No description provided", "query_params":query_params, "payload_mimetype": payload_mimetype, "payload_schema": payload_schema,
+                                    **cls.endpoint_options('POST', options)}
+        cls.invalidateManifest()
+
+    @classmethod
+    def addRPCEndpoint(cls, name, callback, result_mimetype=None, description=None, **options):
+        """Adds an RPC endpoint to the server, options are listed at ENDPOINT_OPTIONS."""
+        cls.rpc_endpoints[name] = {"func":callback, "mimetype":result_mimetype, "description": description or callback.__doc__ or "No description provided",
+                                   **cls.endpoint_options('RPC', options)}
+        cls.invalidateManifest()
+
+    @classmethod
+    def addAsyncRPCEndpoint(cls, name, callback, result_mimetype=None, description=None, suggested_wait=5, **options):
+        """Adds an AsyncRPC endpoint to the server, options are listed at ENDPOINT_OPTIONS."""
+        cls.asyncRPC_endpoints[name] = {"func":callback, "mimetype":result_mimetype, "description": description or callback.__doc__ or "No description provided", "wait": suggested_wait,
+                                        **cls.endpoint_options('ASYNCRPC', options)}
+        cls.invalidateManifest()
+
+    @classmethod
+    def invalidateManifest(cls):
+        """Drops the encoded manifests so that they are rebuilt with the current endpoints.
+        The endpoints are shared by every server class, so this drops the manifest of each."""
+        server.manifest_generation += 1
+        server.manifests.clear()
+
+    @classmethod
+    def invalidateCache(cls, name=None):
+        """Clears the cached responses of the named endpoint, or of every endpoint if name is None."""
+        for endpoints in (cls.get_endpoints, cls.rpc_endpoints):
+            for endpoint, endpoint_data in endpoints.items():
+                if endpoint_data.get('cache') is not None and (name is None or endpoint == name):
+                    endpoint_data['cache'].clear()
 
 
     def get_known_endpoints(self):
@@ -122,6 +721,14 @@ class server(BaseHTTPRequestHandler):
         endpoints["POST"] = []
         endpoints["RPC"] = []
         endpoints["ASYNCRPC"] = []
+        #Optional protocol features that clients can use if they know about them
+        endpoints["CAPABILITIES"] = [wire.PICKLE_CAPABILITY, "batch", "long-poll", "content-encoding"]
+        #Content codings the server can decode in request bodies
+        endpoints["ENCODINGS"] = list(compress.ENCODINGS)
+        if self.shm_transport:
+            #Clients that see the same shared memory directory can pass large buffers through it
+            endpoints["CAPABILITIES"].append(shm.SHM_CAPABILITY)
+            endpoints["SHM"] = {"host_id": shm.host_id(self.shm_directory), "directory": self.shm_directory or shm.SHM_DIRECTORY, "threshold": self.shm_threshold}
         for name, data in self.get_endpoints.items():
             endpoints["GET"].append({
                 "name": name,
@@ -148,48 +755,506 @@ class server(BaseHTTPRequestHandler):
             })
         return endpoints
     
-    def handle_result(self, result, mimetype=None):
+    def parse_request(self):
+        """Parses the request line and headers. Also resets the per-request state
+        since a single handler instance now serves every request on a connection."""
+        self.body_consumed = False
+        self.response_cache = None
+        self.compress_options = {}
+        self.metric_labels = ('internal', '')
+        self.metric_error = None
+        self.array_format = None
+        if self.request_metrics is not None:
+            self.timer = self.request_metrics.begin()
+        elif self.server_timing:
+            self.timer = metrics.requestTimer()
+        if not super().parse_request():
+            return False
+        if self.requests_in_flight is not None:
+            self.requests_in_flight.enter()
+            self.in_flight = True
+            #A draining worker closes each connection after its current request
+            if self.requests_in_flight.draining:
+                self.close_connection = True
+        #Unless a profiling session has been started this check is all profiling costs
+        if self.request_profiler.session is not None:
+            endpoint = urlparse(self.path).path.lstrip('/')
+            if endpoint != 'profile':
+                self.profiling = self.request_profiler.begin(endpoint)
+        return True
+
+    def handle_expect_100(self):
+        #The asyncio engine's wfile holds small writes back, but the client waits
+        #for this interim response before it sends the body
+        if not super().handle_expect_100():
+            return False
+        self.wfile.flush()
+        return True
+
+    def phase(self, name):
+        """Starts timing the next phase of the request (see tarp.metrics)."""
+        if self.timer is not None:
+            self.timer.switch(name)
+
+    def send_timing_header(self):
+        """Sends the Server-Timing header for the phases finished so far."""
+        if self.server_timing and self.timer is not None:
+            self.send_header('Server-Timing', metrics.server_timing(self.timer))
+
+    def handle_one_request(self):
+        try:
+            super().handle_one_request()
+        finally:
+            if self.profiling is not None:
+                self.request_profiler.end(self.profiling)
+                self.profiling = None
+            if self.timer is not None and self.request_metrics is not None:
+                self.request_metrics.finish(*self.metric_labels, self.timer, self.metric_error)
+            self.timer = None
+            #A decoded request body replaces rfile for the rest of that request only
+            if getattr(self, 'encoded_rfile', None) is not None:
+                self.rfile = self.encoded_rfile
+                self.encoded_rfile = None
+            if self.in_flight:
+                self.in_flight = False
+                self.requests_in_flight.leave()
+
+    def read_body(self):
+        """Reads the full request body as declared by the Content-Length header.
+        Bodies larger than spool_threshold are returned as an mmap of a temporary
+        file rather than a bytes object."""
+        content_length = int(self.headers.get('Content-Length', 0))
+        self.body_consumed = True
+        if not content_length:
+            return None
+        if self.spool_threshold is not None and content_length > self.spool_threshold:
+            return self.allocate_body_buffer(content_length, read=True)
+        return self.rfile.read(content_length)
+
+    def allocate_body_buffer(self, length, read=False):
+        """Allocates a buffer for part of the request body, spooling it to a
+        temporary file if it is larger than spool_threshold. If read is True the
+        buffer is filled from the request straight away."""
+        if self.spool_threshold is not None and length > self.spool_threshold:
+            buffer = spooled_buffer(length, self.spool_directory)
+        else:
+            buffer = bytearray(length)
+        if read:
+            with memoryview(buffer) as view:
+                wire.read_exactly(self.rfile.readinto, view)
+        return buffer
+
+    def check_body_size(self, endpoint_data):
+        """Sends a 413 response and returns False if the request body is larger
+        than the endpoint (or the server) allows."""
+        self.phase('deserialize')
+        limit = endpoint_data.get('max_body_size') or self.max_body_size
+        content_length = int(self.headers.get('Content-Length', 0))
+        if limit is not None and content_length > limit:
+            #The body is left unread, so send_body also closes the connection
+            self.send_api_error(413, f'Request body of {content_length} bytes is larger than the limit of {limit} bytes')
+            return False
+        if self.headers.get('Content-Encoding', 'identity').strip().lower() != 'identity':
+            return self.decode_body(limit)
+        return True
+
+    def decode_body(self, limit):
+        """Decompresses a request body sent with a Content-Encoding. The decoded body
+        replaces rfile and Content-Length, so it is read like any other body. Bodies
+        that decode to more than spool_threshold bytes are held in a temporary file.
+        Sends an error response and returns False if the body cannot be decoded or
+        decodes to more than limit bytes."""
+        encoding = self.headers['Content-Encoding']
+        body = requestBody(self.rfile, int(self.headers.get('Content-Length', 0)))
+        try:
+            decoder = compress.decompressor(encoding, body)
+        except ValueError:
+            self.send_api_error(415, f'Unsupported Content-Encoding {encoding}')
+            return False
+        self.body_consumed = True
+        decoded = io.BytesIO()
+        size = 0
+        try:
+            #The body is decoded a block at a time, so one that decodes to far more
+            #than the limit is refused without ever being held in memory
+            while True:
+                data = decoder.read(compress.DECODE_BLOCK)
+                if not data:
+                    break
+                size += len(data)
+                if limit is not None and size > limit:
+                    self.close_connection = True
+                    self.send_api_error(413, f'Decompressed request body is larger than the limit of {limit} bytes')
+                    return False
+                if self.spool_threshold is not None and size > self.spool_threshold and isinstance(decoded, io.BytesIO):
+                    spool = tempfile.TemporaryFile(dir=self.spool_directory)
+                    spool.write(decoded.getbuffer())
+                    decoded = spool
+                decoded.write(data)
+        except Exception as e:
+            self.close_connection = True
+            self.send_api_error(400, f'Malformed {encoding} request body: {e}')
+            return False
+        if body.remaining:
+            #Anything after the end of the compressed data is left unread
+            self.close_connection = True
+        decoded.seek(0)
+        self.encoded_rfile = self.rfile
+        self.rfile = decoded
+        self.headers.replace_header('Content-Length', str(size))
+        del self.headers['Content-Encoding']
+        #The connection is clean again, but the decoded body still has to be read
+        self.body_consumed = False
+        return True
+
+    def open_body_stream(self):
+        """Returns the request body as a file-like requestBody object for endpoints
+        that process their body incrementally."""
+        content_length = int(self.headers.get('Content-Length', 0))
+        self.body_consumed = True
+        return requestBody(self.rfile, content_length, self.headers.get('Content-Type', None))
+
+    def finish_body_stream(self, body):
+        """Discards whatever an endpoint left unread of a streamed body so that the
+        next request on the connection can be parsed. Large remainders are not
+        worth reading, so the connection is closed instead."""
+        if body.remaining > 1024 * 1024:
+            self.close_connection = True
+            return
+        while body.remaining:
+            if not body.read(min(body.remaining, 65536)):
+                break
+
+    def send_body(self, code, body, content_type='application/json', headers=None):
+        """Sends a complete response with a correct Content-Length header.
+        The body is compressed if it is big enough and the client accepts it.
+        If the request body was never read the connection is closed afterwards
+        because the unread bytes would otherwise be parsed as the next request."""
+        body = body or b''
+        self.store_response(code, content_type, body)
+        encoding, level, vary = self.response_encoding(content_type, len(body))
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        if encoding is not None:
+            body = compress.compress(body, encoding, level)
+            self.send_header('Content-Encoding', encoding)
+        if vary:
+            self.send_header('Vary', 'Accept-Encoding')
+        self.phase('write')
+        self.send_timing_header()
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        if self.encoded_rfile is None and not self.body_consumed and int(self.headers.get('Content-Length', 0)):
+            self.send_header('Connection', 'close')
+            self.close_connection = True
+        self.end_headers()
+        self.wfile.write(body)
+
+    def response_encoding(self, content_type, size=None):
+        """Returns the (encoding, level, vary) to compress a response with, encoding being
+        None if it should not be compressed. vary is True if the response could have
+        been compressed for another client. Framed pickles and the binary array formats
+        are never compressed since they are mostly raw array data that is sent without
+        being copied."""
+        level = self.compress_options.get('compress_level')
+        if level is None:
+            level = self.compress_level
+        min_size = self.compress_options.get('compress_min_size')
+        if min_size is None:
+            min_size = self.compress_min_size
+        if level == 0 or min_size is None or content_type in (wire.PICKLE_MIMETYPE, wire.STREAM_MIMETYPE) or content_type in arrays.FORMATS or not compress.compressible(content_type):
+            return None, level, False
+        if size is not None and size < min_size:
+            return None, level, True
+        return compress.choose(self.headers.get('Accept-Encoding'), self.compress_encodings), level, True
+
+    def send_frames(self, code, body, headers=None, content_type=wire.PICKLE_MIMETYPE):
+        """Sends a framed binary response (see tarp.wire), or another body made of
+        several buffers. The buffers are written one after another rather than
+        being joined into a single buffer."""
+        self.phase('write')
+        self.send_response(code)
+        self.send_timing_header()
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        for frame in body:
+            self.wfile.write(frame)
+        self.store_response(code, content_type, body)
+
+    def cached_response(self, endpoint_data, *key_parts):
+        """Sends the cached response for a call if there is one and returns True.
+        Otherwise arranges for the response that is about to be sent to be cached."""
+        cache = endpoint_data.get('cache')
+        if cache is None:
+            return False
+        #Array results can be sent in the formats named in the Accept header or _format, so they are part of the key
+        key = cache_key(*key_parts, arrays.requested(self.array_format, self.headers.get('Accept')))
+        if key is None:
+            return False
+        hit = cache.get(key)
+        if hit is not None:
+            content_type, body = hit
+            self.send_body(200, body, content_type)
+            return True
+        self.response_cache = (cache, key, cache.generation)
+        return False
+
+    def store_response(self, code, content_type, body):
+        """Caches a successful response if cached_response asked for it."""
+        if self.response_cache is not None and code == 200:
+            cache, key, generation = self.response_cache
+            cache.put(key, content_type, body, generation)
+        self.response_cache = None
+
+    def invalidate(self, endpoint_data):
+        """Clears the caches that a successful call to an endpoint makes stale."""
+        for name in endpoint_data.get('invalidates', ()):
+            self.invalidateCache(name)
+
+    def send_chunked(self, chunks, content_type, headers=None):
+        """Streams an iterable of chunks (bytes or framedBody) using chunked transfer
+        encoding, so nothing has to be held in memory beyond the current chunk.
+        HTTP/1.0 clients get the same bytes unchunked and the connection is closed at the end."""
+        chunked = self.request_version != 'HTTP/1.0'
+        encoding, level, vary = self.response_encoding(content_type)
+        if encoding is not None:
+            chunks = self.compress_chunks(chunks, encoding, level)
+        #Items are produced and encoded as they are sent, so that all counts as writing
+        self.phase('write')
+        self.send_response(200)
+        self.send_timing_header()
+        self.send_header('Content-Type', content_type)
+        if encoding is not None:
+            self.send_header('Content-Encoding', encoding)
+        if vary:
+            self.send_header('Vary', 'Accept-Encoding')
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        if chunked:
+            self.send_header('Transfer-Encoding', 'chunked')
+        else:
+            self.send_header('Connection', 'close')
+            self.close_connection = True
+        self.end_headers()
+        try:
+            for chunk in chunks:
+                size = len(chunk)
+                if not size:
+                    continue
+                parts = list(chunk) if isinstance(chunk, wire.framedBody) else [chunk]
+                if chunked:
+                    parts = [f'{size:X}\r\n'.encode('ascii')] + parts + [b'\r\n']
+                if size < 65536:
+                    #Small chunks go out in one write rather than several tiny ones
+                    parts = [b''.join(parts)]
+                for part in parts:
+                    self.wfile.write(part)
+                #Send each chunk straight away even if the output is buffered
+                self.wfile.flush()
+            if chunked:
+                self.wfile.write(b'0\r\n\r\n')
+        except Exception as e:
+            #The status line has already been sent, so the only way to tell the
+            #client that the stream failed is to drop the connection
+            self.close_connection = True
+            self.metric_error = 'stream'
+            self.log_error('Streamed response aborted: %s', e)
+
+    def compress_chunks(self, chunks, encoding, level):
+        """Compresses a stream of chunks, flushing after each one so that every item
+        reaches the client as soon as it is produced."""
+        compressor = compress.compressor(encoding, level)
+        for chunk in chunks:
+            yield compressor.compress(chunk) + compressor.sync()
+        yield compressor.flush()
+
+    def accepts_frames(self):
+        """Returns True if the client asked for framed binary responses."""
+        return wire.PICKLE_MIMETYPE in self.headers.get('Accept', '')
+
+    def accepts_shm(self):
+        """Returns True if the client asked for results through shared memory and the server allows it."""
+        return self.shm_transport and shm.SHM_MIMETYPE in self.headers.get('Accept', '')
+
+    def pack_result(self, result=None, frames=None):
+        """Packs a result (or its frames) for a client on the same host with tarp.shm,
+        returning the packed list. Results without large buffers, or that do not fit
+        in the shared memory directory, are returned as a framedBody to be sent as usual."""
+        if frames is None:
+            frames = wire.dump_frames(result)
+        try:
+            packed = shm.pack_frames(frames, self.shm_threshold, self.shm_directory)
+        except OSError as e:
+            self.log_error('Unable to use shared memory for a result: %s', e)
+            return wire.framedBody(frames)
+        return packed if shm.has_segments(packed) else wire.framedBody(packed)
+
+    def send_packed(self, packed):
+        """Sends an object packed by tarp.shm. Large buffers are left in shared memory
+        files for the client, and removed after shm_ttl seconds if it never takes them."""
+        #The files can only be taken once, so the response must not be cached
+        self.response_cache = None
+        try:
+            self.send_body(200, shm.dumps(packed), shm.SHM_MIMETYPE)
+        finally:
+            shm.release_later(packed, self.shm_ttl)
+
+    def read_frames(self):
+        """Reads a framed binary request body (see tarp.wire) directly from the socket."""
+        content_length = int(self.headers.get('Content-Length', 0))
+        self.body_consumed = True
+        return wire.read_frames(self.rfile.readinto, content_length, allocate=self.allocate_body_buffer)
+
+    def send_file(self, code, f, content_type, headers=None):
+        """Sends the contents of an open file without reading it all into memory.
+        The file position is not used, so several requests can send the same file."""
+        size = os.fstat(f.fileno()).st_size
+        self.phase('write')
+        self.send_response(code)
+        self.send_timing_header()
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(size))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        offset = 0
+        while offset < size:
+            chunk = os.pread(f.fileno(), min(1024 * 1024, size - offset), offset)
+            if not chunk:
+                break
+            self.wfile.write(chunk)
+            offset += len(chunk)
+
+    def send_api_error(self, code, message, type="generic", headers=None):
+        """Sends a JSON-encoded error response."""
+        self.metric_error = type if type != "generic" else str(code)
+        self.send_body(code, api_error(message, type), headers=headers)
+
+    def exception_info(self, e):
+        """Returns the type, message and retry time used to report an exception."""
+        if isinstance(e, OperationInProgress):
+            return "OperationInProgress", str(e), e.retry_after
+        elif isinstance(e, InvalidServerState):
+            return "InvalidServerState", str(e), None
+        return "generic", str(e), None
+
+    def handle_exception(self, e):
+        """Converts an exception raised by an endpoint into an error response."""
+        if isinstance(e, OperationInProgress):
+            self.send_api_error(503, str(e), "OperationInProgress", headers={'Retry-After': str(e.retry_after)})
+        elif isinstance(e, InvalidServerState):
+            self.send_api_error(503, str(e), "InvalidServerState")
+        else:
+            self.send_api_error(500, str(e))
+
+    def handle_result(self, result, mimetype=None, web_endpoint=None):
         """Handles the result returned by the endpoint.
         Depending on the type of result, it sets the appropriate response headers and writes the response body.
+        web_endpoint is the name of the GET or POST endpoint that returned the result,
+        whose arrays can be sent in a binary format instead of JSON.
         """
         presult = result
         if isinstance(result, dict):
             mimetype = mimetype or 'application/json'
             presult = result
         elif isinstance(result, str):
-            minetype = mimetype or 'text/plain'
+            mimetype = mimetype or 'text/plain'
             presult = result.encode('utf-8')
         elif isinstance(result, list):
             mimetype = mimetype or 'application/json'
             presult = result
+        elif jsonenc.is_array(result) or jsonenc.is_scalar(result):
+            #NumPy arrays and scalars are encoded straight from the array
+            mimetype = mimetype or 'application/json'
+            presult = result
         elif isinstance(result, rawPayload):
             #rawPayload class is used to return arbitrary payloads with a mimetype
             #Set the response headers based on the mimetype and doesn't wrap
             #the payload in the API result
-            self.send_response(200)
-            self.send_header('Content-Type', mimetype or result.mimetype)
-            self.end_headers()
-            self.wfile.write(bytes(result))
+            payload = result.payload.encode('utf-8') if isinstance(result.payload, str) else bytes(result)
+            headers = {'Content-Disposition': f'attachment; filename="{result.filename}"'} if getattr(result, 'filename', None) else None
+            self.send_body(200, payload, mimetype or result.mimetype, headers=headers)
             return  # rawPayload is already written, no need to write again
         elif isinstance(result, bytes):
             # If the result is bytes, we assume it's binary data
             mimetype = mimetype or 'application/octet-stream'
             presult = result
+        elif isinstance(result, Iterator):
+            #Generators and other iterators are streamed as newline delimited
+            #JSON, one item per line, without the API result wrapper
+            self.send_chunked((jsonenc.dumps(item) + b'\n' for item in result), wire.NDJSON_MIMETYPE)
+            return
         elif not result:
             presult = None
         else:
             #Payload is returned but is unrecognized. Bug so return 500
-            self.send_response(500)
-            self.send_header('Content-Type', 'application/json')
-            self.end_headers()
-            self.wfile.write(api_error('Unrecognized payload type').encode('utf-8'))
+            self.send_api_error(500, 'Unrecognized payload type')
             return
         # Write the response body
+        headers = None
+        if web_endpoint is not None:
+            #Web endpoints can send arrays in a binary format instead of JSON
+            if self.send_array(presult, web_endpoint):
+                return
+            if arrays.is_arraylike(presult):
+                headers = {'Vary': 'Accept'}
         #Actual mimetype is always application/json because of API result format
-        self.send_response(200)
-        self.send_header('Content-Type', 'application/json')
-        self.end_headers()
-        self.wfile.write(api_success(presult, mimetype))
+        self.send_json(api_wrapper(presult, mimetype), headers)
+
+    def web_query(self, parsed):
+        """Returns the query parameters passed to a web endpoint. The reserved _format
+        parameter is taken out and kept as array_format."""
+        query = flatten_qs(parse_qs(parsed.query))
+        array_format = query.pop(arrays.QUERY_PARAMETER, None)
+        self.array_format = array_format[-1] if isinstance(array_format, list) else array_format
+        return query
+
+    def send_array(self, result, endpoint):
+        """Sends an array result in the binary format that the request asked for with
+        an Accept header or _format query parameter, if it can be, and returns True.
+        A _format query parameter that cannot be used gets a 406 error. Returns False
+        if the result should be sent as JSON."""
+        for name in arrays.requested(self.array_format, self.headers.get('Accept')):
+            if arrays.encodable(name, result):
+                break
+        else:
+            if self.array_format in arrays.MIMETYPES:
+                reason = 'it is not installed on the server' if not arrays.available(self.array_format) else 'the result does not fit it'
+                self.send_api_error(406, f'Result cannot be sent in {self.array_format} format, {reason}')
+                return True
+            return False
+        try:
+            body = arrays.encode(name, result)
+        except Exception as e:
+            self.send_api_error(500, f'Unable to encode result: {e}')
+            return True
+        filename = f'{endpoint or "result"}.{arrays.EXTENSIONS[name]}'
+        self.send_frames(200, body, {'Content-Disposition': f'attachment; filename="{filename}"', 'Vary': 'Accept'}, arrays.MIMETYPES[name])
+        return True
+
+    def send_json(self, data, headers=None):
+        """Sends data as a JSON response. Anything that encodes to more than one
+        chunk is streamed with chunked transfer encoding as it is encoded, so the
+        whole encoding is never held in memory. Cached responses are sent whole."""
+        chunks = jsonenc.iter_encode(data, self.json_chunk_size)
+        try:
+            #Encode the first two chunks up front so that errors in small results
+            #are still reported properly and small results get a Content-Length
+            head = list(itertools.islice(chunks, 2))
+            if len(head) > 1 and self.response_cache is not None:
+                head.extend(chunks)
+                head = [b''.join(head)]
+        except Exception as e:
+            self.send_api_error(500, f'Unable to encode result: {e}')
+            return
+        if len(head) <= 1:
+            self.send_body(200, head[0] if head else b'', headers=headers)
+        else:
+            self.send_chunked(itertools.chain(head, chunks), 'application/json', headers)
 
     def process_body(self, body_data, content_type):
         """Processes the body data based on the content type.
@@ -198,7 +1263,11 @@ class server(BaseHTTPRequestHandler):
         If it's plain text, it decodes the data.
         If it's binary data, it returns the raw bytes.
         If no content type is specified, it assumes raw bytes.
+        Spooled bodies that need decoding are read back into memory, otherwise
+        they are passed on as the mmap.
         """
+        if isinstance(body_data, mmap.mmap) and content_type in ('application/json', 'application/x-www-form-urlencoded', 'text/plain'):
+            body_data = body_data[:]
         if content_type == 'application/json':
             try:
                 return json.loads(body_data.decode('utf-8'))
@@ -220,75 +1289,290 @@ class server(BaseHTTPRequestHandler):
             # If the content type is not recognized, we just return the raw bytes
             return body_data
         
+    @classmethod
+    def poll_timeout(cls, query_params):
+        """Returns how long a long-poll request asked to wait for, capped at max_poll_timeout."""
+        try:
+            timeout = float(query_params.get('timeout', [0])[0])
+        except ValueError:
+            timeout = 0
+        return max(0.0, min(timeout, cls.max_poll_timeout))
+
     def asyncGet(self):
-        """Gets the result of an asynchronous operation by UUID."""
+        """Gets the result of an asynchronous operation by UUID.
+        If a timeout parameter is given and the operation is still running, the
+        request is held open until it finishes or the timeout runs out."""
         query_params = parse_qs(urlparse(self.path).query)
         uuid = query_params.get('UUID', [None])[0]
         if not uuid:
-            self.send_response(400)
-            self.send_header('Content-Type', 'application/json')
-            self.end_headers()
-            self.wfile.write(api_error('UUID parameter is required'))
+            self.send_api_error(400, 'UUID parameter is required')
             return
-        if uuid not in self.futures:
-            self.send_response(404)
-            self.send_header('Content-Type', 'application/json')
-            self.end_headers()
-            self.wfile.write(api_error('UUID not found').encode('utf-8'))
+        if self.route_job(uuid):
+            return
+        job = self.futures.get(uuid)
+        if job is None:
+            self.send_api_error(404, 'UUID not found')
             return
-        future = self.futures[uuid]['future']
+        future = job['future']
+        timeout = self.poll_timeout(query_params)
+        self.phase('execute')
+        if timeout and not self.polled:
+            concurrent.futures.wait([future], timeout=timeout)
+        self.phase('serialize')
         if future.done():
-            result = future.result()
-            self.send_response(200)
-            self.send_header('Content-Type', 'application/json')
+            #Another request may have collected the result while this one waited
+            job = self.futures.pop(uuid)
+            if job is None:
+                self.send_api_error(404, 'UUID not found')
+                return
+            try:
+                self.send_job_result(job)
+            finally:
+                if job['file'] is not None and job.get('removed'):
+                    job['file'].close()
+        else:
+            #A long-poll client has already waited, so it can ask again straight away
+            retry_after = 0 if timeout else job['wait']
+            self.send_api_error(503, "Operation still underway", "OperationInProgress", headers={'Retry-After': str(retry_after)})
+
+    def route_job(self, ID):
+        """In a worker process, passes a request about an AsyncRPC job that another
+        worker started on to that worker, through its private socket, and sends
+        back its response. Returns True if the request was passed on."""
+        if self.worker_index is None:
+            return False
+        owner = prefork.job_owner(ID)
+        if owner is None or owner == self.worker_index:
+            return False
+        self.phase('execute')
+        #Long polls are held open by the other worker for up to max_poll_timeout
+        connection = prefork.workerConnection(prefork.socket_path(self.worker_directory, owner), timeout=self.max_poll_timeout + 60)
+        try:
+            #These requests have no body to pass on
+            skip = prefork.HOP_BY_HOP | {'content-length', 'expect'}
+            headers = {key: value for key, value in self.headers.items() if key.lower() not in skip}
+            try:
+                connection.request(self.command, self.path, headers=headers)
+                response = connection.getresponse()
+            except OSError:
+                #The worker has exited since it started the job, and the job went with it
+                self.send_api_error(404, 'UUID not found')
+                return True
+            self.phase('write')
+            self.send_response(response.status, response.reason)
+            for key, value in response.getheaders():
+                if key.lower() not in prefork.HOP_BY_HOP and key.lower() not in ('server', 'date'):
+                    self.send_header(key, value)
+            if response.getheader('Content-Length') is None or int(self.headers.get('Content-Length', 0)):
+                self.send_header('Connection', 'close')
+                self.close_connection = True
             self.end_headers()
-            result = {'payload': base64.b64encode(pickle.dumps(result)).decode('utf-8')}
-            self.wfile.write(api_success(result, 'application/json'))
-            del self.futures[uuid]
+            while True:
+                block = response.read(prefork.PROXY_BLOCK)
+                if not block:
+                    break
+                self.wfile.write(block)
+        finally:
+            connection.close()
+        return True
+
+    def send_job_result(self, job):
+        """Sends the result of a completed AsyncRPC job, straight from its spill
+        file if it was written to disk."""
+        if job['file'] is not None and self.accepts_frames():
+            self.send_file(200, job['file'], wire.PICKLE_MIMETYPE)
+            return
+        if job['frames'] is not None and self.accepts_shm():
+            payload = self.pack_result(frames=job['frames'])
+            if isinstance(payload, wire.framedBody):
+                self.send_frames(200, payload)
+            else:
+                self.send_packed(payload)
+            return
+        if job['frames'] is not None and self.accepts_frames():
+            self.send_frames(200, wire.framedBody(job['frames']))
+            return
+        try:
+            result = self.futures.result(job)
+            if self.accepts_shm():
+                payload = self.pack_result(result)
+            elif self.accepts_frames():
+                payload = wire.dumps(result)
+            else:
+                payload = {'payload': base64.b64encode(pickle.dumps(result)).decode('utf-8')}
+        except Exception as e:
+            self.handle_exception(e)
+            return
+        if isinstance(payload, wire.framedBody):
+            self.send_frames(200, payload)
+        elif isinstance(payload, list):
+            self.send_packed(payload)
         else:
-            self.send_response(503)
-            self.send_header('Content-Type', 'application/json')
-            self.send_header('Retry-After', str(self.futures[uuid]['wait']))
+            self.send_body(200, api_success(payload, 'application/json'))
+
+    def asyncStats(self):
+        """Reports the size of the AsyncRPC job registry and how many results have been evicted."""
+        self.send_body(200, api_success(self.futures.stats(), 'application/json'))
+
+    def manifest_settings(self):
+        """The settings reported in the manifest besides the endpoints."""
+        return (self.shm_transport, self.shm_directory, self.shm_threshold)
+
+    def send_manifest(self):
+        """Sends the list of endpoints. It is encoded once and served with an ETag
+        until an endpoint is added, and a client that sends that ETag in If-None-Match
+        gets an empty 304 reply instead. The manifest is kept for each server class
+        and is rebuilt if a setting it reports has changed since it was encoded."""
+        settings = self.manifest_settings()
+        manifest = server.manifests.get(type(self))
+        if manifest is None or manifest[0] != settings:
+            generation = server.manifest_generation
+            body = api_success(self.get_known_endpoints(), 'application/json')
+            manifest = (settings, body, '"' + hashlib.sha256(body).hexdigest()[:32] + '"')
+            if generation == server.manifest_generation:
+                server.manifests[type(self)] = manifest
+        _, body, etag = manifest
+        headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+        match = self.headers.get('If-None-Match')
+        if match and (match.strip() == '*' or etag in [tag.strip().removeprefix('W/') for tag in match.split(',')]):
+            self.phase('write')
+            self.send_response(304)
+            self.send_timing_header()
+            for key, value in headers.items():
+                self.send_header(key, value)
             self.end_headers()
-            self.wfile.write(api_error("Operation still underway","OperationInProgress"))
+            return
+        self.send_body(200, body, headers=headers)
+
+    def send_metrics(self):
+        """Sends the server's metrics in the Prometheus text format, or as JSON
+        if the format query parameter is json."""
+        if self.request_metrics is None:
+            self.send_api_error(404, 'Metrics are turned off')
+            return
+        query_params = flatten_qs(parse_qs(urlparse(self.path).query))
+        snapshot = self.request_metrics.snapshot()
+        families = []
+        pools = {name: pool.stats() for name, pool in self.pools.items()}
+        for key, help in (('max_workers', 'Workers in the pool.'), ('running', 'Calls running on the pool.'), ('queued', 'Calls waiting for a worker.')):
+            families.append((f'tarp_pool_{key}', 'gauge', help, [({'pool': name}, stats[key]) for name, stats in pools.items()]))
+        jobs = self.futures.stats()
+        families.append(('tarp_jobs', 'gauge', 'Jobs in the AsyncRPC job registry.', [({}, jobs['entries'])]))
+        families.append(('tarp_jobs_in_progress', 'gauge', 'AsyncRPC jobs still running.', [({}, jobs['in_progress'])]))
+        families.append(('tarp_jobs_memory_bytes', 'gauge', 'Bytes of AsyncRPC results held in memory.', [({}, jobs['memory_bytes'])]))
+        families.append(('tarp_jobs_spilled_bytes', 'gauge', 'Bytes of AsyncRPC results spilled to disk.', [({}, jobs['spilled_bytes'])]))
+        families.append(('tarp_jobs_oldest_age_seconds', 'gauge', 'Age of the oldest AsyncRPC job.', [({}, jobs['oldest_age'])]))
+        families.append(('tarp_jobs_evictions_total', 'counter', 'AsyncRPC results dropped before being collected.', [({'reason': reason}, count) for reason, count in jobs['evictions'].items()]))
+        caches = []
+        coalesced = []
+        for type, endpoints in (('GET', self.get_endpoints), ('POST', self.post_endpoints), ('RPC', self.rpc_endpoints)):
+            for name, endpoint_data in endpoints.items():
+                if endpoint_data.get('cache') is not None:
+                    caches.append(({'type': type, 'endpoint': name}, endpoint_data['cache'].stats()))
+                if endpoint_data.get('coalesce') is not None:
+                    coalesced.append(({'type': type, 'endpoint': name}, endpoint_data['coalesce'].coalesced))
+        coalesced.append(({'type': 'ASYNCRPC', 'endpoint': ''}, jobs['coalesced']))
+        for key, kind, help in (('hits', 'counter', 'Responses served from the cache.'), ('misses', 'counter', 'Requests not found in the cache.'),
+                                ('evictions', 'counter', 'Entries dropped from a full cache.'), ('entries', 'gauge', 'Entries in the cache.'), ('bytes', 'gauge', 'Bytes held in the cache.')):
+            families.append((f'tarp_cache_{key}' + ('_total' if kind == 'counter' else ''), kind, help, [(labels, stats[key]) for labels, stats in caches]))
+        families.append(('tarp_coalesced_total', 'counter', 'Calls that shared the execution of an identical call.', coalesced))
+        if query_params.get('format') == 'json':
+            snapshot.update({'pools': pools, 'jobs': jobs,
+                             'caches': [dict(labels, **stats) for labels, stats in caches],
+                             'coalesced': [dict(labels, count=count) for labels, count in coalesced]})
+            self.send_body(200, api_success(snapshot, 'application/json'))
+            return
+        self.send_body(200, metrics.prometheus(snapshot, families).encode('utf-8'), 'text/plain; version=0.0.4; charset=utf-8')
+
+    def send_profile(self):
+        """Controls the profiler (see tarp.profiler) if the request carries the admin token.
+        The action query parameter is one of
+        start   profile the requests to endpoint (any endpoint if not given) with mode
+                cprofile or sample, for the next requests requests or seconds seconds
+        status  report the progress of the last session
+        stop    end the current session early
+        result  download the profile of the last session"""
+        if not self.admin_token:
+            self.send_api_error(404, 'Profiling is turned off')
+            return
+        supplied = self.headers.get('Authorization', '').encode('utf-8')
+        if not hmac.compare_digest(supplied, f'Bearer {self.admin_token}'.encode('utf-8')):
+            self.send_api_error(403, 'Invalid admin token')
+            return
+        query_params = flatten_qs(parse_qs(urlparse(self.path).query))
+        action = query_params.get('action', 'start')
+        if action == 'start':
+            endpoint = query_params.get('endpoint')
+            if endpoint is not None and not any(endpoint in endpoints for endpoints in (self.get_endpoints, self.post_endpoints, self.rpc_endpoints, self.asyncRPC_endpoints)):
+                self.send_api_error(404, f'Endpoint {endpoint} not found')
+                return
+            try:
+                requests = int(query_params['requests']) if 'requests' in query_params else None
+                seconds = float(query_params['seconds']) if 'seconds' in query_params else None
+                session = self.request_profiler.start(endpoint=endpoint, mode=query_params.get('mode', 'cprofile'), requests=requests, seconds=seconds)
+            except ValueError as e:
+                self.send_api_error(400, str(e))
+                return
+            self.send_body(200, api_success(session.status(), 'application/json'))
+            return
+        if action not in ('status', 'stop', 'result'):
+            self.send_api_error(400, f'Unknown profiler action {action}')
+            return
+        session = self.request_profiler.stop() if action == 'stop' else self.request_profiler.last
+        if session is None:
+            self.send_api_error(404, 'No profiling session has been started')
+            return
+        if action == 'result':
+            data, mimetype, extension = session.result()
+            self.handle_result(rawPayload(data, mimetype, filename=f'tarp-{session.endpoint or "all"}.{extension}'))
+            return
+        self.send_body(200, api_success(session.status(), 'application/json'))
 
     def asyncProbe(self):
-        """Probes the status of an asynchronous operation by UUID."""
+        """Probes the status of an asynchronous operation by UUID.
+        A timeout parameter holds the request open until the operation finishes
+        or the timeout runs out, as for asyncGet."""
         query_params = parse_qs(urlparse(self.path).query)
         uuid = query_params.get('UUID', [None])[0]
         if not uuid:
-            self.send_response(400)
-            self.send_header('Content-Type', 'application/json')
-            self.end_headers()
-            self.wfile.write(api_error('UUID parameter is required'))
+            self.send_api_error(400, 'UUID parameter is required')
             return
-        if uuid not in self.futures:
-            self.send_response(404)
-            self.send_header('Content-Type', 'application/json')
-            self.end_headers()
-            self.wfile.write(api_error('UUID not found').encode('utf-8'))
+        if self.route_job(uuid):
             return
-        future = self.futures[uuid]['future']
-        if future.done():
-            result = future.result()
-            status = 'completed'
+        job = self.futures.get(uuid)
+        if job is None:
+            self.send_api_error(404, 'UUID not found')
+            return
+        future = job['future']
+        timeout = self.poll_timeout(query_params)
+        self.phase('execute')
+        if timeout and not self.polled:
+            concurrent.futures.wait([future], timeout=timeout)
+        self.phase('serialize')
+        result = {"suggested_wait": job['wait']}
+        if not future.done():
+            result['status'] = 'in_progress'
+        elif future.exception() is not None:
+            result['status'] = 'failed'
+            result['error'] = str(future.exception())
         else:
-            status = 'in_progress'
-        self.send_response(200)
-        self.send_header('Content-Type', 'application/json')
-        self.end_headers()
-        self.wfile.write(api_success({'status': status, "suggested_wait":self.futures[uuid]['wait']}, 'application/json'))
+            result['status'] = 'completed'
+        self.send_body(200, api_success(result, 'application/json'))
 
     def do_GET(self):
         """Handles GET requests. This function is a core part of the HTTP server and
         is called whenever a GET request is made to the server."""
         parsed = urlparse(self.path)
         #Firt check if the path is root, if so call the get_endpoints
+        self.metric_labels = ('internal', parsed.path.lstrip('/'))
         if parsed.path == '/':
-            self.send_response(200)
-            self.send_header('Content-Type', 'application/json')
-            self.end_headers()
-            self.wfile.write(api_success(self.get_known_endpoints(), 'application/json'))
+            self.send_manifest()
+            return
+        if parsed.path == '/metrics':
+            self.send_metrics()
+            return
+        if parsed.path == '/profile':
+            self.send_profile()
             return
         #If the path is /asyncGet or /asyncProbe, handle those special cases
         if parsed.path == '/asyncGet':
@@ -297,44 +1581,46 @@ class server(BaseHTTPRequestHandler):
         if parsed.path == '/asyncProbe':
             self.asyncProbe()
             return
+        if parsed.path == '/asyncStats':
+            self.asyncStats()
+            return
 
         # Otherwise, check if the path matches a registered endpoint
         endpoint = parsed.path.lstrip('/')
         if endpoint in self.get_endpoints:
+            self.metric_labels = ('GET', endpoint)
+            self.compress_options = self.get_endpoints[endpoint]
+            if not self.check_body_size(self.get_endpoints[endpoint]):
+                return
 
             #Since RFC 7231 it is valid to have a GET request with a body, but it is not common. Still, we handle it gracefully and pass it to the endpoint if the endpoint has two parameters
-            content_length = int(self.headers.get('Content-Length', 0))
             content_type = self.headers.get('Content-Type', None)
-            body_data = self.rfile.read(content_length) if content_length else None
-            body_data = self.process_body(body_data, content_type)
+            if self.get_endpoints[endpoint]['stream_body']:
+                body_data = self.open_body_stream()
+            else:
+                body_data = self.read_body()
+                body_data = self.process_body(body_data, content_type)
+            query = self.web_query(parsed)
+            #Spooled bodies are too big to be worth hashing, so they are never cached
+            if not isinstance(body_data, mmap.mmap) and self.cached_response(self.get_endpoints[endpoint], endpoint, query, body_data):
+                return
             try:
-                result = self.get_endpoints[endpoint]['func'](flatten_qs(parse_qs(parsed.query)), body_data)
+                #Spooled and streamed bodies are never hashed to coalesce calls either
+                key_parts = (endpoint, query, body_data) if not isinstance(body_data, (mmap.mmap, requestBody)) else ()
+                self.phase('execute')
+                result = self.call_endpoint(self.get_endpoints[endpoint], (query, body_data), {}, *key_parts)
+                self.phase('serialize')
             except Exception as e:
-                if isinstance(e, OperationInProgress):
-                    self.send_response(503)
-                    self.send_header('Content-Type', 'application/json')
-                    self.send_header('Retry-After', str(e.retry_after))
-                    self.end_headers()
-                    self.wfile.write(api_error(str(e),"OperationInProgress"))
-                    return
-                elif isinstance(e, InvalidServerState):
-                    self.send_response(503)
-                    self.send_header('Content-Type', 'application/json')
-                    self.end_headers()
-                    self.wfile.write(api_error(str(e),"InvalidServerState"))
-                    return
-                else:
-                    self.send_response(500)
-                    self.send_header('Content-Type', 'application/json')
-                    self.end_headers()
-                    self.wfile.write(api_error(str(e)))
-                    return
-            self.handle_result(result, mimetype=self.get_endpoints[endpoint]['mimetype'])
+                self.handle_exception(e)
+                return
+            finally:
+                if isinstance(body_data, requestBody):
+                    self.finish_body_stream(body_data)
+            self.invalidate(self.get_endpoints[endpoint])
+            self.handle_result(result, mimetype=self.get_endpoints[endpoint]['mimetype'], web_endpoint=endpoint)
         else:
-            self.send_response(404)
-            self.send_header('Content-Type', 'application/json')
-            self.end_headers()
-            self.wfile.write(api_error(str("Endpoint not found")))
+            self.metric_labels = ('GET', '')
+            self.send_api_error(404, "Endpoint not found")
             return
 
 
@@ -343,42 +1629,145 @@ class server(BaseHTTPRequestHandler):
         is called whenever a POST request is made to the server."""
         parsed = urlparse(self.path)
         endpoint = parsed.path.lstrip('/')
+        if parsed.path == '/batch':
+            self.metric_labels = ('BATCH', 'batch')
+            return self.do_batch()
         if endpoint in self.rpc_endpoints:
+            self.metric_labels = ('RPC', endpoint)
             return self.do_RPC()
         if endpoint in self.asyncRPC_endpoints:
+            self.metric_labels = ('ASYNCRPC', endpoint)
             return self.do_asyncRPC()
+        self.metric_labels = ('POST', endpoint if endpoint in self.post_endpoints else '')
         if endpoint in self.post_endpoints:
-            content_length = int(self.headers.get('Content-Length', 0))
+            self.compress_options = self.post_endpoints[endpoint]
+            if not self.check_body_size(self.post_endpoints[endpoint]):
+                return
             content_type = self.headers.get('Content-Type', None)
-            body_data = self.rfile.read(content_length) if content_length else None
-            body_data = self.process_body(body_data, content_type)
+            if self.post_endpoints[endpoint]['stream_body']:
+                body_data = self.open_body_stream()
+            else:
+                body_data = self.read_body()
+                body_data = self.process_body(body_data, content_type)
             try:
-                result = self.post_endpoints[endpoint]['func'](flatten_qs(parse_qs(parsed.query)), body_data)
+                self.phase('execute')
+                result = self.call_endpoint(self.post_endpoints[endpoint], (self.web_query(parsed), body_data), {})
+                self.phase('serialize')
             except Exception as e:
-                if isinstance(e, OperationInProgress):
-                    self.send_response(503)
-                    self.send_header('Content-Type', 'application/json')
-                    self.send_header('Retry-After', str(e.retry_after))
-                    self.end_headers()
-                    self.wfile.write(api_error(str(e)))
-                    return
-                elif isinstance(e, InvalidServerState):
-                    self.send_response(503)
-                    self.send_header('Content-Type', 'application/json')
-                    self.end_headers()
-                    self.wfile.write(api_error(str(e)))
-                    return
-                else:
-                    self.send_response(500)
-                    self.send_header('Content-Type', 'application/json')
-                    self.end_headers()
-                    self.wfile.write(api_error(str(e)))
-                    return
-            self.handle_result(result, mimetype=self.post_endpoints[endpoint]['mimetype'])
+                self.handle_exception(e)
+                return
+            finally:
+                if isinstance(body_data, requestBody):
+                    self.finish_body_stream(body_data)
+            self.invalidate(self.post_endpoints[endpoint])
+            self.handle_result(result, mimetype=self.post_endpoints[endpoint]['mimetype'], web_endpoint=endpoint)
         else:
-            self.send_response(404)
-            self.end_headers()
-            self.wfile.write(api_error('Endpoint not found'))
+            self.send_api_error(404, 'Endpoint not found')
+
+    def read_rpc_arguments(self, parsed):
+        """Reads and unpacks the args and kwargs of an RPC or AsyncRPC request.
+        Returns None (having already sent an error response) if the request is malformed."""
+        content_type = self.headers.get('Content-Type', None)
+        if content_type == wire.PICKLE_MIMETYPE:
+            return self.read_framed_rpc_arguments(parsed)
+        if content_type == shm.SHM_MIMETYPE and self.shm_transport:
+            return self.read_shm_rpc_arguments(parsed)
+        body_data = self.read_body()
+        body_data = self.process_body(body_data, content_type)
+        #If there are any query parameters that is an error, #RPC endpoints should not have query parameters
+        if parsed.query:
+            self.send_api_error(400, 'RPC endpoints should not have query parameters')
+            return None
+        #The body_data is a JSON object, with the top level being a dict with two keys: "args" and "kwargs"
+        #If it isn't a dict at this point, it is an error
+        if not isinstance(body_data, dict) or 'args' not in body_data or 'kwargs' not in body_data:
+            self.send_api_error(400, 'RPC body data should be a JSON object with "args" and "kwargs" keys')
+            return None
+        #The args and kwargs are base64 encoded pickles - unpack them
+        args = pickle.loads(base64.b64decode(body_data['args']))
+        kwargs = pickle.loads(base64.b64decode(body_data['kwargs']))
+        if not isinstance(args, tuple):
+            self.send_api_error(400, 'RPC args should be a tuple')
+            return None
+        if not isinstance(kwargs, dict):
+            self.send_api_error(400, 'RPC kwargs should be a dict')
+            return None
+        return args, kwargs
+
+    def read_framed_rpc_arguments(self, parsed):
+        """Reads the args and kwargs of an RPC or AsyncRPC request sent in the framed
+        binary format. The body is a single pickled (args, kwargs) tuple."""
+        try:
+            arguments = wire.load_frames(self.read_frames())
+        except Exception as e:
+            #The stream position is unknown after a bad frame so drop the connection
+            self.close_connection = True
+            self.send_api_error(400, f'Malformed RPC body: {e}')
+            return None
+        if parsed.query:
+            self.send_api_error(400, 'RPC endpoints should not have query parameters')
+            return None
+        if not isinstance(arguments, tuple) or len(arguments) != 2:
+            self.send_api_error(400, 'RPC body should be a pickled (args, kwargs) tuple')
+            return None
+        args, kwargs = arguments
+        if not isinstance(args, tuple):
+            self.send_api_error(400, 'RPC args should be a tuple')
+            return None
+        if not isinstance(kwargs, dict):
+            self.send_api_error(400, 'RPC kwargs should be a dict')
+            return None
+        return args, kwargs
+
+    def read_shm_rpc_arguments(self, parsed):
+        """Reads the args and kwargs of an RPC or AsyncRPC request whose large buffers
+        were put in shared memory files by a client on the same host."""
+        try:
+            arguments = shm.loads(self.read_body(), self.shm_directory)
+        except Exception as e:
+            self.send_api_error(400, f'Malformed RPC body: {e}')
+            return None
+        if parsed.query:
+            self.send_api_error(400, 'RPC endpoints should not have query parameters')
+            return None
+        if not isinstance(arguments, tuple) or len(arguments) != 2 or not isinstance(arguments[0], tuple) or not isinstance(arguments[1], dict):
+            self.send_api_error(400, 'RPC body should be a pickled (args, kwargs) tuple')
+            return None
+        return arguments
+
+    def rpc_stream(self, result):
+        """Wraps the items of an iterator returned by an RPC endpoint as framed records.
+        An exception part way through is sent as an error record and the stream
+        always finishes with an end record so that the client can spot truncation."""
+        try:
+            for item in result:
+                yield wire.dumps(('item', item))
+        except Exception as e:
+            yield wire.dumps(('error', self.exception_info(e)))
+            return
+        yield wire.dumps(('end', None))
+
+    def call_endpoint(self, endpoint_data, args, kwargs, *key_parts):
+        """Calls an endpoint's function, sharing the call with identical ones already
+        running if the endpoint coalesces calls. key_parts identify the call."""
+        flight = endpoint_data.get('coalesce')
+        key = cache_key(*key_parts) if flight is not None and key_parts else None
+        if key is None:
+            return self.run_endpoint(endpoint_data, args, kwargs)
+        return flight.run(key, self.run_endpoint, endpoint_data, args, kwargs)
+
+    def run_endpoint(self, endpoint_data, args, kwargs):
+        """Runs an endpoint's function, on its pool if it has one. The handler thread
+        waits for the result. On process pools large buffers in the arguments and
+        result go through shared memory rather than being pickled down a pipe."""
+        if endpoint_data.get('pool') is None:
+            return endpoint_data['func'](*args, **kwargs)
+        pool = self.pools[endpoint_data['pool']]
+        if pool.kind == 'process':
+            #mmaps cannot be pickled, but their contents can be sent as a buffer
+            args = tuple(pickle.PickleBuffer(arg) if isinstance(arg, mmap.mmap) else arg for arg in args)
+            return shm.call(pool, endpoint_data['func'], args, kwargs, self.shm_threshold, self.shm_directory)
+        return pool.submit(endpoint_data['func'], *args, **kwargs).result()
 
     def do_RPC(self):
         """Handles RPC requests. This function is NOT part of the HTTP server and is
@@ -386,67 +1775,93 @@ class server(BaseHTTPRequestHandler):
         parsed = urlparse(self.path)
         endpoint = parsed.path.lstrip('/')
         if endpoint in self.rpc_endpoints:
-            content_length = int(self.headers.get('Content-Length', 0))
-            content_type = self.headers.get('Content-Type', None)
-            body_data = self.rfile.read(content_length) if content_length else None
-            body_data = self.process_body(body_data, content_type)
-            #If there are any query parameters that is an error, #RPC endpoints should not have query parameters
-            if parsed.query:
-                self.send_response(400)
-                self.send_header('Content-Type', 'application/json')
-                self.end_headers()
-                self.wfile.write(api_error('RPC endpoints should not have query parameters'))
-                return
-            #The body_data is a JSON object, with the top level being a dict with two keys: "args" and "kwargs"
-            #If it isn't a dict at this point, it is an error
-            if not isinstance(body_data, dict) or 'args' not in body_data or 'kwargs' not in body_data:
-                self.send_response(400)
-                self.send_header('Content-Type', 'application/json')
-                self.end_headers()
-                self.wfile.write(api_error('RPC body data should be a JSON object with "args" and "kwargs" keys'))
+            self.compress_options = self.rpc_endpoints[endpoint]
+            if not self.check_body_size(self.rpc_endpoints[endpoint]):
                 return
-            #The args and kwargs are base64 encoded pickles - unpack them
-            args = pickle.loads(base64.b64decode(body_data['args']))
-            kwargs = pickle.loads(base64.b64decode(body_data['kwargs']))
-            if not isinstance(args, tuple):
-                self.send_response(400)
-                self.send_header('Content-Type', 'application/json')
-                self.end_headers()
-                self.wfile.write(api_error('RPC args should be a tuple'))
+            arguments = self.read_rpc_arguments(parsed)
+            if arguments is None:
                 return
-            if not isinstance(kwargs, dict):
-                self.send_response(400)
-                self.send_header('Content-Type', 'application/json')
-                self.end_headers()
-                self.wfile.write(api_error('RPC kwargs should be a dict'))
+            args, kwargs = arguments
+            #Framed and JSON replies differ, so they are cached separately
+            if self.cached_response(self.rpc_endpoints[endpoint], endpoint, args, kwargs, self.accepts_frames()):
                 return
             try:
-                result = {"payload":pickle.dumps(self.rpc_endpoints[endpoint]['func'](*args, **kwargs))}
-            except Exception as e:
-                if isinstance(e, OperationInProgress):
-                    self.send_response(503)
-                    self.send_header('Content-Type', 'application/json')
-                    self.send_header('Retry-After', str(e.retry_after))
-                    self.end_headers()
-                    self.wfile.write(api_error(str(e)))
-                    return
-                elif isinstance(e, InvalidServerState):
-                    self.send_response(503)
-                    self.send_header('Content-Type', 'application/json')
-                    self.end_headers()
-                    self.wfile.write(api_error(str(e)))
-                    return
+                self.phase('execute')
+                result = self.call_endpoint(self.rpc_endpoints[endpoint], args, kwargs, endpoint, args, kwargs)
+                self.phase('serialize')
+                self.invalidate(self.rpc_endpoints[endpoint])
+                if isinstance(result, Iterator) and self.accepts_frames():
+                    payload = self.rpc_stream(result)
+                elif isinstance(result, Iterator):
+                    #Older clients cannot read a stream so they get a list
+                    payload = {"payload":pickle.dumps(list(result))}
+                elif self.accepts_shm():
+                    payload = self.pack_result(result)
+                elif self.accepts_frames():
+                    payload = wire.dumps(result)
                 else:
-                    self.send_response(500)
-                    self.send_header('Content-Type', 'application/json')
-                    self.end_headers()
-                    self.wfile.write(api_error(str(e)))
-                    return
-            self.handle_result(result, mimetype=self.rpc_endpoints[endpoint]['mimetype'])
+                    payload = {"payload":pickle.dumps(result)}
+            except Exception as e:
+                self.handle_exception(e)
+                return
+            if isinstance(payload, Iterator):
+                self.send_chunked(payload, wire.STREAM_MIMETYPE)
+            elif isinstance(payload, wire.framedBody):
+                self.send_frames(200, payload)
+            elif isinstance(payload, list):
+                self.send_packed(payload)
+            else:
+                self.handle_result(payload, mimetype=self.rpc_endpoints[endpoint]['mimetype'])
         else:
-            self.send_response(404)
-            self.end_headers()
-            self.wfile.write(api_error('Endpoint not found'))
+            self.send_api_error(404, 'Endpoint not found')
+
+    def run_batch_call(self, call):
+        """Runs a single call from a batch, returning ('ok', result) or ('error', info)."""
+        try:
+            name, args, kwargs = call
+            if name not in self.rpc_endpoints:
+                raise Exception(f"RPC endpoint {name} not found")
+            result = self.call_endpoint(self.rpc_endpoints[name], args, kwargs, name, args, kwargs)
+            self.invalidate(self.rpc_endpoints[name])
+            if isinstance(result, Iterator):
+                result = list(result)
+            return ('ok', result)
+        except Exception as e:
+            return ('error', self.exception_info(e))
+
+    def do_batch(self):
+        """Handles batched RPC requests. This function is NOT part of the HTTP server and is
+        called from do_POST for the /batch path. The body is a framed pickle of a dict with
+        a list of (name, args, kwargs) "calls" and a "concurrent" flag. The calls are run
+        in order, or together on batch_executor if concurrent is set, and the reply is a
+        list with a result or error record for each call in the same order."""
+        if self.headers.get('Content-Type', None) != wire.PICKLE_MIMETYPE:
+            self.send_api_error(400, 'Batched calls must be sent in the framed binary format')
+            return
+        if not self.check_body_size({}):
+            return
+        try:
+            batch = wire.load_frames(self.read_frames())
+            calls = list(batch['calls'])
+            run_concurrently = batch.get('concurrent', False)
+        except Exception as e:
+            #The stream position is unknown after a bad frame so drop the connection
+            self.close_connection = True
+            self.send_api_error(400, f'Malformed batch body: {e}')
+            return
+        executor = getattr(self, 'batch_executor', None)
+        self.phase('execute')
+        if run_concurrently and executor is not None:
+            results = list(executor.map(self.run_batch_call, calls))
+        else:
+            results = [self.run_batch_call(call) for call in calls]
+        self.phase('serialize')
+        try:
+            payload = wire.dumps(results)
+        except Exception as e:
+            self.handle_exception(e)
+            return
+        self.send_frames(200, payload)
 
     def do_asyncRPC(self):
         """Handles AsyncRPC requests. This function is NOT part of the HTTP server and is
@@ -454,79 +1869,486 @@ class server(BaseHTTPRequestHandler):
         parsed = urlparse(self.path)
         endpoint = parsed.path.lstrip('/')
         if endpoint in self.asyncRPC_endpoints:
-            content_length = int(self.headers.get('Content-Length', 0))
-            content_type = self.headers.get('Content-Type', None)
-            body_data = self.rfile.read(content_length) if content_length else None
-            body_data = self.process_body(body_data, content_type)
-            #If there are any query parameters that is an error, #RPC endpoints should not have query parameters
-            if parsed.query:
-                self.send_response(400)
-                self.send_header('Content-Type', 'application/json')
-                self.end_headers()
-                self.wfile.write(api_error('RPC endpoints should not have query parameters'))
+            if not self.check_body_size(self.asyncRPC_endpoints[endpoint]):
                 return
-            #The body_data is a JSON object, with the top level being a dict with two keys: "args" and "kwargs"
-            #If it isn't a dict at this point, it is an error
-            if not isinstance(body_data, dict) or 'args' not in body_data or 'kwargs' not in body_data:
-                self.send_response(400)
-                self.send_header('Content-Type', 'application/json')
-                self.end_headers()
-                self.wfile.write(api_error('RPC body data should be a JSON object with "args" and "kwargs" keys'))
+            arguments = self.read_rpc_arguments(parsed)
+            if arguments is None:
                 return
-            #The args and kwargs are base64 encoded pickles - unpack them
-            args = pickle.loads(base64.b64decode(body_data['args']))
-            kwargs = pickle.loads(base64.b64decode(body_data['kwargs']))
-            if not isinstance(args, tuple):
-                self.send_response(400)
-                self.send_header('Content-Type', 'application/json')
-                self.end_headers()
-                self.wfile.write(api_error('RPC args should be a tuple'))
-                return
-            if not isinstance(kwargs, dict):
-                self.send_response(400)
-                self.send_header('Content-Type', 'application/json')
-                self.end_headers()
-                self.wfile.write(api_error('RPC kwargs should be a dict'))
+            args, kwargs = arguments
+            #Run the async RPC function on its pool
+            pool = self.asyncRPC_endpoints[endpoint].get('pool')
+            executor = self.pools[pool] if pool is not None else self.pools.get('default', self.executor)
+            start = lambda: executor.submit(self.asyncRPC_endpoints[endpoint]['func'], *args, **kwargs)
+            wait = self.asyncRPC_endpoints[endpoint].get('wait', 5)  # Default wait time is 5 seconds if not specified
+            #Identical calls share a running job if the endpoint coalesces them
+            key = cache_key(endpoint, args, kwargs) if self.asyncRPC_endpoints[endpoint].get('coalesce') else None
+            try:
+                #The registry generates a UUID for the async operation
+                self.phase('execute')
+                ID = self.futures.start(start, wait, key)
+                self.phase('serialize')
+            except OperationInProgress as e:
+                self.handle_exception(e)
                 return
-            #Run the async RPC function in a separate thread
-            future = self.executor.submit(self.asyncRPC_endpoints[endpoint]['func'], *args, **kwargs)
-            #Generate a UUID for the async operation
-            ID = str(uuid.uuid4())
-            self.futures[ID]={}
-            self.futures[ID]['future'] = future
-            self.futures[ID]['wait'] = self.asyncRPC_endpoints[endpoint].get('wait', 5)  # Default wait time is 5 seconds if not specified
-            result = {"ID":ID, "suggested_wait": self.futures[ID].get('wait', 5)}
+            self.invalidate(self.asyncRPC_endpoints[endpoint])
+            result = {"ID":ID, "suggested_wait": wait}
 
             self.handle_result(result, mimetype=self.asyncRPC_endpoints[endpoint]['mimetype'])
         else:
-            self.send_response(404)
-            self.end_headers()
-            self.wfile.write(api_error('Endpoint not found'))
+            self.send_api_error(404, 'Endpoint not found')
+
+# The asyncio engine. Connections, keep-alive and the framing of requests are
+# handled on an event loop, so idle connections cost no threads. Each request
+# is then handed to the normal handler class on a bounded thread pool, with
+# an rfile and wfile that read from and write to the connection through the loop.
+
+# Request bodies up to this size are read on the event loop before the handler
+# runs, larger ones are read by the handler as it needs them
+ASYNCIO_INLINE_BODY = 1024 * 1024
+
+class loopReader(io.RawIOBase):
+    """The rfile for a request handled by the asyncio engine. It returns the
+    request head already read by the event loop followed by the body, which
+    is either already in memory or read from the connection through the loop.
+    It never reads past the end of the request."""
+    def __init__(self, data, stream=None, remaining=0, loop=None):
+        self.data = memoryview(data)
+        self.position = 0
+        self.stream = stream
+        self.remaining = remaining
+        self.loop = loop
+
+    def readable(self):
+        return True
 
-def runServer(cls, secure=False, certfile='snakeoil.pem', keyfile='snakeoil.key', port=None, bindTo=''):
+    def readinto(self, b):
+        with memoryview(b) as view:
+            view = view.cast('B')
+            if self.position < self.data.nbytes:
+                n = min(view.nbytes, self.data.nbytes - self.position)
+                view[:n] = self.data[self.position:self.position + n]
+                self.position += n
+                return n
+            if not self.remaining:
+                return 0
+            data = asyncio.run_coroutine_threadsafe(self.stream.read(min(view.nbytes, self.remaining)), self.loop).result()
+            view[:len(data)] = data
+            self.remaining -= len(data)
+            return len(data)
+
+class loopWriter:
+    """The wfile for a request handled by the asyncio engine. Small writes are
+    collected and sent together, and every send waits for the transport to
+    drain so a slow client slows the handler down rather than filling memory."""
+    def __init__(self, stream, loop):
+        self.stream = stream
+        self.loop = loop
+        self.buffer = bytearray()
+
+    def write(self, data):
+        with memoryview(data) as view:
+            if view.nbytes < 65536:
+                self.buffer += view
+                if len(self.buffer) >= 65536:
+                    self.flush()
+                return view.nbytes
+        self.flush()
+        self.send(data)
+        return len(data)
+
+    def flush(self):
+        if self.buffer:
+            data = bytes(self.buffer)
+            self.buffer.clear()
+            self.send(data)
+
+    def send(self, data):
+        async def write():
+            self.stream.write(data)
+            await self.stream.drain()
+        asyncio.run_coroutine_threadsafe(write(), self.loop).result()
+
+def request_framing(head):
+    """Returns the Content-Length of a request and whether the client expects a
+    100 Continue before sending its body. Only these two headers are needed to
+    find where the request ends, the handler parses the rest."""
+    content_length = 0
+    expect_continue = False
+    for line in head.split(b'\r\n')[1:]:
+        name, _, value = line.partition(b':')
+        name = name.strip().lower()
+        if name == b'content-length':
+            try:
+                content_length = int(value.strip())
+            except ValueError:
+                content_length = 0
+        elif name == b'expect':
+            expect_continue = True
+    return content_length, expect_continue
+
+def job_query(head):
+    """Returns the query parameters of a GET request to /asyncGet or /asyncProbe,
+    or None for any other request."""
+    request_line = head[:head.find(b'\r\n')].decode('latin-1').split()
+    if len(request_line) != 3 or request_line[0] != 'GET':
+        return None
+    parsed = urlparse(request_line[1])
+    if parsed.path not in ('/asyncGet', '/asyncProbe'):
+        return None
+    return parse_qs(parsed.query)
+
+def pending_poll(cls, head):
+    """Returns (future, timeout) if the request is a long poll of /asyncGet or
+    /asyncProbe for a job that is still running, so that the asyncio engine can
+    wait for the job on the event loop rather than holding a pool thread.
+    Otherwise returns None."""
+    query_params = job_query(head)
+    if query_params is None:
+        return None
+    timeout = cls.poll_timeout(query_params)
+    job = cls.futures.get(query_params.get('UUID', [''])[0]) if timeout else None
+    if job is None or job['future'].done():
+        return None
+    return job['future'], timeout
+
+def job_worker(cls, head):
+    """Returns the index of the worker process that started the job a request to
+    /asyncGet or /asyncProbe is about, if that is another worker, or None."""
+    if cls.worker_index is None:
+        return None
+    query_params = job_query(head)
+    if query_params is None:
+        return None
+    owner = prefork.job_owner(query_params.get('UUID', [''])[0])
+    return owner if owner is not None and owner != cls.worker_index else None
+
+def header_lines(head):
+    """Splits the head of a request or response into its first line and a list of
+    (lower case name, line) for its headers."""
+    lines = head.split(b'\r\n')
+    return lines[0], [(line.partition(b':')[0].strip().lower().decode('latin-1'), line) for line in lines[1:] if line]
+
+async def proxy_job(cls, head, owner, writer):
+    """Passes a request about a job on to the worker that started it and sends back
+    its response, as route_job does, but on the event loop so that a long poll of
+    the job holds no pool thread. Returns True if the connection should be closed
+    afterwards, or None if the worker could not be reached, in which case nothing
+    has been sent and route_job reports the missing job."""
+    first, headers = header_lines(head)
+    skip = prefork.HOP_BY_HOP | {'content-length', 'expect'}
+    request = [first] + [line for name, line in headers if name not in skip] + [b'Connection: close', b'', b'']
+    #Long polls are held open by the other worker for up to max_poll_timeout
+    timeout = cls.max_poll_timeout + 60
+    try:
+        reader, upstream = await asyncio.open_unix_connection(prefork.socket_path(cls.worker_directory, owner), limit=65536)
+    except OSError:
+        return None
+    if cls.requests_in_flight is not None:
+        cls.requests_in_flight.enter()
+    try:
+        try:
+            upstream.write(b'\r\n'.join(request))
+            response_head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), timeout)
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            #The worker has exited since it started the job, and the job went with it
+            return None
+        except asyncio.TimeoutError:
+            return True
+        status, response_headers = header_lines(response_head)
+        length = next((int(line.partition(b':')[2]) for name, line in response_headers if name == 'content-length'), None)
+        connection = b' '.join(line.partition(b':')[2].strip().lower() for name, line in headers if name == 'connection')
+        close = (length is None or first.endswith(b'HTTP/1.0') or b'close' in connection
+                 or (cls.requests_in_flight is not None and cls.requests_in_flight.draining))
+        #A response without a Content-Length is passed on as it is, chunks and all,
+        #and ends when the other worker closes the connection
+        keep = prefork.HOP_BY_HOP - ({'transfer-encoding'} if length is None else set())
+        response = [status] + [line for name, line in response_headers if name not in keep]
+        response += ([b'Connection: close'] if close else []) + [b'', b'']
+        writer.write(b'\r\n'.join(response))
+        remaining = length
+        try:
+            while remaining is None or remaining > 0:
+                block = await asyncio.wait_for(reader.read(prefork.PROXY_BLOCK if remaining is None else min(prefork.PROXY_BLOCK, remaining)), timeout)
+                if not block:
+                    #A response cut off early leaves the connection unusable
+                    return close or remaining is not None
+                writer.write(block)
+                await writer.drain()
+                if remaining is not None:
+                    remaining -= len(block)
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            return True
+        return close
+    finally:
+        upstream.close()
+        if cls.requests_in_flight is not None:
+            cls.requests_in_flight.leave()
+
+def run_handler(cls, client_address, rfile, wfile, polled=False):
+    """Runs one request through a handler instance on a worker thread. Returns
+    True if the connection should be closed afterwards."""
+    #The handler is not constructed normally because that would start
+    #serving a socket, rfile and wfile are given to it instead
+    handler = cls.__new__(cls)
+    handler.client_address = client_address
+    handler.server = None
+    handler.request = None
+    handler.rfile = rfile
+    handler.wfile = wfile
+    handler.close_connection = True
+    handler.polled = polled
+    try:
+        handler.handle_one_request()
+        wfile.flush()
+    except Exception as e:
+        if not isinstance(e, ConnectionError):
+            handler.log_error('Request failed: %s', e)
+        return True
+    return handler.close_connection
+
+async def serve_connection(cls, executor, keepalive_timeout, reader, writer):
+    """Serves the requests on one connection in turn until it is closed."""
+    loop = asyncio.get_running_loop()
+    #Unix socket peers have no address, so they are logged with the socket's path
+    client_address = writer.get_extra_info('peername') or (writer.get_extra_info('sockname') or '', 0)
+    try:
+        while True:
+            try:
+                head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), keepalive_timeout)
+                content_length, expect_continue = request_framing(head)
+                if content_length <= ASYNCIO_INLINE_BODY and not expect_continue:
+                    rfile = loopReader(head + await reader.readexactly(content_length))
+                else:
+                    rfile = loopReader(head, reader, content_length, loop)
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError, ConnectionError):
+                break
+            owner = job_worker(cls, head) if not content_length and not expect_continue else None
+            if owner is not None:
+                close = await proxy_job(cls, head, owner, writer)
+                if close:
+                    break
+                if close is not None:
+                    continue
+            wfile = loopWriter(writer, loop)
+            poll = pending_poll(cls, head)
+            if poll is not None:
+                #asyncio.wait leaves the job running when the timeout runs out
+                await asyncio.wait([asyncio.wrap_future(poll[0])], timeout=poll[1])
+            close = await loop.run_in_executor(executor, run_handler, cls, client_address, io.BufferedReader(rfile), wfile, poll is not None)
+            if close:
+                break
+    finally:
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except Exception:
+            pass
+
+async def serve_asyncio(cls, server_address, ssl_context, keepalive_timeout, max_workers, unix_socket=None, sockets=(), stop_signal=None, drain_timeout=None):
+    """Runs the asyncio engine until cancelled, on a TCP address and/or a Unix socket
+    and on any sockets that are already listening. With stop_signal the engine stops
+    accepting connections when the process gets that signal, and returns once the
+    requests in flight have finished or drain_timeout seconds have passed."""
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+    def connected(reader, writer):
+        return serve_connection(cls, executor, keepalive_timeout, reader, writer)
+    listeners = []
+    if server_address is not None:
+        listeners.append(await asyncio.start_server(connected, server_address[0] or None, server_address[1], ssl=ssl_context, limit=65536))
+    if unix_socket is not None:
+        listeners.append(await asyncio.start_unix_server(connected, unix_socket, limit=65536))
+    #Newer Pythons remove the file of a Unix socket when its server closes, but
+    #sockets that are passed in are shared with other processes
+    keep_file = {'cleanup_socket': False} if sys.version_info >= (3, 13) else {}
+    for sock in sockets:
+        if sock.family == socket.AF_UNIX:
+            listeners.append(await asyncio.start_unix_server(connected, sock=sock, limit=65536, **keep_file))
+        else:
+            listeners.append(await asyncio.start_server(connected, sock=sock, ssl=ssl_context, limit=65536))
+    try:
+        if stop_signal is None:
+            await asyncio.gather(*(httpd.serve_forever() for httpd in listeners))
+            return
+        loop = asyncio.get_running_loop()
+        stopping = asyncio.Event()
+        loop.add_signal_handler(stop_signal, stopping.set)
+        await stopping.wait()
+        for httpd in listeners:
+            httpd.close()
+        await loop.run_in_executor(None, cls.requests_in_flight.drain, drain_timeout)
+    finally:
+        for httpd in listeners:
+            httpd.close()
+
+def runServer(cls, secure=False, certfile='snakeoil.pem', keyfile='snakeoil.key', port=None, bindTo='', keepalive_timeout=60, engine='threaded', max_workers=32, unix_socket=None, workers=None, reuse_port=False, drain_timeout=30):
+    #With unix_socket the server listens on that Unix domain socket path, and on
+    #TCP as well only if a port is given. The socket always serves plain HTTP
+    #With workers the server runs in that many forked processes (see tarp.prefork)
+    if engine not in ('threaded', 'asyncio'):
+        raise ValueError(f"Unknown server engine {engine}")
+    if workers is not None and workers < 1:
+        raise ValueError("workers must be at least 1")
     if secure:
-        port = port or 443
+        port = port or (None if unix_socket else 443)
     else:
-        port = port or 80
-    server_address = (bindTo, port)
+        port = port or (None if unix_socket else 80)
+    #Idle keep-alive connections are dropped after keepalive_timeout seconds so
+    #that abandoned clients do not hold a handler thread forever
+    cls.timeout = keepalive_timeout
+    server_address = (bindTo, port) if port is not None else None
+    if unix_socket is not None:
+        remove_stale_socket(unix_socket)
+    try:
+        if workers is not None:
+            serve_workers(cls, workers, server_address, secure, certfile, keyfile, keepalive_timeout, engine, max_workers, unix_socket, reuse_port, drain_timeout)
+        else:
+            serve(cls, server_address, secure, certfile, keyfile, keepalive_timeout, engine, max_workers, unix_socket)
+    finally:
+        if unix_socket is not None:
+            try:
+                os.unlink(unix_socket)
+            except FileNotFoundError:
+                pass
+
+def serve(cls, server_address, secure, certfile, keyfile, keepalive_timeout, engine, max_workers, unix_socket):
+    """Runs the server for runServer until it is stopped."""
+    if unix_socket is not None:
+        print(f'Serving HTTP on Unix socket {unix_socket}{" (asyncio engine)" if engine == "asyncio" else ""}')
+    if engine == 'asyncio':
+        #Connections are handled on an event loop and requests are run on a
+        #pool of at most max_workers threads
+        ssl_context = server_ssl_context(certfile, keyfile) if secure else None
+        if server_address is not None:
+            print(f'Serving {"HTTPS" if secure else "HTTP"} on port {server_address[1]} (asyncio engine)')
+        asyncio.run(serve_asyncio(cls, server_address, ssl_context, keepalive_timeout, max_workers, unix_socket))
+        return
+    if unix_socket is not None:
+        unix_httpd = ThreadedUnixHTTPServer(unix_socket, cls)
+        if server_address is None:
+            unix_httpd.serve_forever()
+            return
+        threading.Thread(target=unix_httpd.serve_forever, name='tarp-unix', daemon=True).start()
+    port = server_address[1]
     httpd = ThreadedHTTPServer(server_address, cls)
     if secure:
-        httpd.socket = ssl.wrap_socket(
-            httpd.socket,
-            server_side=True,
-            certfile=certfile,
-            keyfile=keyfile,
-            ssl_version=ssl.PROTOCOL_TLS
-        )
+        httpd.socket = secure_socket(httpd.socket, certfile, keyfile)
         print(f'Serving HTTPS on port {port}')
     else:
         print(f'Serving HTTP on port {port}')
     httpd.serve_forever()
 
+def server_ssl_context(certfile, keyfile):
+    """The TLS context of the asyncio engine."""
+    ssl_context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    ssl_context.load_cert_chain(certfile, keyfile)
+    return ssl_context
+
+def secure_socket(sock, certfile, keyfile):
+    """Wraps a listening socket of the threaded engine in TLS."""
+    return ssl.wrap_socket(
+        sock,
+        server_side=True,
+        certfile=certfile,
+        keyfile=keyfile,
+        ssl_version=ssl.PROTOCOL_TLS
+    )
+
+def listening_server(cls, sock, secure=False, certfile=None, keyfile=None):
+    """Builds a threaded engine server that accepts connections from a socket that
+    is already listening."""
+    server_class = ThreadedUnixHTTPServer if sock.family == socket.AF_UNIX else ThreadedHTTPServer
+    httpd = server_class(sock.getsockname(), cls, bind_and_activate=False)
+    httpd.socket.close()
+    #Other processes accept from the same socket, so a process woken for a
+    #connection that another has already taken must not block in accept
+    sock.setblocking(False)
+    if secure and sock.family != socket.AF_UNIX:
+        sock = secure_socket(sock, certfile, keyfile)
+    httpd.socket = sock
+    return httpd
+
+def serve_workers(cls, workers, server_address, secure, certfile, keyfile, keepalive_timeout, engine, max_workers, unix_socket, reuse_port, drain_timeout):
+    """Runs the server for runServer in worker processes under a supervisor. The
+    listening sockets are opened here and inherited by the workers, except that
+    with reuse_port each worker binds its own TCP socket with SO_REUSEPORT and the
+    kernel spreads connections over them."""
+    if reuse_port and not hasattr(socket, 'SO_REUSEPORT'):
+        raise ValueError('reuse_port needs SO_REUSEPORT, which this platform does not have')
+    sockets = []
+    directory = tempfile.mkdtemp(prefix='tarp-workers-')
+    try:
+        if server_address is not None:
+            #Binding here reports an address in use once rather than from every worker
+            listener = socket.create_server(server_address, reuse_port=reuse_port)
+            if reuse_port:
+                listener.close()
+            else:
+                sockets.append(listener)
+            print(f'Serving {"HTTPS" if secure else "HTTP"} on port {server_address[1]} with {workers} worker processes ({engine} engine)')
+        if unix_socket is not None:
+            listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sockets.append(listener)
+            listener.bind(unix_socket)
+            listener.listen()
+            print(f'Serving HTTP on Unix socket {unix_socket} with {workers} worker processes ({engine} engine)')
+        def run(index):
+            worker_sockets = list(sockets)
+            if reuse_port and server_address is not None:
+                worker_sockets.append(socket.create_server(server_address, reuse_port=True))
+            serve_worker(cls, index, worker_sockets, directory, secure, certfile, keyfile, keepalive_timeout, engine, max_workers, drain_timeout)
+        prefork.supervise(run, workers, drain_timeout)
+    finally:
+        for sock in sockets:
+            sock.close()
+        shutil.rmtree(directory, ignore_errors=True)
+
+def serve_worker(cls, index, sockets, directory, secure, certfile, keyfile, keepalive_timeout, engine, max_workers, drain_timeout):
+    """Serves requests in worker process index until it gets SIGTERM, then stops
+    accepting connections and waits up to drain_timeout seconds for the requests
+    in flight to finish."""
+    #Ctrl-C reaches every process in the group, and the supervisor stops the workers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    cls.worker_index = index
+    cls.worker_directory = directory
+    cls.futures.owner = index
+    cls.requests_in_flight = prefork.inFlight()
+    #Requests about this worker's AsyncRPC jobs are passed on to it through here
+    private_socket = prefork.socket_path(directory, index)
+    remove_stale_socket(private_socket)
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(private_socket)
+    listener.listen()
+    sockets = sockets + [listener]
+    if engine == 'asyncio':
+        ssl_context = server_ssl_context(certfile, keyfile) if secure else None
+        #The loop is left as it is when this returns, since the process exits
+        #straight away and closing it would only cancel the idle connections
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        loop.run_until_complete(serve_asyncio(cls, None, ssl_context, keepalive_timeout, max_workers, sockets=sockets, stop_signal=signal.SIGTERM, drain_timeout=drain_timeout))
+        return
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.set())
+    servers = [listening_server(cls, sock, secure, certfile, keyfile) for sock in sockets]
+    for httpd in servers:
+        threading.Thread(target=httpd.serve_forever, name='tarp-listener', daemon=True).start()
+    while not stopping.wait(1):
+        pass
+    for httpd in servers:
+        httpd.shutdown()
+        httpd.server_close()
+    cls.requests_in_flight.drain(drain_timeout)
+
 def makeServer(name='baseHandler', multiThreaded=False):
     sv = type(name,(server,),{})
+    sv.pools = {} # Each server has its own pools
     if multiThreaded:
-        sv.executor = concurrent.futures.ThreadPoolExecutor(max_workers=10)  # Use a thread pool executor for multithreaded servers
+        sv.executor = sv.addPool('default', 'thread', max_workers=10)  # Use a thread pool executor for multithreaded servers
     else:
-        sv.executor = concurrent.futures.ProcessPoolExecutor(max_workers=10) # Use a process pool executor for single-threaded, multi process servers
-    return sv
\ No newline at end of file
+        sv.executor = sv.addPool('default', 'process', max_workers=10) # Use a process pool executor for single-threaded, multi process servers
+    sv.batch_executor = concurrent.futures.ThreadPoolExecutor(max_workers=10) # Runs the calls of concurrent batches
+    sv.futures = jobRegistry() # Each server keeps its own AsyncRPC jobs
+    sv.request_metrics = metrics.serverMetrics() # and its own metrics
+    sv.request_profiler = profiler.requestProfiler() # and profiler
+    return sv
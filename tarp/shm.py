@@ -0,0 +1,187 @@
+#   Copyright 2025 Chris Brady, Heather Ratcliffe
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+# Shared memory transfer of objects between processes on the same host.
+# An object is pickled with tarp.wire into frames. Small frames are sent as
+# they are, but each large out of band buffer is written once to a file in
+# shared memory (/dev/shm where it exists) and only the file's name is sent.
+# The receiver maps the file copy-on-write, so the unpickled object (a NumPy
+# array, say) uses the shared pages directly, and then unlinks it. The memory
+# is released when the last mapping of it is closed.
+# The same packing is used between a TARP client and server on the same host,
+# where only the names of the files cross the HTTP request (see dumps and loads).
+import hashlib
+import ipaddress
+import mmap
+import os
+import pickle
+import socket
+import tempfile
+import threading
+from collections.abc import Iterator
+from urllib.parse import urlparse
+
+from . import wire
+
+SHM_DIRECTORY = '/dev/shm' if os.path.isdir('/dev/shm') else None
+# Out of band buffers at least this big are sent through shared memory
+THRESHOLD = 1024 * 1024
+# Content type of a request or response body holding a packed object
+SHM_MIMETYPE = 'application/x-tarp-shm'
+# Name advertised in the server's endpoint list when it accepts packed bodies
+SHM_CAPABILITY = 'shared-memory'
+PREFIX = 'tarp-'
+
+class segment:
+    """The name and size of a buffer written to a shared memory file."""
+    def __init__(self, path, size):
+        self.path = path
+        self.size = size
+
+    def map(self):
+        """Maps the file copy-on-write and unlinks it, so that it disappears once unmapped."""
+        with open(self.path, 'rb') as f:
+            data = mmap.mmap(f.fileno(), self.size, access=mmap.ACCESS_COPY)
+        self.unlink()
+        return data
+
+    def unlink(self):
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+def write_segment(buffer, directory=None):
+    """Writes a buffer to a new shared memory file and returns its segment."""
+    view = memoryview(buffer).cast('B')
+    fd, path = tempfile.mkstemp(prefix=PREFIX, dir=directory or SHM_DIRECTORY)
+    try:
+        with open(fd, 'wb', closefd=True) as f:
+            f.write(view)
+    except BaseException:
+        os.unlink(path)
+        raise
+    return segment(path, view.nbytes)
+
+def pack(obj, threshold=THRESHOLD, directory=None):
+    """Pickles an object into a list of frames that can be sent to another process,
+    with the large buffers replaced by shared memory segments."""
+    return pack_frames(wire.dump_frames(obj), threshold, directory)
+
+def pack_frames(frames, threshold=THRESHOLD, directory=None):
+    """Packs frames from tarp.wire, moving the large buffers to shared memory segments."""
+    packed = []
+    try:
+        for i, frame in enumerate(frames):
+            if i > 0 and memoryview(frame).nbytes >= threshold:
+                packed.append(write_segment(frame, directory))
+            else:
+                packed.append(bytes(frame))
+    except BaseException:
+        release(packed)
+        raise
+    return packed
+
+def unpack(packed):
+    """Unpickles an object packed by pack, taking ownership of its shared memory."""
+    frames = [frame.map() if isinstance(frame, segment) else frame for frame in packed]
+    return wire.load_frames(frames)
+
+def release(packed):
+    """Removes any shared memory files of a packed object that were never unpacked."""
+    for frame in packed:
+        if isinstance(frame, segment):
+            frame.unlink()
+
+def has_segments(packed):
+    return any(isinstance(frame, segment) for frame in packed)
+
+def release_later(packed, delay):
+    """Removes the shared memory files of a packed object after delay seconds, unless
+    the receiver has already taken them."""
+    if has_segments(packed):
+        timer = threading.Timer(delay, release, (packed,))
+        timer.daemon = True
+        timer.start()
+
+def dumps(packed):
+    """Encodes a packed object as a request or response body. Only the names and
+    sizes of the shared memory files are sent, along with the small frames."""
+    return pickle.dumps([(frame.path, frame.size) if isinstance(frame, segment) else frame for frame in packed], protocol=5)
+
+def loads(body, directory=None):
+    """Unpacks a body made by dumps, taking ownership of its shared memory files.
+    Only files that pack could have made, in directory, are accepted."""
+    directory = os.path.realpath(directory or SHM_DIRECTORY or tempfile.gettempdir())
+    packed = []
+    for frame in pickle.loads(body):
+        if isinstance(frame, tuple):
+            path, size = frame
+            if os.path.dirname(os.path.realpath(path)) != directory or not os.path.basename(path).startswith(PREFIX):
+                release(packed)
+                raise ValueError(f'Shared memory file {path} is not in {directory}')
+            frame = segment(path, size)
+        packed.append(frame)
+    try:
+        return unpack(packed)
+    except BaseException:
+        release(packed)
+        raise
+
+def host_id(directory=None):
+    """Identifies the machine and the shared memory directory, so that a client can
+    tell whether it sees the same files as a server. None if there is no directory."""
+    directory = directory or SHM_DIRECTORY or tempfile.gettempdir()
+    try:
+        info = os.stat(directory)
+    except OSError:
+        return None
+    try:
+        with open('/proc/sys/kernel/random/boot_id') as f:
+            boot = f.read().strip()
+    except OSError:
+        boot = ''
+    return hashlib.sha256(f'{socket.gethostname()}|{boot}|{info.st_dev}|{info.st_ino}'.encode('utf-8')).hexdigest()[:32]
+
+def is_local(url):
+    """True if a server URL names this machine."""
+    host = urlparse(url).hostname
+    if not host:
+        return False
+    if host == 'localhost' or host in (socket.gethostname(), socket.getfqdn()):
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+def run(func, packed, threshold=THRESHOLD, directory=None):
+    """Runs in the worker process: unpacks the arguments, calls func and packs
+    the result. Iterators are turned into lists since they cannot be sent back."""
+    args, kwargs = unpack(packed)
+    result = func(*args, **kwargs)
+    if isinstance(result, Iterator):
+        result = list(result)
+    return pack(result, threshold, directory)
+
+def call(executor, func, args, kwargs, threshold=THRESHOLD, directory=None):
+    """Calls func(*args, **kwargs) on a process pool and waits for the result,
+    moving large buffers both ways through shared memory."""
+    packed = pack((args, kwargs), threshold, directory)
+    try:
+        result = executor.submit(run, func, packed, threshold, directory).result()
+    finally:
+        #If the worker died before unpacking the arguments their files are still there
+        release(packed)
+    return unpack(result)
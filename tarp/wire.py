@@ -0,0 +1,172 @@
+#   Copyright 2025 Chris Brady, Heather Ratcliffe
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+# Binary wire format shared by the TARP client and server for RPC calls.
+# A framed body is laid out as
+#   b'TARP' | frame count (u32) | length of each frame (u64 each) | frames
+# all little endian. The first frame is always a pickle. This replaces the
+# JSON envelope with base64 encoded pickles that older clients still use.
+# Pickles use protocol 5 so that large contiguous buffers (NumPy arrays,
+# bytearrays, ...) are not copied into the pickle. Each one becomes a frame
+# of its own that is written straight from the object's memory, and on the
+# receiving side is read into a preallocated bytearray that the unpickled
+# object then wraps without copying.
+import pickle
+import struct
+
+PICKLE_MIMETYPE = 'application/x-tarp-pickle'
+# A streamed RPC result is a sequence of framed bodies, each holding a pickled
+# (kind, value) record where kind is 'item', 'error' or 'end'
+STREAM_MIMETYPE = 'application/x-tarp-pickle-stream'
+# Streamed results from GET and POST endpoints are newline delimited JSON
+NDJSON_MIMETYPE = 'application/x-ndjson'
+# Name advertised in the server's endpoint list when it understands framed bodies
+PICKLE_CAPABILITY = 'pickle-frames'
+
+MAGIC = b'TARP'
+_count = struct.Struct('<4sI')
+_length = struct.Struct('<Q')
+# Frame lengths are read this many at a time, so that a frame count the body
+# cannot back up never allocates more than has actually been sent
+LENGTH_BLOCK = 65536
+
+class framedBody:
+    """A framed message ready to be sent. Iterating gives the header followed by
+    each frame so that nothing has to be joined into one big buffer, and len()
+    gives the total size for the Content-Length header."""
+    def __init__(self, frames):
+        self.frames = [memoryview(frame).cast('B') for frame in frames]
+        self.header = _count.pack(MAGIC, len(self.frames)) + b''.join(_length.pack(frame.nbytes) for frame in self.frames)
+
+    def __len__(self):
+        return len(self.header) + sum(frame.nbytes for frame in self.frames)
+
+    def __iter__(self):
+        yield self.header
+        yield from self.frames
+
+    def __bytes__(self):
+        return b''.join(self)
+
+def dump_frames(obj):
+    """Pickles an object into a list of frames, with contiguous buffers kept out of band."""
+    buffers = []
+    def buffer_callback(buffer):
+        try:
+            buffers.append(buffer.raw())
+        except BufferError:
+            #Non-contiguous buffers cannot be sent as they are, so pickle them in band
+            return True
+        return False
+    data = pickle.dumps(obj, protocol=5, buffer_callback=buffer_callback)
+    return [data] + buffers
+
+def dumps(obj):
+    """Pickles an object into a framedBody."""
+    return framedBody(dump_frames(obj))
+
+def read_exactly(readinto, view):
+    """Fills a memoryview using a readinto callable, raising if the stream ends early."""
+    while view.nbytes:
+        n = readinto(view)
+        if not n:
+            raise EOFError("Framed body ended early")
+        view = view[n:]
+
+def check_count(count, content_length):
+    """Raises ValueError if the lengths of count frames cannot fit in content_length
+    bytes, before anything is allocated for them."""
+    if content_length is not None and _count.size + _length.size * count > content_length:
+        raise ValueError("Framed body does not match its Content-Length")
+
+def check_lengths(lengths, content_length):
+    if content_length is not None and _count.size + _length.size * len(lengths) + sum(lengths) != content_length:
+        raise ValueError("Framed body does not match its Content-Length")
+
+def read_frames(readinto, content_length=None, allocate=bytearray):
+    """Reads the frames of a framed body from a stream given its readinto method.
+    If content_length is given the frame lengths are checked against it.
+    allocate is called with the length of each frame to create the buffer it is read into."""
+    header = bytearray(_count.size)
+    read_exactly(readinto, memoryview(header))
+    magic, count = _count.unpack(header)
+    if magic != MAGIC:
+        raise ValueError("Not a TARP framed body")
+    check_count(count, content_length)
+    lengths = []
+    while len(lengths) < count:
+        block = bytearray(_length.size * min(count - len(lengths), LENGTH_BLOCK))
+        read_exactly(readinto, memoryview(block))
+        lengths.extend(length for (length,) in _length.iter_unpack(block))
+    check_lengths(lengths, content_length)
+    frames = []
+    for length in lengths:
+        frame = allocate(length)
+        with memoryview(frame) as view:
+            read_exactly(readinto, view)
+        frames.append(frame)
+    return frames
+
+async def read_exactly_async(readinto, view):
+    """Fills a memoryview using an awaitable readinto callable, raising if the stream ends early."""
+    while view.nbytes:
+        n = await readinto(view)
+        if not n:
+            raise EOFError("Framed body ended early")
+        view = view[n:]
+
+async def read_frames_async(readinto, content_length=None, allocate=bytearray):
+    """The same as read_frames, but for an awaitable readinto callable."""
+    header = bytearray(_count.size)
+    await read_exactly_async(readinto, memoryview(header))
+    magic, count = _count.unpack(header)
+    if magic != MAGIC:
+        raise ValueError("Not a TARP framed body")
+    check_count(count, content_length)
+    lengths = []
+    while len(lengths) < count:
+        block = bytearray(_length.size * min(count - len(lengths), LENGTH_BLOCK))
+        await read_exactly_async(readinto, memoryview(block))
+        lengths.extend(length for (length,) in _length.iter_unpack(block))
+    check_lengths(lengths, content_length)
+    frames = []
+    for length in lengths:
+        frame = allocate(length)
+        with memoryview(frame) as view:
+            await read_exactly_async(readinto, view)
+        frames.append(frame)
+    return frames
+
+def load_frames(frames):
+    """Unpickles an object from a list of frames. Out of band buffers are used in
+    place, so objects such as NumPy arrays share memory with the frames."""
+    return pickle.loads(frames[0], buffers=frames[1:])
+
+def loads(data):
+    """Unpickles an object from a complete framed body held in memory. The frames
+    are views into data rather than copies of it."""
+    view = memoryview(data).cast('B')
+    magic, count = _count.unpack_from(view)
+    if magic != MAGIC:
+        raise ValueError("Not a TARP framed body")
+    position = _count.size + _length.size * count
+    if position > view.nbytes:
+        raise ValueError("Framed body does not match its length")
+    frames = []
+    for (length,) in _length.iter_unpack(view[_count.size:position]):
+        frames.append(view[position:position + length])
+        position += length
+    if position != view.nbytes:
+        raise ValueError("Framed body does not match its length")
+    return load_frames(frames)
@@ -0,0 +1,54 @@
+#   Copyright 2025 Chris Brady, Heather Ratcliffe
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+# Shared helpers for the tests, which run real TARP servers on local ports.
+# Endpoints are registered on the base server class and so are shared by every
+# server, so each test module prefixes the names of its endpoints.
+import socket
+import threading
+import time
+
+import pytest
+import requests
+
+import tarp.server
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def wait_for_server(url, **kwargs):
+    for _ in range(100):
+        try:
+            requests.get(url, timeout=1, **kwargs)
+            return
+        except requests.ConnectionError:
+            time.sleep(0.05)
+    raise RuntimeError(f'Server at {url} did not start')
+
+def run_server(sv, **kwargs):
+    """Runs a server class with runServer on a free local port in a daemon thread
+    and returns its URL once it answers."""
+    port = free_port()
+    kwargs = {'port': port, 'bindTo': '127.0.0.1', **kwargs}
+    threading.Thread(target=tarp.server.runServer, args=(sv,), kwargs=kwargs, daemon=True).start()
+    url = f'http://127.0.0.1:{port}'
+    wait_for_server(url)
+    return url
+
+@pytest.fixture(scope='session')
+def start_server():
+    """Returns run_server, which starts a server class and returns its URL."""
+    return run_server
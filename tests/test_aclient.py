@@ -0,0 +1,69 @@
+#   Copyright 2025 Chris Brady, Heather Ratcliffe
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+# Tests of the asyncio TARP client
+import asyncio
+
+import pytest
+
+pytest.importorskip('aiohttp')
+
+import tarp.aclient
+import tarp.server
+
+def add(a, b):
+    return a + b
+
+def slow_add(a, b):
+    return a + b
+
+@pytest.fixture(scope='module')
+def url(start_server):
+    sv = tarp.server.makeServer('aclientTestServer', multiThreaded=True)
+    sv.addRPCEndpoint('acl_add', add)
+    sv.addAsyncRPCEndpoint('acl_slow_add', slow_add, suggested_wait=0.1)
+    return start_server(sv)
+
+def test_async_with(url):
+    async def main():
+        async with tarp.aclient.client(url) as client:
+            results = await asyncio.gather(*[client.acl_add(i, 1) for i in range(10)])
+            handle = await client.acl_slow_add(2, 3)
+            return results, await handle
+    assert asyncio.run(main()) == (list(range(1, 11)), 5)
+
+def test_connects_on_first_call(url):
+    """A client that was never connected fetches its endpoints when first called."""
+    async def main():
+        client = tarp.aclient.client(url)
+        try:
+            results = await asyncio.gather(client.acl_add(1, 2), client.acl_add(3, 4))
+            with pytest.raises(AttributeError):
+                client.acl_missing
+            return results
+        finally:
+            await client.close()
+    assert asyncio.run(main()) == [3, 7]
+
+def test_unknown_method_before_connect(url):
+    async def main():
+        client = tarp.aclient.client(url)
+        try:
+            with pytest.raises(AttributeError):
+                await client.acl_missing()
+            with pytest.raises(AttributeError):
+                client._private
+        finally:
+            await client.close()
+    asyncio.run(main())
@@ -0,0 +1,88 @@
+#   Copyright 2025 Chris Brady, Heather Ratcliffe
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+# Tests of sending array results in the binary array formats
+import io
+
+import pytest
+import requests
+
+numpy = pytest.importorskip('numpy')
+
+import tarp.client
+import tarp.server
+from tarp import arrays
+
+def single(query, body):
+    return numpy.arange(int(query.get('n', 10)), dtype=numpy.float64)
+
+def columns(query, body):
+    return {'x': numpy.arange(5), 'y': numpy.linspace(0, 1, 5)}
+
+def formatted(query, body):
+    #An endpoint with a parameter of its own called format
+    return {'parameters': sorted(query), 'format': query.get('format')}
+
+@pytest.fixture(scope='module')
+def url(start_server):
+    sv = tarp.server.makeServer('arraysTestServer', multiThreaded=True)
+    sv.addGetEndpoint('arr_single', single)
+    sv.addGetEndpoint('arr_columns', columns)
+    sv.addGetEndpoint('arr_formatted', formatted)
+    sv.addGetEndpoint('arr_cached', single, cache=True)
+    return start_server(sv)
+
+def test_npy(url):
+    response = requests.get(f'{url}/arr_single?_format=npy')
+    assert response.headers['Content-Type'] == arrays.NPY_MIMETYPE
+    assert 'arr_single.npy' in response.headers['Content-Disposition']
+    numpy.testing.assert_array_equal(numpy.load(io.BytesIO(response.content)), numpy.arange(10.0))
+
+def test_npz(url):
+    response = requests.get(f'{url}/arr_columns?_format=npz')
+    data = numpy.load(io.BytesIO(response.content))
+    numpy.testing.assert_array_equal(data['y'], numpy.linspace(0, 1, 5))
+
+def test_arrow(url):
+    pytest.importorskip('pyarrow')
+    response = requests.get(f'{url}/arr_columns?_format=arrow')
+    assert response.headers['Content-Type'] == arrays.ARROW_MIMETYPE
+    numpy.testing.assert_array_equal(arrays.decode(arrays.ARROW_MIMETYPE, response.content)['x'], numpy.arange(5))
+
+def test_accept_header(url):
+    headers = {'Accept': f'{arrays.NPY_MIMETYPE}, application/json;q=0.5'}
+    assert requests.get(f'{url}/arr_single', headers=headers).headers['Content-Type'] == arrays.NPY_MIMETYPE
+    #A dict cannot be sent as .npy, so it falls back to JSON
+    assert requests.get(f'{url}/arr_columns', headers=headers).headers['Content-Type'] == 'application/json'
+
+def test_unsuitable_format(url):
+    assert requests.get(f'{url}/arr_columns?_format=npy').status_code == 406
+
+def test_endpoint_format_parameter(url):
+    """format is passed to the endpoint, _format is not."""
+    response = requests.get(f'{url}/arr_formatted?format=csv&_format=json')
+    assert response.json()['result'] == {'parameters': ['format'], 'format': 'csv'}
+
+def test_cached_formats(url):
+    """Cached responses are kept separately for each format."""
+    assert requests.get(f'{url}/arr_cached?_format=npy').headers['Content-Type'] == arrays.NPY_MIMETYPE
+    assert requests.get(f'{url}/arr_cached').headers['Content-Type'] == 'application/json'
+    assert requests.get(f'{url}/arr_cached?_format=npz').headers['Content-Type'] == arrays.NPZ_MIMETYPE
+
+def test_client(url):
+    mimetype, value = tarp.client.client(url, array_format='npy').arr_single(n=4)
+    assert mimetype == arrays.NPY_MIMETYPE
+    numpy.testing.assert_array_equal(value, numpy.arange(4.0))
+    mimetype, value = tarp.client.client(url).arr_columns(_format='npz')
+    numpy.testing.assert_array_equal(value['x'], numpy.arange(5))
@@ -0,0 +1,89 @@
+#   Copyright 2025 Chris Brady, Heather Ratcliffe
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+# Tests of the asyncio server engine, run against a real server on a local port
+import concurrent.futures
+import http.client
+import json
+import socket
+import threading
+import time
+
+import pytest
+import requests
+
+import tarp.client
+import tarp.server
+
+MAX_WORKERS = 2
+
+release = threading.Event()
+
+def ping():
+    return 'pong'
+
+def held():
+    release.wait(30)
+    return 'done'
+
+def size(query, body):
+    return {'size': len(body)}
+
+@pytest.fixture(scope='module')
+def url(start_server):
+    sv = tarp.server.makeServer('asyncioTestServer', multiThreaded=True)
+    sv.addRPCEndpoint('aio_ping', ping)
+    sv.addAsyncRPCEndpoint('aio_held', held, suggested_wait=1)
+    sv.addPostEndpoint('aio_size', size)
+    yield start_server(sv, engine='asyncio', max_workers=MAX_WORKERS)
+    release.set()
+
+def test_long_polls_do_not_hold_pool_threads(url):
+    """More long polls than there are pool threads must not block other requests."""
+    release.clear()
+    client = tarp.client.client(url)
+    IDs = [client.aio_held().ID for _ in range(MAX_WORKERS + 2)]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(IDs)) as pool:
+        polls = [pool.submit(requests.get, f'{url}/asyncGet?UUID={ID}&timeout=20', timeout=30) for ID in IDs]
+        time.sleep(0.5)
+        try:
+            assert tarp.client.client(url, timeout=5).aio_ping() == 'pong'
+            assert not any(poll.done() for poll in polls)
+        finally:
+            release.set()
+        for poll in polls:
+            assert poll.result().status_code == 200
+
+def test_long_poll_times_out(url):
+    release.clear()
+    ID = tarp.client.client(url).aio_held().ID
+    try:
+        response = requests.get(f'{url}/asyncProbe?UUID={ID}&timeout=0.2', timeout=10)
+        assert response.json()['result']['status'] == 'in_progress'
+    finally:
+        release.set()
+
+def test_expect_100_continue(url):
+    """A client that waits for 100 Continue before sending the body must get it."""
+    body = b'x' * (2 * 1024 * 1024)
+    host, port = url.split('//')[1].split(':')
+    with socket.create_connection((host, int(port)), timeout=5) as sock:
+        sock.sendall((f'POST /aio_size HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/octet-stream\r\n'
+                      f'Content-Length: {len(body)}\r\nExpect: 100-continue\r\n\r\n').encode('ascii'))
+        assert sock.recv(1024).startswith(b'HTTP/1.1 100 ')
+        sock.sendall(body)
+        response = http.client.HTTPResponse(sock)
+        response.begin()
+        assert response.status == 200
+        assert json.loads(response.read())['result'] == {'size': len(body)}
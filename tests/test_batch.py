@@ -0,0 +1,76 @@
+#   Copyright 2025 Chris Brady, Heather Ratcliffe
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+# Tests of batched RPC calls through /batch
+import threading
+import time
+
+import pytest
+
+import tarp.client
+import tarp.server
+
+def add(a, b=0):
+    return a + b
+
+def fail(message):
+    raise ValueError(message)
+
+def sleep(seconds):
+    time.sleep(seconds)
+    return threading.get_ident()
+
+@pytest.fixture(scope='module')
+def url(start_server):
+    sv = tarp.server.makeServer('batchTestServer', multiThreaded=True)
+    sv.addRPCEndpoint('bat_add', add)
+    sv.addRPCEndpoint('bat_fail', fail)
+    sv.addRPCEndpoint('bat_sleep', sleep)
+    return start_server(sv)
+
+@pytest.fixture(params=[True, False], ids=['batch', 'separate'])
+def client(url, request):
+    #Without the binary format the client makes the calls one at a time
+    return tarp.client.client(url, binary=request.param)
+
+def test_results_in_order(client):
+    results = client.call_many([('bat_add', (1, 2)), ('bat_add', (3,), {'b': 4}), ('bat_add', (5,))])
+    assert results == [3, 7, 5]
+
+def test_partial_failure(client):
+    with pytest.raises(Exception, match='second'):
+        client.call_many([('bat_add', (1, 2)), ('bat_fail', ('second',)), ('bat_add', (3, 4))])
+    results = client.call_many([('bat_add', (1, 2)), ('bat_fail', ('second',)), ('bat_add', (3, 4))], return_exceptions=True)
+    assert results[0] == 3 and results[2] == 7
+    assert isinstance(results[1], Exception) and 'second' in str(results[1])
+
+def test_unknown_endpoint(url):
+    results = tarp.client.client(url).call_many([('bat_add', (1, 1)), ('bat_missing',)], return_exceptions=True)
+    assert results[0] == 2
+    assert isinstance(results[1], Exception)
+
+def test_concurrent(url):
+    client = tarp.client.client(url)
+    start = time.monotonic()
+    threads = client.call_many([('bat_sleep', (0.3,))] * 4, concurrent=True)
+    assert time.monotonic() - start < 1.0
+    assert len(set(threads)) > 1
+
+def test_batch_context(client):
+    with client.batch() as b:
+        first = b.bat_add(1, 2)
+        second = b.bat_fail('oops')
+    assert first.result() == 3
+    with pytest.raises(Exception, match='oops'):
+        second.result()
@@ -0,0 +1,73 @@
+#   Copyright 2025 Chris Brady, Heather Ratcliffe
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+# Smoke tests of the benchmark suite, run with very few small calls
+import contextlib
+import io
+import json
+
+import pytest
+
+from tarp import bench
+
+SMALL = ['--payloads', 'bytes,dict', '--sizes', '1K', '--concurrency', '1,2', '--requests', '4', '--warmup', '1', '--duration', '5']
+
+def run(argv):
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        bench.main(argv)
+    return output.getvalue()
+
+def test_parse_size():
+    assert bench.parse_size('512') == 512
+    assert bench.parse_size('1k') == 1024
+    assert bench.parse_size('1.5M') == 3 * 512 * 1024
+
+def test_percentile():
+    ordered = list(range(1, 101))
+    assert bench.percentile(ordered, 50) == 50
+    assert bench.percentile(ordered, 99) == 99
+    assert bench.percentile(ordered, 100) == 100
+    assert bench.percentile([7], 95) == 7
+
+@pytest.mark.parametrize('engine', ['threaded', 'asyncio'])
+def test_in_process(tmp_path, engine):
+    output = tmp_path / 'results.json'
+    report = json.loads(run(SMALL + ['--in-process', '--engine', engine, '--transports', 'tcp,unix', '--json', '--output', str(output)]))
+    assert json.loads(output.read_text()) == report
+    assert report['meta']['engine'] == engine
+    #4 kinds, 2 payloads, 1 size, 2 concurrencies and 2 transports
+    assert len(report['results']) == 32
+    for result in report['results']:
+        assert result['errors'] == 0, result.get('first_error')
+        assert result['requests'] == 4
+        assert result['latency_s']['p50'] <= result['latency_s']['max']
+        #The server's own usage is only reported when it runs in a subprocess
+        assert result['server_cpu_s'] is None
+    assert {result['transport'] for result in report['results']} == {'tcp', 'unix'}
+
+def test_subprocess_and_compare(tmp_path):
+    baseline = tmp_path / 'baseline.json'
+    argv = SMALL + ['--kinds', 'rpc', '--payloads', 'dict', '--concurrency', '1']
+    run(argv + ['--json', '--output', str(baseline)])
+    [result] = json.loads(baseline.read_text())['results']
+    assert result['errors'] == 0, result.get('first_error')
+    assert result['server_cpu_s'] is not None
+    table = run(argv + ['--compare', str(baseline)]).splitlines()
+    assert table[0] == bench.HEADER
+    assert 'throughput x' in table[1]
+
+def test_unknown_kind():
+    with pytest.raises(SystemExit):
+        run(['--kinds', 'nonsense'])
@@ -0,0 +1,123 @@
+#   Copyright 2025 Chris Brady, Heather Ratcliffe
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+# Tests of the cache of endpoint results
+import time
+
+import pytest
+
+import tarp.client
+import tarp.server
+from tarp.server import resultCache
+
+calls = {'count': 0}
+
+def counted(x):
+    calls['count'] += 1
+    return [x, calls['count']]
+
+def web_counted(query, body):
+    calls['count'] += 1
+    return {'x': query.get('x'), 'count': calls['count']}
+
+def reset(query, body):
+    return {'reset': True}
+
+def failing(x):
+    calls['count'] += 1
+    raise ValueError('not cached')
+
+@pytest.fixture(scope='module')
+def server_class():
+    sv = tarp.server.makeServer('cacheTestServer', multiThreaded=True)
+    sv.addRPCEndpoint('cache_counted', counted, cache=True)
+    sv.addRPCEndpoint('cache_expiring', counted, cache=True, ttl=0.2)
+    sv.addRPCEndpoint('cache_failing', failing, cache=True)
+    sv.addGetEndpoint('cache_web', web_counted, cache=True)
+    sv.addPostEndpoint('cache_reset', reset, invalidates=['cache_web', 'cache_counted'])
+    return sv
+
+@pytest.fixture(scope='module')
+def url(start_server, server_class):
+    return start_server(server_class)
+
+def test_lru():
+    cache = resultCache(max_entries=2)
+    for key in 'abc':
+        if key == 'c':
+            cache.get('a')
+        cache.put(key, 'text/plain', key.encode(), cache.generation)
+    assert cache.get('a') == ('text/plain', b'a')
+    assert cache.get('b') is None
+    assert cache.stats()['evictions'] == 1
+
+def test_max_bytes():
+    cache = resultCache(max_bytes=10)
+    cache.put('big', 'text/plain', b'x' * 11, cache.generation)
+    assert cache.get('big') is None
+    cache.put('a', 'text/plain', b'x' * 6, cache.generation)
+    cache.put('b', 'text/plain', b'x' * 6, cache.generation)
+    assert cache.get('a') is None and cache.get('b') is not None
+
+def test_ttl():
+    cache = resultCache(ttl=0.05)
+    cache.put('a', 'text/plain', b'a', cache.generation)
+    assert cache.get('a') is not None
+    time.sleep(0.1)
+    assert cache.get('a') is None
+
+def test_stale_put():
+    """A response computed before the cache was cleared is not stored."""
+    cache = resultCache()
+    generation = cache.generation
+    cache.clear()
+    cache.put('a', 'text/plain', b'a', generation)
+    assert cache.get('a') is None
+
+@pytest.mark.parametrize('binary', [True, False])
+def test_rpc_hits(url, binary):
+    client = tarp.client.client(url, binary=binary)
+    first = client.cache_counted(f'rpc-{binary}')
+    assert client.cache_counted(f'rpc-{binary}') == first
+    assert client.cache_counted(f'other-{binary}') != first
+
+def test_rpc_ttl(url):
+    client = tarp.client.client(url)
+    first = client.cache_expiring('ttl')
+    assert client.cache_expiring('ttl') == first
+    time.sleep(0.3)
+    assert client.cache_expiring('ttl') != first
+
+def test_errors_not_cached(url):
+    client = tarp.client.client(url)
+    before = calls['count']
+    for _ in range(2):
+        with pytest.raises(Exception):
+            client.cache_failing(1)
+    assert calls['count'] == before + 2
+
+def test_invalidates(url):
+    client = tarp.client.client(url)
+    first = client.cache_web(x='1')[1]
+    assert client.cache_web(x='1')[1] == first
+    rpc = client.cache_counted('invalidated')
+    client.cache_reset({})
+    assert client.cache_web(x='1')[1] != first
+    assert client.cache_counted('invalidated') != rpc
+
+def test_invalidate_cache(url, server_class):
+    client = tarp.client.client(url)
+    first = client.cache_counted('cleared')
+    server_class.invalidateCache('cache_counted')
+    assert client.cache_counted('cleared') != first
@@ -0,0 +1,91 @@
+#   Copyright 2025 Chris Brady, Heather Ratcliffe
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+# Tests of how the client fetches and caches the list of endpoints
+import os
+
+import pytest
+import requests
+
+import tarp.client
+import tarp.server
+from conftest import free_port
+
+def add(a, b):
+    return a + b
+
+@pytest.fixture(scope='module')
+def url(start_server):
+    sv = tarp.server.makeServer('clientTestServer', multiThreaded=True)
+    sv.addRPCEndpoint('cli_add', add)
+    return start_server(sv)
+
+@pytest.fixture
+def dead_url():
+    return f'http://127.0.0.1:{free_port()}'
+
+def test_fetches_endpoints_when_created(url, dead_url):
+    assert tarp.client.client(url).remoteEndpoints is not None
+    with pytest.raises(requests.ConnectionError):
+        tarp.client.client(dead_url)
+
+def test_lazy(url):
+    client = tarp.client.client(url, lazy=True)
+    assert client.remoteEndpoints is None
+    assert client.cli_add(1, 2) == 3
+
+def test_lazy_unreachable(dead_url):
+    """Looking up a method on a lazy client that cannot reach its server raises
+    AttributeError, with the connection error as its cause."""
+    client = tarp.client.client(dead_url, lazy=True)
+    with pytest.raises(AttributeError) as error:
+        client.cli_add
+    assert isinstance(error.value.__cause__, requests.ConnectionError)
+    assert not hasattr(client, 'cli_add')
+
+def test_private_names_do_not_fetch(dead_url):
+    client = tarp.client.client(dead_url, lazy=True)
+    with pytest.raises(AttributeError) as error:
+        client._private
+    assert error.value.__cause__ is None
+    assert getattr(client, '__array__', None) is None
+
+def test_unknown_method(url):
+    with pytest.raises(AttributeError):
+        tarp.client.client(url).cli_missing
+
+def test_no_manifest_cache_by_default(url, tmp_path, monkeypatch):
+    monkeypatch.setattr(tarp.client, 'MANIFEST_DIRECTORY', str(tmp_path))
+    tarp.client.client(url)
+    assert not os.listdir(tmp_path)
+
+def test_manifest_etag(url, tmp_path):
+    """A client with a cached copy of the list revalidates it and gets a 304."""
+    first = requests.get(f'{url}/')
+    etag = first.headers['ETag']
+    again = requests.get(f'{url}/', headers={'If-None-Match': etag})
+    assert again.status_code == 304
+    assert again.content == b''
+    tarp.client.client(url, manifest_cache=str(tmp_path))
+    assert len(os.listdir(tmp_path)) == 1
+    client = tarp.client.client(url, manifest_cache=str(tmp_path))
+    assert client.cli_add(2, 3) == 5
+
+def test_manifest_changes_with_endpoints(url):
+    etag = requests.get(f'{url}/').headers['ETag']
+    tarp.server.server.addRPCEndpoint('cli_added', add)
+    response = requests.get(f'{url}/', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+    assert tarp.client.client(url).cli_added(1, 1) == 2
@@ -0,0 +1,101 @@
+#   Copyright 2025 Chris Brady, Heather Ratcliffe
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+# Tests of coalescing identical calls that arrive together
+import concurrent.futures
+import threading
+import time
+
+import pytest
+
+import tarp.client
+import tarp.server
+from tarp.server import singleFlight
+
+CALLERS = 5
+
+calls = {'count': 0}
+lock = threading.Lock()
+
+def slow(x):
+    with lock:
+        calls['count'] += 1
+    time.sleep(0.5)
+    return x * 2
+
+def web_slow(query, body):
+    return {'x': slow(int(query['x']))}
+
+@pytest.fixture(scope='module')
+def url(start_server):
+    sv = tarp.server.makeServer('coalesceTestServer', multiThreaded=True)
+    sv.addRPCEndpoint('coal_slow', slow, coalesce=True)
+    sv.addGetEndpoint('coal_web', web_slow, coalesce=True)
+    sv.addAsyncRPCEndpoint('coal_async', slow, coalesce=True, suggested_wait=0.1)
+    return start_server(sv)
+
+def run_together(call, args_list):
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(args_list)) as pool:
+        return list(pool.map(lambda args: call(*args), args_list))
+
+def test_single_flight():
+    flight = singleFlight()
+    ran = []
+    def work(x):
+        ran.append(x)
+        time.sleep(0.2)
+        return x
+    assert run_together(lambda: flight.run('key', work, 1), [()] * CALLERS) == [1] * CALLERS
+    assert ran == [1]
+    assert flight.coalesced == CALLERS - 1
+    assert flight.calls == {}
+
+def test_single_flight_exception():
+    flight = singleFlight()
+    def fail():
+        time.sleep(0.2)
+        raise ValueError('shared')
+    def call():
+        try:
+            flight.run('key', fail)
+        except ValueError as e:
+            return str(e)
+    assert run_together(call, [()] * 3) == ['shared'] * 3
+
+def test_rpc(url):
+    before = calls['count']
+    results = run_together(lambda x: tarp.client.client(url).coal_slow(x), [(21,)] * CALLERS)
+    assert results == [42] * CALLERS
+    assert calls['count'] == before + 1
+
+def test_different_arguments(url):
+    before = calls['count']
+    assert run_together(lambda x: tarp.client.client(url).coal_slow(x), [(1,), (2,)]) == [2, 4]
+    assert calls['count'] == before + 2
+
+def test_get(url):
+    before = calls['count']
+    results = run_together(lambda x: tarp.client.client(url).coal_web(x=x)[1], [(3,)] * CALLERS)
+    assert results == [{'x': 6}] * CALLERS
+    assert calls['count'] == before + 1
+
+def test_async(url):
+    """Identical AsyncRPC calls made while the first is running share its job."""
+    client = tarp.client.client(url)
+    before = calls['count']
+    handles = [client.coal_async(5) for _ in range(CALLERS)]
+    assert len({handle.ID for handle in handles}) == 1
+    #Each caller collects the shared result once
+    assert [handle.wait() for handle in handles] == [10] * CALLERS
+    assert calls['count'] == before + 1
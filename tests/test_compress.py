@@ -0,0 +1,93 @@
+#   Copyright 2025 Chris Brady, Heather Ratcliffe
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+# Tests of response compression and compressed request bodies
+import io
+
+import pytest
+import requests
+
+import tarp.client
+import tarp.server
+from tarp import compress
+
+LIMIT = 1024 * 1024
+
+def text(query, body):
+    return {'text': 'x' * int(query.get('size', 0))}
+
+def size(query, body):
+    return {'size': len(body)}
+
+def echo(value):
+    return value
+
+@pytest.fixture(scope='module')
+def url(start_server):
+    sv = tarp.server.makeServer('compressTestServer', multiThreaded=True)
+    sv.addGetEndpoint('cmp_text', text)
+    sv.addGetEndpoint('cmp_plain', text, compress_level=0)
+    sv.addPostEndpoint('cmp_size', size, max_body_size=LIMIT)
+    sv.addRPCEndpoint('cmp_echo', echo)
+    return start_server(sv)
+
+def test_choose():
+    assert compress.choose('gzip, deflate', ['gzip', 'deflate']) == 'gzip'
+    assert compress.choose('gzip;q=0, deflate', ['gzip', 'deflate']) == 'deflate'
+    assert compress.choose('*', ['deflate']) == 'deflate'
+    assert compress.choose('identity', ['gzip']) is None
+    assert compress.choose(None) is None
+
+@pytest.mark.parametrize('encoding', compress.ENCODINGS)
+def test_round_trip(encoding):
+    data = bytes(range(256)) * 1000
+    decoder = compress.decompressor(encoding, io.BytesIO(compress.compress(data, encoding)))
+    assert b''.join(iter(lambda: decoder.read(1000), b'')) == data
+
+@pytest.mark.parametrize('encoding', compress.ENCODINGS)
+def test_reads_are_bounded(encoding):
+    """However well the data compresses, no read returns more than was asked for."""
+    decoder = compress.decompressor(encoding, io.BytesIO(compress.compress(bytes(64 * 1024 * 1024), encoding)))
+    assert max(len(decoder.read(4096)) for _ in range(100)) == 4096
+
+@pytest.mark.parametrize('encoding', ['gzip', 'deflate'])
+def test_negotiation(url, encoding):
+    response = requests.get(f'{url}/cmp_text?size=10000', headers={'Accept-Encoding': encoding})
+    assert response.headers['Content-Encoding'] == encoding
+    assert response.json()['result'] == {'text': 'x' * 10000}
+
+def test_not_compressed(url):
+    #Too small, not accepted by the client and turned off for the endpoint
+    assert 'Content-Encoding' not in requests.get(f'{url}/cmp_text?size=10', headers={'Accept-Encoding': 'gzip'}).headers
+    assert 'Content-Encoding' not in requests.get(f'{url}/cmp_text?size=10000', headers={'Accept-Encoding': 'identity'}).headers
+    assert 'Content-Encoding' not in requests.get(f'{url}/cmp_plain?size=10000', headers={'Accept-Encoding': 'gzip'}).headers
+
+def test_compressed_request(url):
+    client = tarp.client.client(url, compress_requests=True)
+    value = {'data': 'y' * 100000}
+    assert client.cmp_echo(value) == value
+    body = compress.compress(b'z' * 1000, 'gzip')
+    response = requests.post(f'{url}/cmp_size', data=body, headers={'Content-Encoding': 'gzip', 'Content-Type': 'application/octet-stream'})
+    assert response.json()['result'] == {'size': 1000}
+
+def test_decompression_bomb(url):
+    """A small body that decodes to far more than max_body_size gets a 413."""
+    body = compress.compress(bytes(256 * 1024 * 1024), 'gzip')
+    assert len(body) < LIMIT
+    response = requests.post(f'{url}/cmp_size', data=body, headers={'Content-Encoding': 'gzip', 'Content-Type': 'application/octet-stream'})
+    assert response.status_code == 413
+
+def test_unsupported_encoding(url):
+    response = requests.post(f'{url}/cmp_size', data=b'abc', headers={'Content-Encoding': 'br', 'Content-Type': 'application/octet-stream'})
+    assert response.status_code == 415
@@ -0,0 +1,123 @@
+#   Copyright 2025 Chris Brady, Heather Ratcliffe
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+# Tests of the registry of AsyncRPC jobs and its limits
+import concurrent.futures
+import time
+
+import pytest
+import requests
+
+import tarp.client
+import tarp.server
+from tarp.server import jobRegistry, OperationInProgress
+
+def finished(value):
+    future = concurrent.futures.Future()
+    future.set_result(value)
+    return future
+
+def make_bytes(n):
+    return bytes(n)
+
+def make_arrays(*sizes):
+    import numpy
+    return [numpy.arange(size, dtype=numpy.uint8) for size in sizes]
+
+@pytest.fixture(scope='module')
+def url(start_server):
+    sv = tarp.server.makeServer('jobsTestServer', multiThreaded=True)
+    sv.configureJobs(spill_threshold=10000)
+    sv.addAsyncRPCEndpoint('job_bytes', make_bytes, suggested_wait=0.05)
+    sv.addAsyncRPCEndpoint('job_arrays', make_arrays, suggested_wait=0.05)
+    return start_server(sv)
+
+def test_ttl():
+    jobs = jobRegistry(ttl=0.05)
+    ID = jobs.add(finished(1), 1)
+    assert jobs.result(jobs.get(ID)) == 1
+    time.sleep(0.1)
+    #Sweeps run at most once a second
+    jobs.last_sweep = 0
+    assert jobs.get(ID) is None
+    assert jobs.stats()['evictions']['expired'] == 1
+
+def test_max_entries_evicts_least_recently_used():
+    jobs = jobRegistry(max_entries=2)
+    first = jobs.add(finished(1), 1)
+    second = jobs.add(finished(2), 1)
+    jobs.get(first)
+    third = jobs.add(finished(3), 1)
+    assert first in jobs and third in jobs
+    assert second not in jobs
+    assert jobs.stats()['evictions']['max_entries'] == 1
+
+def test_running_jobs_are_kept():
+    jobs = jobRegistry(max_entries=1)
+    running = concurrent.futures.Future()
+    ID = jobs.add(running, 1)
+    with pytest.raises(OperationInProgress):
+        jobs.add(finished(1), 1)
+    running.set_result('done')
+    assert jobs.result(jobs.get(ID)) == 'done'
+
+def test_max_bytes():
+    jobs = jobRegistry(max_bytes=2500)
+    IDs = [jobs.add(finished(bytes(1000)), 1) for _ in range(3)]
+    assert IDs[0] not in jobs
+    assert IDs[1] in jobs and IDs[2] in jobs
+    stats = jobs.stats()
+    assert stats['evictions']['max_bytes'] == 1
+    assert stats['memory_bytes'] <= 2500
+
+def test_spill():
+    jobs = jobRegistry(spill_threshold=100, max_spill_bytes=1500)
+    first = jobs.add(finished(bytes(1000)), 1)
+    job = jobs.get(first)
+    assert job['file'] is not None and job['frames'] is None
+    assert jobs.result(job) == bytes(1000)
+    second = jobs.add(finished(bytes(1000)), 1)
+    assert first not in jobs and second in jobs
+    assert jobs.stats()['evictions']['max_spill_bytes'] == 1
+
+def test_pop_forgets_bytes():
+    jobs = jobRegistry(spill_threshold=100)
+    ID = jobs.add(finished(bytes(1000)), 1)
+    job = jobs.pop(ID)
+    job['file'].close()
+    assert jobs.stats()['spilled_bytes'] == 0
+    assert jobs.pop(ID) is None
+
+def test_spilled_result_collected(url):
+    """Results over spill_threshold are sent back from their file."""
+    client = tarp.client.client(url)
+    assert client.job_bytes(50000).wait() == bytes(50000)
+    assert client.job_bytes(10).wait() == bytes(10)
+    stats = requests.get(f'{url}/asyncStats').json()['result']
+    assert stats['entries'] == 0 and stats['spilled_bytes'] == 0
+
+@pytest.mark.parametrize('binary', [True, False])
+def test_spilled_file_is_complete(url, binary):
+    """A spilled result whose last frame is small is sent in full."""
+    numpy = pytest.importorskip('numpy')
+    first, second = tarp.client.client(url, binary=binary).job_arrays(50000, 10).wait()
+    numpy.testing.assert_array_equal(first, numpy.arange(50000, dtype=numpy.uint8))
+    numpy.testing.assert_array_equal(second, numpy.arange(10, dtype=numpy.uint8))
+
+def test_collected_twice(url):
+    client = tarp.client.client(url)
+    handle = client.job_bytes(10)
+    assert handle.wait() == bytes(10)
+    with pytest.raises(Exception):
+        client.wait(handle.ID)
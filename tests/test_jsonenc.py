@@ -0,0 +1,103 @@
+#   Copyright 2025 Chris Brady, Heather Ratcliffe
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+# Tests of the JSON encoding of results, directly and through a server
+import base64
+import json
+
+import pytest
+import requests
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import tarp.server
+from tarp import jsonenc
+
+needs_numpy = pytest.mark.skipif(numpy is None, reason='needs numpy')
+
+CHUNK_SIZE = 4096
+
+def big(query, body):
+    return {'values': list(range(int(query['count'])))}
+
+def unencodable(query, body):
+    return {'value': object()}
+
+@pytest.fixture(scope='module')
+def url(start_server):
+    sv = tarp.server.makeServer('jsonencTestServer', multiThreaded=True)
+    sv.json_chunk_size = CHUNK_SIZE
+    sv.addGetEndpoint('jenc_big', big)
+    sv.addGetEndpoint('jenc_unencodable', unencodable)
+    return start_server(sv)
+
+def decode(chunks):
+    return json.loads(b''.join(chunks))
+
+def test_bytes_as_base64():
+    value = {'a': b'\x00\x01\xff', 'b': bytearray(b'xyz'), 'c': memoryview(b'mv')}
+    assert jsonenc.loads(jsonenc.dumps(value)) == {key: base64.b64encode(bytes(data)).decode('ascii') for key, data in value.items()}
+
+def test_unknown_type():
+    with pytest.raises(TypeError):
+        jsonenc.dumps(object())
+
+def test_large_integers():
+    assert jsonenc.loads(jsonenc.dumps({'big': 2**70})) == {'big': 2**70}
+
+@needs_numpy
+def test_numpy():
+    value = {'array': numpy.arange(6, dtype=numpy.int16).reshape(2, 3), 'float': numpy.float32(1.5), 'bool': numpy.bool_(True)}
+    assert jsonenc.loads(jsonenc.dumps(value)) == {'array': [[0, 1, 2], [3, 4, 5]], 'float': 1.5, 'bool': True}
+
+def test_small_result_is_one_chunk():
+    value = {'a': [1, 2, 3], 'b': 'text'}
+    chunks = list(jsonenc.iter_encode(value))
+    assert len(chunks) == 1
+    assert json.loads(chunks[0]) == value
+
+def test_long_list_in_chunks():
+    value = {'nested': {'values': list(range(3 * jsonenc.BLOCK_ITEMS)), 'rows': [[i, str(i)] for i in range(jsonenc.BLOCK_ITEMS + 1)]}}
+    chunks = list(jsonenc.iter_encode(value, chunk_size=CHUNK_SIZE))
+    assert len(chunks) > 1
+    assert decode(chunks) == value
+
+@needs_numpy
+@pytest.mark.parametrize('shape', [(3 * jsonenc.BLOCK_ITEMS + 5,), (1000, 300), (5, jsonenc.BLOCK_ITEMS + 1)])
+def test_large_array_in_chunks(shape):
+    array = numpy.arange(numpy.prod(shape), dtype=numpy.float64).reshape(shape) / 3
+    chunks = list(jsonenc.iter_encode({'array': array}, chunk_size=CHUNK_SIZE))
+    assert len(chunks) > 1
+    numpy.testing.assert_array_equal(numpy.array(decode(chunks)['array']), array)
+
+def test_small_response_has_length(url):
+    response = requests.get(f'{url}/jenc_big?count=10')
+    assert 'Content-Length' in response.headers
+    assert response.json()['result'] == {'values': list(range(10))}
+
+def test_large_response_is_chunked(url):
+    response = requests.get(f'{url}/jenc_big?count=100000')
+    assert response.status_code == 200
+    assert response.headers.get('Transfer-Encoding') == 'chunked'
+    assert response.json()['result'] == {'values': list(range(100000))}
+
+def test_encode_failure(url):
+    response = requests.get(f'{url}/jenc_unencodable')
+    assert response.status_code == 500
+    assert 'Unable to encode result' in response.json()['message']
+    #The connection and server are still usable
+    assert requests.get(f'{url}/jenc_big?count=1').json()['result'] == {'values': [0]}
@@ -0,0 +1,88 @@
+#   Copyright 2025 Chris Brady, Heather Ratcliffe
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+# Tests of long polls of /asyncGet and /asyncProbe on both server engines
+import threading
+import time
+
+import pytest
+import requests
+
+import tarp.client
+import tarp.server
+
+MAX_POLL_TIMEOUT = 1
+
+release = threading.Event()
+
+def held():
+    release.wait(30)
+    return 'done'
+
+@pytest.fixture(scope='module', params=['threaded', 'asyncio'])
+def url(request, start_server):
+    sv = tarp.server.makeServer('longPollTestServer', multiThreaded=True)
+    sv.max_poll_timeout = MAX_POLL_TIMEOUT
+    #A long suggested wait, so that a client that slept instead would be slow
+    sv.addAsyncRPCEndpoint('lp_held', held, suggested_wait=10)
+    yield start_server(sv, engine=request.param)
+    release.set()
+
+def test_capability(url):
+    assert tarp.client.client(url).useLongPoll
+    assert not tarp.client.client(url, poll_timeout=None).useLongPoll
+
+def test_result_arrives_when_ready(url):
+    release.clear()
+    handle = tarp.client.client(url).lp_held()
+    timer = threading.Timer(0.3, release.set)
+    timer.start()
+    start = time.monotonic()
+    assert handle.wait() == 'done'
+    assert time.monotonic() - start < 5
+    timer.join()
+
+def still_running(path, response):
+    #asyncGet refuses a result that is not ready, asyncProbe reports its status
+    if path == 'asyncGet':
+        return response.status_code == 503
+    return response.json()['result']['status'] == 'in_progress'
+
+@pytest.mark.parametrize('path', ['asyncGet', 'asyncProbe'])
+def test_timeout(url, path):
+    """A poll gives up once its timeout passes, capped at max_poll_timeout."""
+    release.clear()
+    ID = tarp.client.client(url).lp_held().ID
+    try:
+        start = time.monotonic()
+        response = requests.get(f'{url}/{path}?UUID={ID}&timeout=0.3', timeout=10)
+        assert 0.25 < time.monotonic() - start < 5
+        assert still_running(path, response)
+        start = time.monotonic()
+        response = requests.get(f'{url}/{path}?UUID={ID}&timeout=100', timeout=10)
+        assert MAX_POLL_TIMEOUT - 0.05 < time.monotonic() - start < MAX_POLL_TIMEOUT + 5
+        assert still_running(path, response)
+    finally:
+        release.set()
+
+def test_without_timeout(url):
+    release.clear()
+    ID = tarp.client.client(url).lp_held().ID
+    try:
+        start = time.monotonic()
+        response = requests.get(f'{url}/asyncProbe?UUID={ID}', timeout=10)
+        assert time.monotonic() - start < 0.5
+        assert response.json()['result']['status'] == 'in_progress'
+    finally:
+        release.set()
@@ -0,0 +1,100 @@
+#   Copyright 2025 Chris Brady, Heather Ratcliffe
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+# Tests of the metrics served on /metrics
+import re
+
+import pytest
+import requests
+
+import tarp.client
+import tarp.server
+
+SAMPLE = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(\{(?:[a-zA-Z_][a-zA-Z0-9_]*="(?:[^"\\]|\\.)*",?)*\})? (\S+)$')
+
+def add(a, b):
+    return a + b
+
+def parse(text):
+    """Parses the Prometheus text format into {name: type} and a list of
+    (name, labels, value), checking each line as it goes."""
+    types = {}
+    samples = []
+    for line in text.splitlines():
+        if line.startswith('# TYPE '):
+            name, kind = line[7:].split()
+            assert kind in ('counter', 'gauge', 'histogram')
+            types[name] = kind
+        elif line.startswith('# HELP ') or not line:
+            continue
+        else:
+            match = SAMPLE.match(line)
+            assert match, line
+            name, labels, value = match.group(1), match.group(2) or '', float(match.group(3))
+            family = re.sub(r'_(bucket|sum|count)$', '', name) if name not in types else name
+            assert family in types, f'{name} has no TYPE'
+            samples.append((name, dict(re.findall(r'([a-zA-Z_]+)="([^"]*)"', labels)), value))
+    return types, samples
+
+@pytest.fixture(scope='module')
+def server_class():
+    sv = tarp.server.makeServer('metricsTestServer', multiThreaded=True)
+    sv.addRPCEndpoint('met_add', add)
+    return sv
+
+@pytest.fixture(scope='module')
+def url(start_server, server_class):
+    url = start_server(server_class)
+    client = tarp.client.client(url)
+    client.met_add(1, 2)
+    client.met_add(3, 4)
+    with pytest.raises(Exception):
+        client.met_add(1)
+    return url
+
+def test_prometheus_format(url):
+    response = requests.get(f'{url}/metrics')
+    assert response.headers['Content-Type'].startswith('text/plain; version=0.0.4')
+    types, samples = parse(response.text)
+    assert types['tarp_requests_total'] == 'counter'
+    assert types['tarp_request_phase_seconds'] == 'histogram'
+    labels = {'type': 'RPC', 'endpoint': 'met_add'}
+    assert ('tarp_requests_total', labels, 3.0) in samples
+    assert ('tarp_errors_total', dict(labels, error='500'), 1.0) in samples
+
+def test_histograms(url):
+    """Buckets are cumulative and the +Inf bucket equals the count."""
+    types, samples = parse(requests.get(f'{url}/metrics').text)
+    series = {}
+    for name, labels, value in samples:
+        if name == 'tarp_request_phase_seconds_bucket' and labels['endpoint'] == 'met_add':
+            series.setdefault(labels['phase'], []).append((labels['le'], value))
+    counts = {labels['phase']: value for name, labels, value in samples if name == 'tarp_request_phase_seconds_count' and labels['endpoint'] == 'met_add'}
+    assert 'execute' in series
+    for phase, buckets in series.items():
+        values = [value for le, value in buckets]
+        assert values == sorted(values)
+        assert buckets[-1] == ('+Inf', counts[phase])
+
+def test_json(url):
+    result = requests.get(f'{url}/metrics?format=json').json()['result']
+    endpoint = next(entry for entry in result['requests'] if entry['endpoint'] == 'met_add')
+    assert endpoint['type'] == 'RPC' and endpoint['count'] == 3
+    assert endpoint['errors'] == {'500': 1}
+    assert endpoint['phases']['execute']['buckets'][-1] == ['+Inf', endpoint['phases']['execute']['count']]
+
+def test_turned_off(start_server):
+    sv = tarp.server.makeServer('metricsOffTestServer', multiThreaded=True)
+    sv.request_metrics = None
+    assert requests.get(f'{start_server(sv)}/metrics').status_code == 404
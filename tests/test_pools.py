@@ -0,0 +1,127 @@
+#   Copyright 2025 Chris Brady, Heather Ratcliffe
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+# Tests of named worker pools and the endpoint options that choose them
+import concurrent.futures
+import os
+import threading
+import time
+
+import pytest
+
+import tarp.client
+import tarp.server
+from tarp.client import OperationInProgress
+
+state = {}
+release = threading.Event()
+
+def setup(value):
+    state['value'] = value
+
+def configured():
+    return state.get('value'), threading.current_thread().name
+
+def held():
+    release.wait(10)
+    return 'done'
+
+def pid():
+    return os.getpid()
+
+def web_pid(query, body):
+    return {'pid': os.getpid()}
+
+def total(array):
+    return array.sum(), array * 2
+
+def counted(n):
+    return iter(range(n))
+
+def streamed(query, body):
+    return body.read()
+
+@pytest.fixture(scope='module')
+def server_class():
+    sv = tarp.server.makeServer('poolsTestServer', multiThreaded=True)
+    sv.addPool('pool_configured', 'thread', max_workers=2, initializer=setup, initargs=('ready',))
+    sv.addPool('pool_tiny', 'thread', max_workers=1, max_queue=1)
+    sv.addRPCEndpoint('pool_configured', configured, pool='pool_configured')
+    sv.addRPCEndpoint('pool_unpooled', configured)
+    sv.addRPCEndpoint('pool_held', held, pool='pool_tiny')
+    sv.addPool('pool_processes', 'process', max_workers=1)
+    sv.addGetEndpoint('pool_get_pid', web_pid, pool='pool_processes')
+    sv.addPostEndpoint('pool_post_pid', web_pid, pool='pool_processes')
+    sv.addRPCEndpoint('pool_rpc_pid', pid, pool='pool_processes')
+    sv.addRPCEndpoint('pool_total', total, pool='pool_processes')
+    sv.addRPCEndpoint('pool_counted', counted, pool='pool_processes')
+    return sv
+
+@pytest.fixture(scope='module')
+def url(start_server, server_class):
+    return start_server(server_class)
+
+def test_runs_on_pool(url):
+    value, thread = tarp.client.client(url).pool_configured()
+    assert value == 'ready'
+    assert thread.startswith('tarp-pool_configured')
+    assert not tarp.client.client(url).pool_unpooled()[1].startswith('tarp-')
+
+def test_max_queue(url):
+    """Calls beyond max_queue waiting for a busy pool are refused."""
+    release.clear()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=3) as pool:
+        try:
+            calls = [pool.submit(tarp.client.client(url).pool_held)]
+            time.sleep(0.2)
+            calls.append(pool.submit(tarp.client.client(url).pool_held))
+            time.sleep(0.2)
+            with pytest.raises(OperationInProgress):
+                tarp.client.client(url).pool_held()
+        finally:
+            release.set()
+        assert [call.result() for call in calls] == ['done', 'done']
+
+def test_undeclared_pool(server_class):
+    with pytest.raises(ValueError):
+        server_class.addRPCEndpoint('pool_missing', configured, pool='pool_undeclared')
+
+def test_unknown_option(server_class):
+    with pytest.raises(TypeError):
+        server_class.addRPCEndpoint('pool_bad_option', configured, stream_body=True)
+    with pytest.raises(TypeError):
+        server_class.addAsyncRPCEndpoint('pool_bad_option', configured, cache=True)
+
+def test_process_pool(url):
+    """GET, POST and RPC callbacks on a process pool run outside the server's process."""
+    client = tarp.client.client(url)
+    pids = {client.pool_get_pid()[1]['pid'], client.pool_post_pid({})[1]['pid'], client.pool_rpc_pid()}
+    assert len(pids) == 1
+    assert os.getpid() not in pids
+
+def test_process_pool_arrays(url):
+    """Large arrays go to and from the process through shared memory."""
+    numpy = pytest.importorskip('numpy')
+    array = numpy.arange(1000000, dtype=numpy.float64)
+    result, doubled = tarp.client.client(url).pool_total(array)
+    assert result == array.sum()
+    numpy.testing.assert_array_equal(doubled, array * 2)
+
+def test_process_pool_iterator(url):
+    """Iterators returned on a process pool are turned into lists."""
+    assert list(tarp.client.client(url).pool_counted(3)) == [0, 1, 2]
+
+def test_stream_body_on_process_pool(server_class):
+    with pytest.raises(ValueError):
+        server_class.addPostEndpoint('pool_streamed', streamed, stream_body=True, pool='pool_processes')
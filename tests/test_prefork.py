@@ -0,0 +1,143 @@
+#   Copyright 2025 Chris Brady, Heather Ratcliffe
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+# Tests of runServer with worker processes. The server forks, so it is run in a
+# subprocess, and requests are sent to the private socket of each worker so that
+# the tests decide which worker handles them
+import concurrent.futures
+import glob
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+
+import pytest
+
+import tarp.client
+from tarp import prefork
+
+MAX_WORKERS = 2
+
+SERVER = '''
+import os, sys, tempfile, time
+sys.path.insert(0, {root!r})
+#The workers' private sockets are made in a directory under here
+tempfile.tempdir = {directory!r}
+import tarp.server
+
+def ping():
+    return 'pong'
+
+def held():
+    while not os.path.exists({release!r}):
+        time.sleep(0.02)
+    return 'done'
+
+sv = tarp.server.makeServer('preforkTestServer', multiThreaded=True)
+sv.addRPCEndpoint('pf_ping', ping)
+sv.addAsyncRPCEndpoint('pf_held', held, suggested_wait=1)
+sv.addAsyncRPCEndpoint('pf_big', lambda n: list(range(n)), suggested_wait=0.1)
+tarp.server.runServer(sv, unix_socket={socket!r}, workers=2, engine={engine!r}, max_workers={max_workers}, drain_timeout=1)
+'''
+
+def worker_client(path, **kwargs):
+    return tarp.client.client(f'unix://{path}', **kwargs)
+
+@pytest.fixture(params=['threaded', 'asyncio'])
+def workers(request, tmp_path):
+    """Runs a server with two worker processes and returns the paths of their
+    private sockets and of the file that releases the pf_held jobs."""
+    release = str(tmp_path / 'release')
+    script = SERVER.format(root=os.path.dirname(os.path.dirname(os.path.abspath(__file__))), directory=str(tmp_path), release=release,
+                           socket=str(tmp_path / 'tarp.sock'), engine=request.param, max_workers=MAX_WORKERS)
+    process = subprocess.Popen([sys.executable, '-c', script], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        for _ in range(200):
+            paths = sorted(glob.glob(str(tmp_path / 'tarp-workers-*' / 'worker-*.sock')))
+            if len(paths) == 2:
+                try:
+                    for path in paths:
+                        worker_client(path)
+                    break
+                except Exception:
+                    pass
+            time.sleep(0.05)
+        else:
+            raise RuntimeError('Worker processes did not start')
+        yield paths, release
+    finally:
+        open(release, 'w').close()
+        process.send_signal(signal.SIGTERM)
+        try:
+            process.wait(10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+def get(path, url, timeout=30):
+    connection = prefork.workerConnection(path, timeout=timeout)
+    try:
+        connection.request('GET', url)
+        response = connection.getresponse()
+        return response.status, json.loads(response.read())
+    finally:
+        connection.close()
+
+def test_job_ids_name_their_worker(workers):
+    paths, release = workers
+    for index, path in enumerate(paths):
+        assert prefork.job_owner(worker_client(path).pf_held().ID) == index
+
+def test_requests_reach_the_job_owner(workers):
+    """A request about a job that reaches another worker is passed on to its owner."""
+    (first, second), release = workers
+    ID = worker_client(second).pf_held().ID
+    status, body = get(first, f'/asyncProbe?UUID={ID}')
+    assert status == 200 and body['result']['status'] == 'in_progress'
+    open(release, 'w').close()
+    status, body = get(first, f'/asyncProbe?UUID={ID}&timeout=10')
+    assert body['result']['status'] == 'completed'
+    assert worker_client(first, binary=False).wait(ID) == 'done'
+
+@pytest.mark.parametrize('binary', [True, False])
+def test_large_results_are_passed_on(workers, binary):
+    """Large results, which are sent in chunks as JSON, come through intact."""
+    (first, second), release = workers
+    ID = worker_client(second).pf_big(500000).ID
+    client = worker_client(first, binary=binary)
+    assert client.wait(ID) == list(range(500000))
+    #The connection can still be used afterwards
+    assert client.pf_ping() == 'pong'
+
+def test_unknown_worker(workers):
+    (first, second), release = workers
+    assert get(first, '/asyncProbe?UUID=missing.7')[0] == 404
+
+def test_remote_long_polls_do_not_hold_pool_threads(workers, request):
+    """Long polls that are passed on to another worker must not use up the pool
+    threads of the worker they reached. The threaded engine has no such pool."""
+    (first, second), release = workers
+    IDs = [worker_client(second).pf_held().ID for _ in range(MAX_WORKERS + 3)]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(IDs)) as pool:
+        polls = [pool.submit(get, first, f'/asyncGet?UUID={ID}&timeout=20') for ID in IDs]
+        time.sleep(0.5)
+        try:
+            assert worker_client(first, timeout=5).pf_ping() == 'pong'
+            assert not any(poll.done() for poll in polls)
+        finally:
+            open(release, 'w').close()
+        for poll in polls:
+            assert poll.result()[0] == 200
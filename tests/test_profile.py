@@ -0,0 +1,78 @@
+#   Copyright 2025 Chris Brady, Heather Ratcliffe
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+# Tests of on-demand profiling through /profile
+import pstats
+import time
+
+import pytest
+import requests
+
+import tarp.client
+import tarp.server
+
+TOKEN = 'test-admin-token'
+AUTH = {'Authorization': f'Bearer {TOKEN}'}
+
+def busy_function(seconds):
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        pass
+    return seconds
+
+@pytest.fixture(scope='module')
+def url(start_server):
+    sv = tarp.server.makeServer('profileTestServer', multiThreaded=True)
+    sv.admin_token = TOKEN
+    sv.addRPCEndpoint('prof_busy', busy_function)
+    return start_server(sv)
+
+def test_turned_off(start_server):
+    sv = tarp.server.makeServer('profileOffTestServer', multiThreaded=True)
+    assert requests.get(f'{start_server(sv)}/profile', headers=AUTH).status_code == 404
+
+def test_needs_token(url):
+    assert requests.get(f'{url}/profile').status_code == 403
+    assert requests.get(f'{url}/profile', headers={'Authorization': 'Bearer wrong'}).status_code == 403
+    assert requests.get(f'{url}/profile', headers={'Authorization': TOKEN}).status_code == 403
+
+def test_bad_requests(url):
+    assert requests.get(f'{url}/profile?endpoint=prof_missing', headers=AUTH).status_code == 404
+    assert requests.get(f'{url}/profile?action=explode', headers=AUTH).status_code == 400
+
+def test_cprofile(url, tmp_path):
+    response = requests.get(f'{url}/profile?endpoint=prof_busy&requests=2', headers=AUTH)
+    assert response.json()['result']['status'] == 'running'
+    client = tarp.client.client(url)
+    for _ in range(2):
+        client.prof_busy(0.01)
+    status = requests.get(f'{url}/profile?action=status', headers=AUTH).json()['result']
+    assert status['status'] == 'finished' and status['profiled'] == 2
+    response = requests.get(f'{url}/profile?action=result', headers=AUTH)
+    assert 'tarp-prof_busy.pstats' in response.headers['Content-Disposition']
+    path = tmp_path / 'profile.pstats'
+    path.write_bytes(response.content)
+    stats = pstats.Stats(str(path))
+    assert any(function == 'busy_function' for filename, line, function in stats.stats)
+
+def test_sample(url):
+    requests.get(f'{url}/profile?endpoint=prof_busy&mode=sample&seconds=30', headers=AUTH)
+    tarp.client.client(url).prof_busy(0.2)
+    status = requests.get(f'{url}/profile?action=stop', headers=AUTH).json()['result']
+    assert status['status'] == 'finished'
+    stacks = requests.get(f'{url}/profile?action=result', headers=AUTH).text
+    assert 'busy_function' in stacks
+    for line in stacks.splitlines():
+        stack, count = line.rsplit(' ', 1)
+        assert int(count) > 0
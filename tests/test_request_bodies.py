@@ -0,0 +1,95 @@
+#   Copyright 2025 Chris Brady, Heather Ratcliffe
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+# Tests of body size limits, spooling of large bodies and streamed bodies
+import hashlib
+import mmap
+
+import pytest
+import requests
+
+import tarp.client
+import tarp.server
+
+SPOOL_THRESHOLD = 64 * 1024
+OCTETS = {'Content-Type': 'application/octet-stream'}
+
+def describe(query, body):
+    return {'type': type(body).__name__, 'size': len(body), 'sha': hashlib.sha256(body).hexdigest()}
+
+def streamed(query, body):
+    digest = hashlib.sha256()
+    while True:
+        data = body.read(10000)
+        if not data:
+            break
+        digest.update(data)
+    return {'type': type(body).__name__, 'length': body.length, 'sha': digest.hexdigest()}
+
+def partly_read(query, body):
+    return {'first': body.read(4).decode()}
+
+def size(data):
+    return len(data)
+
+@pytest.fixture(scope='module')
+def url(start_server):
+    sv = tarp.server.makeServer('bodiesTestServer', multiThreaded=True)
+    sv.spool_threshold = SPOOL_THRESHOLD
+    sv.max_body_size = 4 * 1024 * 1024
+    sv.addPostEndpoint('body_describe', describe, max_body_size=1024 * 1024)
+    sv.addPostEndpoint('body_default_limit', describe)
+    sv.addPostEndpoint('body_streamed', streamed, stream_body=True)
+    sv.addPostEndpoint('body_partly_read', partly_read, stream_body=True)
+    sv.addRPCEndpoint('body_size', size, max_body_size=1024 * 1024)
+    return start_server(sv)
+
+def test_small_body_in_memory(url):
+    body = b'a' * 1000
+    result = requests.post(f'{url}/body_describe', data=body, headers=OCTETS).json()['result']
+    assert result == {'type': 'bytes', 'size': 1000, 'sha': hashlib.sha256(body).hexdigest()}
+
+def test_large_body_spooled(url):
+    """Bodies over spool_threshold reach the endpoint as an mmap of a temporary file."""
+    body = bytes(range(256)) * 1000
+    result = requests.post(f'{url}/body_describe', data=body, headers=OCTETS).json()['result']
+    assert result == {'type': mmap.mmap.__name__, 'size': len(body), 'sha': hashlib.sha256(body).hexdigest()}
+
+def test_endpoint_limit(url):
+    response = requests.post(f'{url}/body_describe', data=bytes(1024 * 1024 + 1), headers=OCTETS)
+    assert response.status_code == 413
+    #The server closes the connection rather than reading the body, and is fine afterwards
+    assert requests.post(f'{url}/body_describe', data=b'ok', headers=OCTETS).status_code == 200
+
+def test_server_limit(url):
+    assert requests.post(f'{url}/body_default_limit', data=bytes(4 * 1024 * 1024 + 1), headers=OCTETS).status_code == 413
+    assert requests.post(f'{url}/body_default_limit', data=bytes(2 * 1024 * 1024), headers=OCTETS).status_code == 200
+
+def test_rpc_limit(url):
+    client = tarp.client.client(url)
+    assert client.body_size(b'x' * 1000) == 1000
+    with pytest.raises(Exception):
+        client.body_size(b'x' * (2 * 1024 * 1024))
+
+def test_streamed_body(url):
+    body = bytes(range(256)) * 4000
+    result = requests.post(f'{url}/body_streamed', data=body, headers=OCTETS).json()['result']
+    assert result == {'type': 'requestBody', 'length': len(body), 'sha': hashlib.sha256(body).hexdigest()}
+
+def test_unread_body_is_discarded(url):
+    """Whatever a streaming endpoint leaves unread does not corrupt the next request."""
+    with requests.Session() as session:
+        response = session.post(f'{url}/body_partly_read', data=b'abcd' + bytes(500000), headers=OCTETS)
+        assert response.json()['result'] == {'first': 'abcd'}
+        assert session.post(f'{url}/body_describe', data=b'next', headers=OCTETS).json()['result']['size'] == 4
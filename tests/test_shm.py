@@ -0,0 +1,132 @@
+#   Copyright 2025 Chris Brady, Heather Ratcliffe
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+# Tests of passing large RPC arguments and results through shared memory files
+import mmap
+import os
+import pickle
+import time
+
+import pytest
+import requests
+
+numpy = pytest.importorskip('numpy')
+
+import tarp.client
+import tarp.server
+from tarp import shm
+
+THRESHOLD = 64 * 1024
+TTL = 0.5
+
+def in_shared_memory(array):
+    """True if an array's memory is a mapped file."""
+    while isinstance(array, numpy.ndarray) and array.base is not None:
+        array = array.base
+    return isinstance(array, memoryview) and isinstance(array.obj, mmap.mmap)
+
+def double(array):
+    return array * 2, in_shared_memory(array)
+
+def fail(array):
+    raise ValueError('failed on purpose')
+
+@pytest.fixture(scope='module')
+def directory(tmp_path_factory):
+    return str(tmp_path_factory.mktemp('shm'))
+
+@pytest.fixture(scope='module')
+def url(start_server, directory):
+    sv = tarp.server.makeServer('shmTestServer', multiThreaded=True)
+    sv.shm_transport = True
+    sv.shm_directory = directory
+    sv.shm_threshold = THRESHOLD
+    sv.shm_ttl = TTL
+    sv.addRPCEndpoint('shm_double', double)
+    sv.addAsyncRPCEndpoint('shm_async_double', double, suggested_wait=0.05)
+    sv.addRPCEndpoint('shm_fail', fail)
+    return start_server(sv)
+
+def wait_until_empty(directory, timeout=5):
+    deadline = time.monotonic() + timeout
+    while os.listdir(directory) and time.monotonic() < deadline:
+        time.sleep(0.05)
+    return os.listdir(directory)
+
+def test_manifest(url, directory):
+    info = tarp.client.client(url).sharedMemory
+    assert info is not None
+    assert os.path.realpath(info['directory']) == os.path.realpath(directory)
+    assert info['threshold'] == THRESHOLD
+    assert tarp.client.client(url, shared_memory=False).sharedMemory is None
+
+def test_rpc(url, directory):
+    array = numpy.arange(100000, dtype=numpy.float64)
+    result, received_in_shm = tarp.client.client(url).shm_double(array)
+    assert received_in_shm
+    assert in_shared_memory(result)
+    numpy.testing.assert_array_equal(result, array * 2)
+    assert wait_until_empty(directory) == []
+
+def test_async_rpc(url, directory):
+    array = numpy.arange(100000, dtype=numpy.int64)
+    result, received_in_shm = tarp.client.client(url).shm_async_double(array).wait()
+    assert received_in_shm
+    numpy.testing.assert_array_equal(result, array * 2)
+    assert wait_until_empty(directory) == []
+
+def test_small_arguments(url, directory):
+    array = numpy.arange(10)
+    result, received_in_shm = tarp.client.client(url).shm_double(array)
+    assert not received_in_shm
+    numpy.testing.assert_array_equal(result, array * 2)
+    assert os.listdir(directory) == []
+
+def test_turned_off(url, directory):
+    array = numpy.arange(100000, dtype=numpy.float64)
+    result, received_in_shm = tarp.client.client(url, shared_memory=False).shm_double(array)
+    assert not received_in_shm
+    numpy.testing.assert_array_equal(result, array * 2)
+
+def test_error(url, directory):
+    with pytest.raises(Exception, match='failed on purpose'):
+        tarp.client.client(url).shm_fail(numpy.zeros(100000))
+    assert wait_until_empty(directory) == []
+
+def post(url, packed):
+    return requests.post(f'{url}/shm_double', data=shm.dumps(packed),
+                         headers={'Content-Type': shm.SHM_MIMETYPE, 'Accept': shm.SHM_MIMETYPE})
+
+def test_result_not_taken(url, directory):
+    """The files of a result that the client never maps are removed after shm_ttl."""
+    packed = shm.pack(((numpy.ones(100000),), {}), THRESHOLD, directory)
+    response = post(url, packed)
+    assert response.status_code == 200
+    assert response.headers['Content-Type'] == shm.SHM_MIMETYPE
+    paths = [frame[0] for frame in pickle.loads(response.content) if isinstance(frame, tuple)]
+    assert paths and all(os.path.exists(path) for path in paths)
+    #The server took the files of the arguments when it read them
+    assert not any(os.path.exists(frame.path) for frame in packed if isinstance(frame, shm.segment))
+    time.sleep(TTL + 0.5)
+    assert wait_until_empty(directory) == []
+
+def test_file_outside_directory(url, tmp_path):
+    """The server refuses files that are not in its directory and leaves them alone."""
+    packed = shm.pack(((numpy.ones(100000),), {}), THRESHOLD, str(tmp_path))
+    try:
+        response = post(url, packed)
+        assert response.status_code == 400
+        assert all(os.path.exists(frame.path) for frame in packed if isinstance(frame, shm.segment))
+    finally:
+        shm.release(packed)
@@ -0,0 +1,81 @@
+#   Copyright 2025 Chris Brady, Heather Ratcliffe
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+# Tests of endpoints that stream their results as they produce them
+import json
+
+import pytest
+import requests
+
+import tarp.client
+import tarp.server
+from tarp import wire
+
+def lines(query, body):
+    for i in range(int(query.get('n', 3))):
+        yield {'i': i}
+
+def broken_lines(query, body):
+    yield {'i': 0}
+    raise ValueError('stream failed')
+
+def items(n):
+    for i in range(n):
+        yield [i] * i
+
+def broken_items():
+    yield 1
+    raise ValueError('stream failed')
+
+@pytest.fixture(scope='module')
+def url(start_server):
+    sv = tarp.server.makeServer('streamingTestServer', multiThreaded=True)
+    sv.addGetEndpoint('str_lines', lines)
+    sv.addGetEndpoint('str_broken_lines', broken_lines)
+    sv.addRPCEndpoint('str_items', items)
+    sv.addRPCEndpoint('str_broken_items', broken_items)
+    return start_server(sv)
+
+def test_ndjson(url):
+    response = requests.get(f'{url}/str_lines?n=5', stream=True)
+    assert response.headers['Content-Type'] == wire.NDJSON_MIMETYPE
+    assert response.headers['Transfer-Encoding'] == 'chunked'
+    assert [json.loads(line) for line in response.iter_lines()] == [{'i': i} for i in range(5)]
+
+def test_ndjson_client(url):
+    mimetype, iterator = tarp.client.client(url).str_lines(n=4)
+    assert mimetype == wire.NDJSON_MIMETYPE
+    assert list(iterator) == [{'i': i} for i in range(4)]
+
+def test_ndjson_failure(url):
+    """A web stream that fails part way through is cut off."""
+    mimetype, iterator = tarp.client.client(url).str_broken_lines()
+    with pytest.raises(Exception):
+        list(iterator)
+
+def test_pickle_stream(url):
+    client = tarp.client.client(url)
+    assert list(client.str_items(4)) == [[], [1], [2, 2], [3, 3, 3]]
+    #The connection can be used again once the stream has been read
+    assert list(client.str_items(2)) == [[], [1]]
+
+def test_pickle_stream_failure(url):
+    iterator = iter(tarp.client.client(url).str_broken_items())
+    assert next(iterator) == 1
+    with pytest.raises(Exception, match='stream failed'):
+        next(iterator)
+
+def test_json_wire_format(url):
+    """Clients using the JSON wire format get a streamed result as a list."""
+    assert tarp.client.client(url, binary=False).str_items(3) == [[], [1], [2, 2]]
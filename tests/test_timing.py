@@ -0,0 +1,59 @@
+#   Copyright 2025 Chris Brady, Heather Ratcliffe
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+# Tests of the Server-Timing header and the client's timing of calls
+import time
+
+import pytest
+import requests
+
+import tarp.client
+import tarp.server
+from tarp import metrics
+
+def slow(seconds):
+    time.sleep(seconds)
+    return seconds
+
+@pytest.fixture(scope='module')
+def url(start_server):
+    sv = tarp.server.makeServer('timingTestServer', multiThreaded=True)
+    sv.addRPCEndpoint('tim_slow', slow)
+    return start_server(sv)
+
+def test_parse_server_timing():
+    assert metrics.parse_server_timing('parse;dur=0.1, execute;dur=20, total;dur=20.5') == {'parse': 0.0001, 'execute': 0.02, 'total': 0.0205}
+    assert metrics.parse_server_timing(None) == {}
+
+def test_server_timing_header(url):
+    response = requests.get(f'{url}/')
+    phases = metrics.parse_server_timing(response.headers['Server-Timing'])
+    assert 'total' in phases
+
+def test_client_timing(url):
+    timings = []
+    client = tarp.client.client(url, timing_hook=timings.append)
+    client.tim_slow(0.2)
+    timing = client.lastTiming
+    assert timings[-1] is timing
+    assert timing['call'] == 'tim_slow'
+    assert set(timing['client']) <= set(tarp.client.CLIENT_PHASES)
+    assert timing['server']['execute'] >= 0.2
+    assert timing['client']['wait'] >= timing['server']['execute']
+    assert timing['total'] >= timing['client']['wait']
+
+def test_timing_off(url):
+    client = tarp.client.client(url, timing=False)
+    client.tim_slow(0)
+    assert client.lastTiming is None
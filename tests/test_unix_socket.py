@@ -0,0 +1,155 @@
+#   Copyright 2025 Chris Brady, Heather Ratcliffe
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+# Tests of runServer on a Unix domain socket and of unix:// client URLs
+import asyncio
+import os
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+import tarp.aclient
+import tarp.client
+import tarp.server
+from conftest import free_port, wait_for_server
+
+pytestmark = pytest.mark.skipif(not hasattr(socket, 'AF_UNIX'), reason='needs Unix domain sockets')
+
+SERVER = '''
+import sys
+sys.path.insert(0, {root!r})
+import tarp.server
+
+sv = tarp.server.makeServer('unixStopTestServer', multiThreaded=True)
+sv.addRPCEndpoint('us_ping', lambda: 'pong')
+try:
+    tarp.server.runServer(sv, unix_socket={socket!r}, engine={engine!r})
+except KeyboardInterrupt:
+    pass
+'''
+
+def ping():
+    return 'pong'
+
+def get(query, body):
+    return {'query': query}
+
+def post(query, body):
+    return {'size': len(body)}
+
+def make_server():
+    sv = tarp.server.makeServer('unixTestServer', multiThreaded=True)
+    sv.addRPCEndpoint('us_ping', ping)
+    sv.addAsyncRPCEndpoint('us_async_ping', ping, suggested_wait=0.05)
+    sv.addGetEndpoint('us_get', get)
+    sv.addPostEndpoint('us_post', post)
+    return sv
+
+def wait_for_socket(path, timeout=5):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            return tarp.client.client(f'unix://{path}')
+        except Exception:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.05)
+
+def start(path, **kwargs):
+    """Runs a server on the Unix socket path in a daemon thread and returns a client for it."""
+    threading.Thread(target=tarp.server.runServer, args=(make_server(),), kwargs={'unix_socket': path, **kwargs}, daemon=True).start()
+    return wait_for_socket(path)
+
+@pytest.fixture(scope='module', params=['threaded', 'asyncio'])
+def engine(request):
+    return request.param
+
+@pytest.fixture(scope='module')
+def path(tmp_path_factory, engine):
+    path = str(tmp_path_factory.mktemp('unix') / 'tarp.sock')
+    start(path, engine=engine)
+    return path
+
+def test_endpoints(path):
+    client = tarp.client.client(f'unix://{path}')
+    assert client.us_ping() == 'pong'
+    assert client.us_async_ping().wait() == 'pong'
+    assert client.us_get(a='1')[1] == {'query': {'a': '1'}}
+    assert client.us_post(b'x' * 100000)[1] == {'size': 100000}
+
+def test_keep_alive(path):
+    client = tarp.client.client(f'unix://{path}', max_connections=2)
+    for _ in range(20):
+        assert client.us_ping() == 'pong'
+
+def test_already_listening(path):
+    """A second server refuses to take over the socket of one that is still running."""
+    with pytest.raises(OSError, match='already listening'):
+        tarp.server.runServer(make_server(), unix_socket=path)
+    assert tarp.client.client(f'unix://{path}').us_ping() == 'pong'
+
+def test_stale_socket(tmp_path, engine):
+    """A socket file left behind by a server that has gone is replaced."""
+    path = str(tmp_path / 'stale.sock')
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.bind(path)
+    assert os.path.exists(path)
+    assert start(path, engine=engine).us_ping() == 'pong'
+
+def test_not_a_socket(tmp_path):
+    path = tmp_path / 'file.sock'
+    path.write_text('not a socket')
+    with pytest.raises(OSError, match='not a socket'):
+        tarp.server.runServer(make_server(), unix_socket=str(path))
+    assert path.read_text() == 'not a socket'
+
+def test_tcp_as_well(tmp_path, engine):
+    port = free_port()
+    path = str(tmp_path / 'both.sock')
+    assert start(path, engine=engine, port=port, bindTo='127.0.0.1').us_ping() == 'pong'
+    wait_for_server(f'http://127.0.0.1:{port}')
+    assert tarp.client.client(f'http://127.0.0.1:{port}').us_ping() == 'pong'
+
+def test_plain_requests(path):
+    """Requests made through the client's session reach the server as plain HTTP."""
+    client = tarp.client.client(f'unix://{path}')
+    response = client.session.get(f'{client.server_url}/us_get?b=2')
+    assert response.status_code == 200
+    assert response.json()['result'] == {'query': {'b': '2'}}
+
+def test_asyncio_client(path):
+    pytest.importorskip('aiohttp')
+    async def main():
+        async with tarp.aclient.client(f'unix://{path}') as client:
+            return await asyncio.gather(client.us_ping(), client.us_ping())
+    assert asyncio.run(main()) == ['pong', 'pong']
+
+def test_removed_at_stop(tmp_path, engine):
+    path = str(tmp_path / 'stop.sock')
+    script = SERVER.format(root=os.path.dirname(os.path.dirname(os.path.abspath(__file__))), socket=path, engine=engine)
+    process = subprocess.Popen([sys.executable, '-c', script], stdout=subprocess.DEVNULL)
+    try:
+        assert wait_for_socket(path).us_ping() == 'pong'
+        process.send_signal(signal.SIGINT)
+        assert process.wait(10) == 0
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+    assert not os.path.exists(path)
@@ -0,0 +1,120 @@
+#   Copyright 2025 Chris Brady, Heather Ratcliffe
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+# Tests of the framed binary wire format for RPC calls
+import io
+import struct
+
+import pytest
+import requests
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import tarp.client
+import tarp.server
+from tarp import wire
+
+needs_numpy = pytest.mark.skipif(numpy is None, reason='needs numpy')
+
+def echo(*args, **kwargs):
+    return args, kwargs
+
+def double(array):
+    array *= 2
+    return array
+
+@pytest.fixture(scope='module')
+def url(start_server):
+    sv = tarp.server.makeServer('wireTestServer', multiThreaded=True)
+    sv.addRPCEndpoint('wire_echo', echo)
+    sv.addRPCEndpoint('wire_double', double)
+    return start_server(sv)
+
+def test_round_trip():
+    value = {'a': [1, 2.5, 'three'], 'b': b'bytes', 'c': (None, True)}
+    body = bytes(wire.dumps(value))
+    assert body[:4] == wire.MAGIC
+    assert wire.loads(body) == value
+    assert wire.load_frames(wire.read_frames(io.BytesIO(body).readinto, len(body))) == value
+
+@pytest.mark.parametrize('binary', [True, False])
+def test_rpc_call(url, binary):
+    client = tarp.client.client(url, binary=binary)
+    assert client.wire_echo(1, [2, 3], key='value') == ((1, [2, 3]), {'key': 'value'})
+
+def test_truncated_body():
+    body = bytes(wire.dumps([1, 2, 3]))
+    with pytest.raises(ValueError):
+        wire.loads(body[:-1])
+    with pytest.raises(EOFError):
+        wire.read_frames(io.BytesIO(body[:-1]).readinto)
+
+def test_bad_magic():
+    with pytest.raises(ValueError):
+        wire.read_frames(io.BytesIO(b'JUNK' + bytes(8)).readinto)
+
+def test_frame_count_checked_before_allocation():
+    """A frame count that cannot fit in the Content-Length is refused without
+    allocating anything for it."""
+    body = struct.pack('<4sI', wire.MAGIC, 0xFFFFFFFF) + bytes(4)
+    with pytest.raises(ValueError):
+        wire.read_frames(io.BytesIO(body).readinto, len(body))
+    with pytest.raises(ValueError):
+        wire.loads(body)
+
+def test_frame_count_without_length():
+    """Without a Content-Length the frame lengths are read as they arrive, so a
+    huge count only fails when the body runs out."""
+    body = struct.pack('<4sI', wire.MAGIC, 0xFFFFFFFF) + bytes(64)
+    with pytest.raises(EOFError):
+        wire.read_frames(io.BytesIO(body).readinto)
+
+def test_malformed_request(url):
+    body = struct.pack('<4sI', wire.MAGIC, 0xFFFFFFFF) + bytes(4)
+    response = requests.post(f'{url}/wire_echo', data=body, headers={'Content-Type': wire.PICKLE_MIMETYPE})
+    assert response.status_code == 400
+    assert 'Malformed RPC body' in response.json()['message']
+    #The server is still fine afterwards
+    assert tarp.client.client(url).wire_echo(1) == ((1,), {})
+
+@needs_numpy
+def test_arrays_out_of_band():
+    """Contiguous arrays are sent as frames of their own, not copied into the pickle."""
+    array = numpy.arange(100000, dtype=numpy.float64)
+    frames = wire.dump_frames({'a': array, 'b': b'small'})
+    assert len(frames) == 2
+    assert len(frames[0]) < 1000
+    assert frames[1].nbytes == array.nbytes
+    body = bytes(wire.dumps(array))
+    received = wire.load_frames(wire.read_frames(io.BytesIO(body).readinto, len(body)))
+    numpy.testing.assert_array_equal(received, array)
+    #The received array uses the buffer it was read into and is writable
+    received[0] = -1
+
+@needs_numpy
+def test_non_contiguous_arrays():
+    array = numpy.arange(100).reshape(10, 10)[:, ::2]
+    frames = wire.dump_frames(array)
+    assert len(frames) == 1
+    numpy.testing.assert_array_equal(wire.loads(bytes(wire.dumps(array))), array)
+
+@needs_numpy
+@pytest.mark.parametrize('binary', [True, False])
+def test_rpc_arrays(url, binary):
+    array = numpy.arange(1000000, dtype=numpy.int32)
+    result = tarp.client.client(url, binary=binary).wire_double(array)
+    numpy.testing.assert_array_equal(result, numpy.arange(1000000, dtype=numpy.int32) * 2)